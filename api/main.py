@@ -21,6 +21,7 @@ logger = logging.getLogger(__name__)
 # Global service instances (will be initialized on startup)
 from api.services.graph_service import GraphService
 from api.services.query_service import QueryService
+from hypergraphrag.llm import close_http_clients
 
 graph_service = GraphService()
 query_service = QueryService()
@@ -52,6 +53,7 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down HyperGraphRAG Visualization API...")
+    await close_http_clients()
 
 
 # Create FastAPI application
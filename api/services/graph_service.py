@@ -32,7 +32,7 @@ class GraphService:
         This loads all data from the working directory:
         - vdb_entities.json -> entity vectors
         - vdb_hyperedges.json -> hyperedge vectors
-        - graph_chunk_entity_relation.graphml -> graph structure
+        - graph_chunk_entity_relation.npz (or legacy .graphml) -> graph structure
         - kv_store_text_chunks.json -> text chunks
         
         Args:
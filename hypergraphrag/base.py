@@ -1,5 +1,6 @@
+import asyncio
 from dataclasses import dataclass, field
-from typing import TypedDict, Union, Literal, Generic, TypeVar
+from typing import Callable, TypedDict, Union, Literal, Generic, TypeVar
 
 import numpy as np
 
@@ -10,9 +11,29 @@ TextChunkSchema = TypedDict(
     {"tokens": int, "content": str, "full_doc_id": str, "chunk_order_index": int},
 )
 
+EntityContextRow = TypedDict(
+    "EntityContextRow", {"entity": str, "type": str, "description": str}
+)
+RelationContextRow = TypedDict(
+    "RelationContextRow", {"hyperedge": str, "related_entities": str}
+)
+SourceContextRow = TypedDict("SourceContextRow", {"id": str, "content": str})
+
 T = TypeVar("T")
 
 
+@dataclass
+class QueryContext:
+    """Rows retrieved for a query, rendered into prompt text only at the end"""
+
+    entities: list[EntityContextRow] = field(default_factory=list)
+    relations: list[RelationContextRow] = field(default_factory=list)
+    sources: list[SourceContextRow] = field(default_factory=list)
+
+    def is_empty(self) -> bool:
+        return not (self.entities or self.relations or self.sources)
+
+
 @dataclass
 class QueryParam:
     mode: Literal["local", "global", "hybrid", "naive"] = "hybrid"
@@ -30,6 +51,9 @@ class QueryParam:
     max_token_for_global_context: int = 4000
     # Number of tokens for the entity descriptions
     max_token_for_local_context: int = 4000
+    # How the retrieved context is rendered: "csv", "json", "compact", or a
+    # callable taking a QueryContext and returning the prompt text
+    context_format: Union[str, Callable[[QueryContext], str]] = "csv"
 
 
 @dataclass
@@ -54,6 +78,32 @@ class BaseVectorStorage(StorageNameSpace):
     async def query(self, query: str, top_k: int) -> list[dict]:
         raise NotImplementedError
 
+    async def query_batch(self, queries: list[str], top_k: int) -> list[list[dict]]:
+        """Search several queries at once, returning one result list per query.
+        Falls back to one `query` call per string for backends without bulk search.
+        """
+        return list(await asyncio.gather(*[self.query(q, top_k=top_k) for q in queries]))
+
+    async def query_embeddings(
+        self, embeddings: np.ndarray, top_k: int
+    ) -> list[list[dict]]:
+        """Search already embedded queries, one result list per row.
+        Lets callers embed queries for several stores in a single call; backends
+        that can only search by text raise NotImplementedError.
+        """
+        raise NotImplementedError
+
+    async def _embed_queries(self, queries: list[str]) -> np.ndarray:
+        """Embed queries in `embedding_batch_num` sized batches, keeping order"""
+        batch_size = self.global_config.get("embedding_batch_num") or len(queries)
+        embeddings_list = await asyncio.gather(
+            *[
+                self.embedding_func(queries[i : i + batch_size])
+                for i in range(0, len(queries), batch_size)
+            ]
+        )
+        return np.concatenate(embeddings_list)
+
     async def upsert(self, data: dict[str, dict]):
         """Use 'content' field from value for embedding, use key as id.
         If embedding_func is None, use 'embedding' field from value
@@ -64,6 +114,8 @@ class BaseVectorStorage(StorageNameSpace):
 @dataclass
 class BaseKVStorage(Generic[T], StorageNameSpace):
     embedding_func: EmbeddingFunc
+    # namespaces the backend has a schema for; None means any namespace
+    supported_namespaces = None
 
     async def all_keys(self) -> list[str]:
         raise NotImplementedError
@@ -83,6 +135,9 @@ class BaseKVStorage(Generic[T], StorageNameSpace):
     async def upsert(self, data: dict[str, T]):
         raise NotImplementedError
 
+    async def delete(self, ids: list[str]):
+        raise NotImplementedError
+
     async def drop(self):
         raise NotImplementedError
 
@@ -116,6 +171,33 @@ class BaseGraphStorage(StorageNameSpace):
     ) -> Union[list[tuple[str, str]], None]:
         raise NotImplementedError
 
+    async def get_nodes_batch(self, node_ids: list[str]) -> list[Union[dict, None]]:
+        """Bulk `get_node`, results aligned with `node_ids`.
+        Backends that can answer in one round-trip should override the *_batch methods.
+        """
+        return list(await asyncio.gather(*[self.get_node(n) for n in node_ids]))
+
+    async def node_degrees_batch(self, node_ids: list[str]) -> list[int]:
+        return list(await asyncio.gather(*[self.node_degree(n) for n in node_ids]))
+
+    async def get_edges_batch(
+        self, edge_pairs: list[tuple[str, str]]
+    ) -> list[Union[dict, None]]:
+        return list(
+            await asyncio.gather(*[self.get_edge(src, tgt) for src, tgt in edge_pairs])
+        )
+
+    async def edge_degrees_batch(self, edge_pairs: list[tuple[str, str]]) -> list[int]:
+        """Sum of endpoint degrees, fetched with a single `node_degrees_batch` call"""
+        node_ids = list({n for pair in edge_pairs for n in pair})
+        degrees = dict(zip(node_ids, await self.node_degrees_batch(node_ids)))
+        return [(degrees[src] or 0) + (degrees[tgt] or 0) for src, tgt in edge_pairs]
+
+    async def get_node_edges_batch(
+        self, node_ids: list[str]
+    ) -> list[Union[list[tuple[str, str]], None]]:
+        return list(await asyncio.gather(*[self.get_node_edges(n) for n in node_ids]))
+
     async def upsert_node(self, node_id: str, node_data: dict[str, str]):
         raise NotImplementedError
 
@@ -124,6 +206,17 @@ class BaseGraphStorage(StorageNameSpace):
     ):
         raise NotImplementedError
 
+    async def upsert_nodes(self, nodes: list[tuple[str, dict]]):
+        """Bulk `upsert_node` of (node_id, node_data) pairs.
+        Backends that can write in one round-trip should override the bulk upserts.
+        """
+        await asyncio.gather(*[self.upsert_node(n, data) for n, data in nodes])
+
+    async def upsert_edges(self, edges: list[tuple[str, str, dict]]):
+        await asyncio.gather(
+            *[self.upsert_edge(src, tgt, data) for src, tgt, data in edges]
+        )
+
     async def delete_node(self, node_id: str):
         raise NotImplementedError
 
@@ -1,12 +1,15 @@
 import asyncio
 import os
+import uuid
 from tqdm.asyncio import tqdm as tqdm_async
 from dataclasses import asdict, dataclass, field
 from datetime import datetime
 from functools import partial
-from typing import Type, cast
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Type, Union, cast
 
 from .llm import (
+    close_http_clients,
     gpt_4o_mini_complete,
     openai_embedding,
 )
@@ -14,14 +17,20 @@ from .operate import (
     chunking_by_token_size,
     extract_entities,
     # local_query,global_query,hybrid_query,
-    kg_query
+    kg_query,
+    kg_query_batch,
 )
 
 from .utils import (
     EmbeddingFunc,
     compute_mdhash_id,
     limit_async_func_call,
+    admission_priority,
+    PRIORITY_QUERY,
     convert_response_to_json,
+    response_cache,
+    load_json,
+    write_json,
     logger,
     set_logger,
 )
@@ -35,8 +44,13 @@ from .base import (
 
 from .storage import (
     JsonKVStorage,
+    JsonLogKVStorage,
     NanoVectorDBStorage,
+    MmapVectorDBStorage,
+    IVFVectorDBStorage,
     NetworkXStorage,
+    IncidenceGraphStorage,
+    EmbeddingVectorCache,
 )
 
 # future KG integrations
@@ -129,10 +143,23 @@ class HyperGraphRAG:
     chunk_token_size: int = 1200
     chunk_overlap_token_size: int = 100
     tiktoken_model_name: str = "gpt-4o-mini"
+    # "thread", "process" or "none" (chunk inline on the event loop)
+    chunking_executor: str = "thread"
+    chunking_max_workers: int = None
 
     # entity extraction
     entity_extract_max_gleaning: int = 2
     entity_summary_to_max_tokens: int = 500
+    # new description tokens that trigger folding into an existing summary
+    entity_summary_refresh_tokens: int = 250
+    # entities packed into one summarization request
+    entity_summary_batch_size: int = 8
+    entity_summary_batch_max_tokens: int = 8000
+    # persist per-chunk extraction results so an interrupted insert resumes
+    enable_extraction_checkpoint: bool = True
+    extraction_checkpoint_interval: int = 32
+    # nodes/edges per bulk graph write when merging extraction results
+    graph_upsert_batch_size: int = 500
 
     # node embedding
     node_embedding_algorithm: str = "node2vec"
@@ -151,6 +178,12 @@ class HyperGraphRAG:
     embedding_func: EmbeddingFunc = field(default_factory=lambda: openai_embedding)
     embedding_batch_num: int = 32
     embedding_func_max_async: int = 16
+    # content-addressed on-disk cache of computed embeddings
+    enable_embedding_vector_cache: bool = True
+    embedding_vector_cache_dir: str = None  # defaults to working_dir
+    # model id; derived from the func's `model` keyword, the cache is off if unknown
+    embedding_vector_cache_key: str = None
+    embedding_vector_cache_max_bytes: int = 1024 * 1024 * 1024
 
     # LLM
     llm_model_func: callable = gpt_4o_mini_complete  # hf_model_complete#
@@ -158,11 +191,20 @@ class HyperGraphRAG:
     llm_model_max_token_size: int = 32768
     llm_model_max_async: int = 16
     llm_model_kwargs: dict = field(default_factory=dict)
+    # queries of one aquery_batch call processed at the same time
+    query_batch_max_async: int = 16
 
     # storage
     vector_db_storage_cls_kwargs: dict = field(default_factory=dict)
 
     enable_llm_cache: bool = True
+    llm_cache_max_bytes: int = 256 * 1024 * 1024
+    llm_cache_max_entries: int = None
+    llm_cache_ttl: float = None  # seconds
+    # query keywords cached per normalized query, apart from the answer cache
+    enable_keyword_cache: bool = True
+    # only_need_context results, dropped whenever an insert or delete finishes
+    enable_context_cache: bool = True
 
     # extension
     addon_params: dict = field(default_factory=dict)
@@ -192,18 +234,42 @@ class HyperGraphRAG:
             logger.info(f"Creating working directory {self.working_dir}")
             os.makedirs(self.working_dir)
 
-        self.llm_response_cache = (
-            self.key_string_value_json_storage_cls(
-                namespace="llm_response_cache",
-                global_config=asdict(self),
-                embedding_func=None,
-            )
-            if self.enable_llm_cache
-            else None
+        self.llm_response_cache = self._optional_kv(
+            "llm_response_cache", self.enable_llm_cache
+        )
+        self.keyword_cache = self._optional_kv(
+            "keyword_cache", self.enable_keyword_cache
+        )
+        self.context_cache = self._optional_kv(
+            "context_cache", self.enable_context_cache
+        )
+        # rewritten by every finished insert or delete; part of the context
+        # cache key, so it is kept on disk for restarts and other workers
+        self._storage_version_file = os.path.join(
+            self.working_dir, "kv_store_storage_version.json"
         )
+        self.extraction_checkpoint = self._optional_kv(
+            "extraction_checkpoint", self.enable_extraction_checkpoint
+        )
+        cache_key = self.embedding_vector_cache_key or EmbeddingVectorCache.model_id(
+            self.embedding_func
+        )
+        if self.enable_embedding_vector_cache and cache_key is None:
+            logger.warning(
+                "Embedding vector cache disabled: cannot tell which model the "
+                "embedding function uses, set embedding_vector_cache_key"
+            )
         self.embedding_func = limit_async_func_call(self.embedding_func_max_async)(
             self.embedding_func
         )
+        if self.enable_embedding_vector_cache and cache_key is not None:
+            # outside the limiter so cache hits never queue behind provider calls
+            self.embedding_func = EmbeddingVectorCache(
+                self.embedding_vector_cache_dir or self.working_dir,
+                cache_key,
+                self.embedding_func.embedding_dim,
+                max_bytes=self.embedding_vector_cache_max_bytes,
+            ).wrap(self.embedding_func)
 
         self.full_docs = self.key_string_value_json_storage_cls(
             namespace="full_docs",
@@ -215,6 +281,8 @@ class HyperGraphRAG:
             global_config=asdict(self),
             embedding_func=self.embedding_func,
         )
+        self._chunking_executor = None
+
         self.chunk_entity_relation_graph = self.graph_storage_cls(
             namespace="chunk_entity_relation",
             global_config=asdict(self),
@@ -247,21 +315,44 @@ class HyperGraphRAG:
             )
         )
 
+    def _optional_kv(
+        self, namespace: str, enabled: bool
+    ) -> Union[BaseKVStorage, None]:
+        """KV store of an optional cache, None if disabled or if the KV backend
+        has no schema for ``namespace``
+        """
+        if not enabled:
+            return None
+        kv = self.key_string_value_json_storage_cls(
+            namespace=namespace,
+            global_config=asdict(self),
+            embedding_func=None,
+        )
+        supported = kv.supported_namespaces
+        if supported is not None and namespace not in supported:
+            logger.warning(f"{namespace} disabled: {self.kv_storage} cannot store it")
+            return None
+        return kv
+
     def _get_storage_class(self) -> Type[BaseGraphStorage]:
         return {
             # kv storage
             "JsonKVStorage": JsonKVStorage,
+            "JsonLogKVStorage": JsonLogKVStorage,
             "OracleKVStorage": OracleKVStorage,
             "MongoKVStorage": MongoKVStorage,
             "TiDBKVStorage": TiDBKVStorage,
             # vector storage
             "NanoVectorDBStorage": NanoVectorDBStorage,
+            "MmapVectorDBStorage": MmapVectorDBStorage,
+            "IVFVectorDBStorage": IVFVectorDBStorage,
             "OracleVectorDBStorage": OracleVectorDBStorage,
             "MilvusVectorDBStorge": MilvusVectorDBStorge,
             "ChromaVectorDBStorage": ChromaVectorDBStorage,
             "TiDBVectorDBStorage": TiDBVectorDBStorage,
             # graph storage
             "NetworkXStorage": NetworkXStorage,
+            "IncidenceGraphStorage": IncidenceGraphStorage,
             "Neo4JStorage": Neo4JStorage,
             "OracleGraphStorage": OracleGraphStorage,
             # "ArangoDBStorage": ArangoDBStorage
@@ -273,6 +364,7 @@ class HyperGraphRAG:
 
     async def ainsert(self, string_or_strings):
         update_storage = False
+        inserted = False
         try:
             if isinstance(string_or_strings, str):
                 string_or_strings = [string_or_strings]
@@ -289,61 +381,260 @@ class HyperGraphRAG:
             update_storage = True
             logger.info(f"[New Docs] inserting {len(new_docs)} docs")
 
+            async def _doc_chunks():
+                async for _, chunks in tqdm_async(
+                    self._iter_doc_chunks(new_docs),
+                    total=len(new_docs),
+                    desc="Chunking documents",
+                    unit="doc",
+                ):
+                    yield chunks
+
+            inserted = await self._insert_chunks(new_docs, _doc_chunks())
+        finally:
+            if update_storage:
+                await self._insert_done()
+        if inserted:
+            await self._clear_extraction_checkpoint()
+
+    def insert_stream(self, docs, batch_size: int = 64, max_pending_batches: int = 2):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(
+            self.ainsert_stream(docs, batch_size, max_pending_batches)
+        )
+
+    async def ainsert_stream(
+        self, docs, batch_size: int = 64, max_pending_batches: int = 2
+    ):
+        """Insert documents from a (sync or async) iterable in micro-batches.
+
+        A producer task chunks (on the chunking executor) up to
+        ``max_pending_batches`` batches of ``batch_size`` documents ahead of
+        the consumer, which embeds, extracts,
+        merges and flushes each batch before taking the next one. Memory is
+        bounded by the batches in flight, and work on batches already flushed
+        survives a crash.
+        """
+        queue = asyncio.Queue(maxsize=max_pending_batches)
+
+        async def _put_batch(batch: dict):
             inserting_chunks = {}
-            for doc_key, doc in tqdm_async(
-                new_docs.items(), desc="Chunking documents", unit="doc"
-            ):
-                chunks = {
-                    compute_mdhash_id(dp["content"], prefix="chunk-"): {
-                        **dp,
-                        "full_doc_id": doc_key,
-                    }
-                    for dp in chunking_by_token_size(
-                        doc["content"],
-                        overlap_token_size=self.chunk_overlap_token_size,
-                        max_token_size=self.chunk_token_size,
-                        tiktoken_model=self.tiktoken_model_name,
-                    )
-                }
+            async for _, chunks in self._iter_doc_chunks(batch):
                 inserting_chunks.update(chunks)
-            _add_chunk_keys = await self.text_chunks.filter_keys(
-                list(inserting_chunks.keys())
+            await queue.put((batch, inserting_chunks))
+
+        async def _iter_docs():
+            if hasattr(docs, "__aiter__"):
+                async for c in docs:
+                    yield c
+            else:
+                for c in docs:
+                    yield c
+
+        async def _produce():
+            batch = {}
+            async for c in _iter_docs():
+                batch[compute_mdhash_id(c.strip(), prefix="doc-")] = {
+                    "content": c.strip()
+                }
+                if len(batch) >= batch_size:
+                    await _put_batch(batch)
+                    batch = {}
+            if batch:
+                await _put_batch(batch)
+
+        async def _produce_then_close():
+            try:
+                await _produce()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await queue.put(None)
+                raise
+            await queue.put(None)
+
+        async def _once(chunks: dict):
+            yield chunks
+
+        producer = asyncio.create_task(_produce_then_close())
+        inserted_docs = 0
+        try:
+            while (item := await queue.get()) is not None:
+                new_docs, inserting_chunks = item
+                # filter here rather than in the producer so that duplicates
+                # of a document in the batch just committed are dropped
+                _add_doc_keys = await self.full_docs.filter_keys(list(new_docs.keys()))
+                new_docs = {k: v for k, v in new_docs.items() if k in _add_doc_keys}
+                if not len(new_docs):
+                    continue
+                inserting_chunks = {
+                    k: v
+                    for k, v in inserting_chunks.items()
+                    if v["full_doc_id"] in new_docs
+                }
+                logger.info(f"[New Docs] inserting batch of {len(new_docs)} docs")
+                inserted = False
+                try:
+                    inserted = await self._insert_chunks(
+                        new_docs, _once(inserting_chunks)
+                    )
+                finally:
+                    await self._insert_done()
+                if inserted:
+                    inserted_docs += len(new_docs)
+                    await self._clear_extraction_checkpoint()
+            # surface errors raised while reading or chunking documents
+            await producer
+        finally:
+            if not producer.done():
+                producer.cancel()
+                await asyncio.gather(producer, return_exceptions=True)
+        logger.info(f"[Stream] inserted {inserted_docs} docs")
+        return inserted_docs
+
+    def _get_chunking_executor(self) -> Union[Executor, None]:
+        if self._chunking_executor is None and self.chunking_executor != "none":
+            executor_cls = (
+                ProcessPoolExecutor
+                if self.chunking_executor == "process"
+                else ThreadPoolExecutor
             )
-            inserting_chunks = {
-                k: v for k, v in inserting_chunks.items() if k in _add_chunk_keys
-            }
-            if not len(inserting_chunks):
-                logger.warning("All chunks are already in the storage")
-                return
-            logger.info(f"[New Chunks] inserting {len(inserting_chunks)} chunks")
+            self._chunking_executor = executor_cls(
+                max_workers=self.chunking_max_workers
+            )
+        return self._chunking_executor
 
-            await self.chunks_vdb.upsert(inserting_chunks)
+    def _shutdown_chunking_executor(self):
+        if self._chunking_executor is not None:
+            self._chunking_executor.shutdown(wait=False, cancel_futures=True)
+            self._chunking_executor = None
 
-            logger.info("[Entity Extraction]...")
-            maybe_new_kg = await extract_entities(
-                inserting_chunks,
-                knowledge_graph_inst=self.chunk_entity_relation_graph,
-                entity_vdb=self.entities_vdb,
-                hyperedge_vdb=self.hyperedges_vdb,
-                global_config=asdict(self),
-            )
-            if maybe_new_kg is None:
-                logger.warning("No new hyperedges and entities found")
-                return
-            self.chunk_entity_relation_graph = maybe_new_kg
+    def close(self):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.aclose())
+
+    async def aclose(self):
+        """Release the chunking workers and the pooled HTTP clients of the
+        running event loop. The instance stays usable: workers and clients are
+        created again on the next call. The clients are shared by every
+        instance on the loop.
+        """
+        self._shutdown_chunking_executor()
+        await close_http_clients()
+
+    async def _iter_doc_chunks(self, docs: dict):
+        """Chunk ``docs`` on the chunking executor, yielding ``(doc_key, chunks)``
+        as each document finishes
+        """
+        chunk = partial(
+            chunking_by_token_size,
+            overlap_token_size=self.chunk_overlap_token_size,
+            max_token_size=self.chunk_token_size,
+            tiktoken_model=self.tiktoken_model_name,
+        )
+        executor = self._get_chunking_executor()
+        if executor is None:
+            for doc_key, doc in docs.items():
+                yield doc_key, self._key_chunks(doc_key, chunk(doc["content"]))
+            return
+        loop = asyncio.get_running_loop()
+
+        async def _chunk_one(doc_key, doc):
+            return doc_key, await loop.run_in_executor(executor, chunk, doc["content"])
+
+        for result in asyncio.as_completed(
+            [_chunk_one(doc_key, doc) for doc_key, doc in docs.items()]
+        ):
+            doc_key, chunks = await result
+            yield doc_key, self._key_chunks(doc_key, chunks)
+
+    @staticmethod
+    def _key_chunks(doc_key: str, chunks: list[dict]) -> dict:
+        return {
+            compute_mdhash_id(dp["content"], prefix="chunk-"): {
+                **dp,
+                "full_doc_id": doc_key,
+            }
+            for dp in chunks
+        }
 
-            await self.full_docs.upsert(new_docs)
-            await self.text_chunks.upsert(inserting_chunks)
-        finally:
-            if update_storage:
-                await self._insert_done()
+    async def _insert_chunks(self, new_docs: dict, chunk_batches) -> bool:
+        """Embed and extract the chunks of ``chunk_batches``, an async iterable
+        of ``{chunk_key: chunk}`` dicts, starting on each dict as it arrives
+        """
+        inserting_chunks = {}
+
+        async def _new_chunks():
+            async for chunks in chunk_batches:
+                _add_chunk_keys = await self.text_chunks.filter_keys(
+                    list(chunks.keys())
+                )
+                chunks = {
+                    k: v
+                    for k, v in chunks.items()
+                    if k in _add_chunk_keys and k not in inserting_chunks
+                }
+                if not chunks:
+                    continue
+                inserting_chunks.update(chunks)
+                await self.chunks_vdb.upsert(chunks)
+                yield chunks
+
+        logger.info("[Entity Extraction]...")
+        maybe_new_kg = await extract_entities(
+            _new_chunks(),
+            knowledge_graph_inst=self.chunk_entity_relation_graph,
+            entity_vdb=self.entities_vdb,
+            hyperedge_vdb=self.hyperedges_vdb,
+            global_config=asdict(self),
+            extraction_checkpoint=self.extraction_checkpoint,
+        )
+        if not len(inserting_chunks):
+            logger.warning("All chunks are already in the storage")
+            return False
+        logger.info(f"[New Chunks] inserted {len(inserting_chunks)} chunks")
+        if maybe_new_kg is None:
+            logger.warning("No new hyperedges and entities found")
+            return False
+        self.chunk_entity_relation_graph = maybe_new_kg
+
+        await self.full_docs.upsert(new_docs)
+        await self.text_chunks.upsert(inserting_chunks)
+        return True
+
+    async def _clear_extraction_checkpoint(self):
+        # only after the extracted graph and text chunks have been flushed
+        if self.extraction_checkpoint is None:
+            return
+        await self.extraction_checkpoint.drop()
+        await self.extraction_checkpoint.index_done_callback()
+
+    def _storage_version(self) -> str:
+        state = load_json(self._storage_version_file) or {}
+        return state.get("version", "")
+
+    async def _bump_storage_version(self):
+        """Invalidate cached query contexts after the stored data changed"""
+        tmp_file_name = f"{self._storage_version_file}.{os.getpid()}.tmp"
+        write_json({"version": uuid.uuid4().hex}, tmp_file_name)
+        os.replace(tmp_file_name, self._storage_version_file)
+        if self.context_cache is not None:
+            await response_cache(self.context_cache).drop_mode("context")
+
+    async def _save_cache_indexes(self):
+        for cache in [self.llm_response_cache, self.keyword_cache, self.context_cache]:
+            if cache is not None:
+                await response_cache(cache).save()
 
     async def _insert_done(self):
+        await self._bump_storage_version()
+        await self._save_cache_indexes()
         tasks = []
         for storage_inst in [
             self.full_docs,
             self.text_chunks,
             self.llm_response_cache,
+            self.context_cache,
             self.entities_vdb,
             self.hyperedges_vdb,
             self.chunks_vdb,
@@ -496,8 +787,41 @@ class HyperGraphRAG:
 
     async def aquery(self, query: str, param: QueryParam = QueryParam()):
         if param.mode in ["hybrid"]:
-            response = await kg_query(
-                query,
+            # admitted ahead of any bulk extraction calls queued on the same limits
+            with admission_priority(PRIORITY_QUERY):
+                response = await kg_query(
+                    query,
+                    self.chunk_entity_relation_graph,
+                    self.entities_vdb,
+                    self.hyperedges_vdb,
+                    self.text_chunks,
+                    param,
+                    asdict(self),
+                    hashing_kv=self.llm_response_cache,
+                    keywords_kv=self.keyword_cache,
+                    context_kv=self.context_cache,
+                    storage_version=self._storage_version(),
+                )
+        await self._query_done()
+        return response
+
+    def query_batch(self, queries: list[str], param: QueryParam = QueryParam()):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.aquery_batch(queries, param))
+
+    async def aquery_batch(
+        self, queries: list[str], param: QueryParam = QueryParam()
+    ) -> list[str]:
+        """Run several queries with shared embedding, vector search and graph reads.
+
+        Returns one answer (or context, with ``only_need_context``) per query,
+        in order.
+        """
+        if param.mode not in ["hybrid"]:
+            raise ValueError(f"Unknown mode {param.mode}")
+        with admission_priority(PRIORITY_QUERY):
+            responses = await kg_query_batch(
+                queries,
                 self.chunk_entity_relation_graph,
                 self.entities_vdb,
                 self.hyperedges_vdb,
@@ -505,13 +829,22 @@ class HyperGraphRAG:
                 param,
                 asdict(self),
                 hashing_kv=self.llm_response_cache,
+                keywords_kv=self.keyword_cache,
+                context_kv=self.context_cache,
+                storage_version=self._storage_version(),
+                max_concurrency=self.query_batch_max_async,
             )
         await self._query_done()
-        return response
+        return responses
 
     async def _query_done(self):
+        await self._save_cache_indexes()
         tasks = []
-        for storage_inst in [self.llm_response_cache]:
+        for storage_inst in [
+            self.llm_response_cache,
+            self.keyword_cache,
+            self.context_cache,
+        ]:
             if storage_inst is None:
                 continue
             tasks.append(cast(StorageNameSpace, storage_inst).index_done_callback())
@@ -537,11 +870,14 @@ class HyperGraphRAG:
             logger.error(f"Error while deleting entity '{entity_name}': {e}")
 
     async def _delete_by_entity_done(self):
+        await self._bump_storage_version()
+        await self._save_cache_indexes()
         tasks = []
         for storage_inst in [
             self.entities_vdb,
             self.hyperedges_vdb,
             self.chunk_entity_relation_graph,
+            self.context_cache,
         ]:
             if storage_inst is None:
                 continue
@@ -138,11 +138,19 @@ class ChromaVectorDBStorage(BaseVectorStorage):
             raise
 
     async def query(self, query: str, top_k=5) -> Union[dict, list[dict]]:
-        try:
-            embedding = await self.embedding_func([query])
+        return (await self.query_batch([query], top_k=top_k))[0]
+
+    async def query_batch(self, queries: list[str], top_k=5) -> list[list[dict]]:
+        if not queries:
+            return []
+        return await self.query_embeddings(await self._embed_queries(queries), top_k)
 
+    async def query_embeddings(
+        self, embeddings: np.ndarray, top_k=5
+    ) -> list[list[dict]]:
+        try:
             results = self._collection.query(
-                query_embeddings=embedding.tolist(),
+                query_embeddings=embeddings.tolist(),
                 n_results=top_k * 2,  # Request more results to allow for filtering
                 include=["metadatas", "distances", "documents"],
             )
@@ -153,15 +161,19 @@ class ChromaVectorDBStorage(BaseVectorStorage):
             # We convert to distance (0 = identical, 1 = orthogonal) via (1 - similarity)
             # Only keep results with distance below threshold, then take top k
             return [
-                {
-                    "id": results["ids"][0][i],
-                    "distance": 1 - results["distances"][0][i],
-                    "content": results["documents"][0][i],
-                    **results["metadatas"][0][i],
-                }
-                for i in range(len(results["ids"][0]))
-                if (1 - results["distances"][0][i]) >= self.cosine_better_than_threshold
-            ][:top_k]
+                [
+                    {
+                        "id": results["ids"][q][i],
+                        "distance": 1 - results["distances"][q][i],
+                        "content": results["documents"][q][i],
+                        **results["metadatas"][q][i],
+                    }
+                    for i in range(len(results["ids"][q]))
+                    if (1 - results["distances"][q][i])
+                    >= self.cosine_better_than_threshold
+                ][:top_k]
+                for q in range(len(embeddings))
+            ]
 
         except Exception as e:
             logger.error(f"Error during ChromaDB query: {str(e)}")
@@ -75,16 +75,25 @@ class MilvusVectorDBStorge(BaseVectorStorage):
         return results
 
     async def query(self, query, top_k=5):
-        embedding = await self.embedding_func([query])
+        return (await self.query_batch([query], top_k=top_k))[0]
+
+    async def query_batch(self, queries: list[str], top_k=5):
+        if not queries:
+            return []
+        return await self.query_embeddings(await self._embed_queries(queries), top_k)
+
+    async def query_embeddings(self, embeddings: np.ndarray, top_k=5):
         results = self._client.search(
             collection_name=self.namespace,
-            data=embedding,
+            data=embeddings,
             limit=top_k,
             output_fields=list(self.meta_fields),
             search_params={"metric_type": "COSINE", "params": {"radius": 0.2}},
         )
-        print(results)
         return [
-            {**dp["entity"], "id": dp["id"], "distance": dp["distance"]}
-            for dp in results[0]
+            [
+                {**dp["entity"], "id": dp["id"], "distance": dp["distance"]}
+                for dp in hits
+            ]
+            for hits in results
         ]
@@ -1,12 +1,15 @@
 import os
 from tqdm.asyncio import tqdm as tqdm_async
 from dataclasses import dataclass
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 
 from hypergraphrag.utils import logger
 
 from hypergraphrag.base import BaseKVStorage
 
+# operations per bulk_write request
+MONGO_BULK_SIZE = 1000
+
 
 @dataclass
 class MongoKVStorage(BaseKVStorage):
@@ -25,14 +28,10 @@ class MongoKVStorage(BaseKVStorage):
         return self._data.find_one({"_id": id})
 
     async def get_by_ids(self, ids, fields=None):
-        if fields is None:
-            return list(self._data.find({"_id": {"$in": ids}}))
-        return list(
-            self._data.find(
-                {"_id": {"$in": ids}},
-                {field: 1 for field in fields},
-            )
-        )
+        projection = None if fields is None else {field: 1 for field in fields}
+        found = {x["_id"]: x for x in self._data.find({"_id": {"$in": ids}}, projection)}
+        # one result per id, in order, like the other KV backends
+        return [found.get(id) for id in ids]
 
     async def filter_keys(self, data: list[str]) -> set[str]:
         existing_ids = [
@@ -41,11 +40,21 @@ class MongoKVStorage(BaseKVStorage):
         return set([s for s in data if s not in existing_ids])
 
     async def upsert(self, data: dict[str, dict]):
-        for k, v in tqdm_async(data.items(), desc="Upserting"):
-            self._data.update_one({"_id": k}, {"$set": v}, upsert=True)
-            data[k]["_id"] = k
+        items = list(data.items())
+        for start in tqdm_async(
+            range(0, len(items), MONGO_BULK_SIZE), desc="Upserting", unit="batch"
+        ):
+            chunk = items[start : start + MONGO_BULK_SIZE]
+            self._data.bulk_write(
+                [UpdateOne({"_id": k}, {"$set": v}, upsert=True) for k, v in chunk],
+                ordered=False,
+            )
+            for k, _ in chunk:
+                data[k]["_id"] = k
         return data
 
+    async def delete(self, ids: list[str]):
+        self._data.delete_many({"_id": {"$in": ids}})
+
     async def drop(self):
-        """ """
-        pass
+        self._data.delete_many({})
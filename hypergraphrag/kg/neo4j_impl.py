@@ -207,6 +207,97 @@ class Neo4JStorage(BaseGraphStorage):
 
             return edges
 
+    @staticmethod
+    def _labels(node_ids) -> list[str]:
+        return [node_id.strip('"') for node_id in node_ids]
+
+    async def _run_union(self, parts: list[str]) -> list:
+        """
+        Run one MATCH per item as a single UNION ALL statement.
+
+        Node ids are labels, which Cypher cannot take as parameters, so every
+        part carries its own label and tags its rows with the item index `idx`.
+        """
+        if not parts:
+            return []
+        query = "\nUNION ALL\n".join(parts)
+        async with self._driver.session() as session:
+            result = await session.run(query)
+            records = [record async for record in result]
+        logger.debug(
+            f"{inspect.currentframe().f_code.co_name}:parts:{len(parts)}:records:{len(records)}"
+        )
+        return records
+
+    async def get_nodes_batch(self, node_ids: list[str]) -> list[Union[dict, None]]:
+        records = await self._run_union(
+            [
+                f"MATCH (n:`{label}`) RETURN {i} AS idx, n"
+                for i, label in enumerate(self._labels(node_ids))
+            ]
+        )
+        nodes = [None] * len(node_ids)
+        for record in records:
+            if nodes[record["idx"]] is None:
+                nodes[record["idx"]] = dict(record["n"])
+        return nodes
+
+    async def node_degrees_batch(self, node_ids: list[str]) -> list[int]:
+        records = await self._run_union(
+            [
+                f"MATCH (n:`{label}`) RETURN {i} AS idx, COUNT {{ (n)--() }} AS degree"
+                for i, label in enumerate(self._labels(node_ids))
+            ]
+        )
+        degrees = [0] * len(node_ids)
+        for record in records:
+            degrees[record["idx"]] = record["degree"]
+        return degrees
+
+    async def get_edges_batch(
+        self, edge_pairs: list[tuple[str, str]]
+    ) -> list[Union[dict, None]]:
+        records = await self._run_union(
+            [
+                f"MATCH (start:`{src}`)-[r]->(end:`{tgt}`) "
+                f"RETURN {i} AS idx, properties(r) AS edge_properties LIMIT 1"
+                for i, (src, tgt) in enumerate(
+                    zip(
+                        self._labels(pair[0] for pair in edge_pairs),
+                        self._labels(pair[1] for pair in edge_pairs),
+                    )
+                )
+            ]
+        )
+        edges = [None] * len(edge_pairs)
+        for record in records:
+            edges[record["idx"]] = dict(record["edge_properties"])
+        return edges
+
+    async def get_node_edges_batch(
+        self, node_ids: list[str]
+    ) -> list[List[Tuple[str, str]]]:
+        records = await self._run_union(
+            [
+                f"MATCH (n:`{label}`) OPTIONAL MATCH (n)-[r]-(connected) "
+                f"RETURN {i} AS idx, n, connected"
+                for i, label in enumerate(self._labels(node_ids))
+            ]
+        )
+        edges = [[] for _ in node_ids]
+        for record in records:
+            source_node = record["n"]
+            connected_node = record["connected"]
+            source_label = list(source_node.labels)[0] if source_node.labels else None
+            target_label = (
+                list(connected_node.labels)[0]
+                if connected_node and connected_node.labels
+                else None
+            )
+            if source_label and target_label:
+                edges[record["idx"]].append((source_label, target_label))
+        return edges
+
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=4, max=10),
@@ -294,5 +385,71 @@ class Neo4JStorage(BaseGraphStorage):
             logger.error(f"Error during edge upsert: {str(e)}")
             raise
 
+    async def _write_union(self, parts: list[str], params: dict):
+        """
+        Run one unit subquery per item inside a single write transaction.
+
+        Each `CALL { ... }` is independent, so an edge whose endpoints are
+        missing is skipped without aborting the rest of the statement.
+        """
+        if not parts:
+            return
+        query = "\n".join(f"CALL {{ {part} }}" for part in parts)
+
+        async def _do_write(tx: AsyncManagedTransaction):
+            await tx.run(query, params)
+
+        try:
+            async with self._driver.session() as session:
+                await session.execute_write(_do_write)
+        except Exception as e:
+            logger.error(f"Error during bulk upsert: {str(e)}")
+            raise
+        logger.debug(f"{inspect.currentframe().f_code.co_name}:parts:{len(parts)}")
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception_type(
+            (
+                neo4jExceptions.ServiceUnavailable,
+                neo4jExceptions.TransientError,
+                neo4jExceptions.WriteServiceUnavailable,
+            )
+        ),
+    )
+    async def upsert_nodes(self, nodes: list[tuple[str, Dict[str, Any]]]):
+        labels = self._labels(node_id for node_id, _ in nodes)
+        await self._write_union(
+            [
+                f"MERGE (n:`{label}`) SET n += $p{i}"
+                for i, label in enumerate(labels)
+            ],
+            {f"p{i}": node_data for i, (_, node_data) in enumerate(nodes)},
+        )
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception_type(
+            (
+                neo4jExceptions.ServiceUnavailable,
+                neo4jExceptions.TransientError,
+                neo4jExceptions.WriteServiceUnavailable,
+            )
+        ),
+    )
+    async def upsert_edges(self, edges: list[tuple[str, str, Dict[str, Any]]]):
+        sources = self._labels(src for src, _, _ in edges)
+        targets = self._labels(tgt for _, tgt, _ in edges)
+        await self._write_union(
+            [
+                f"MATCH (source:`{src}`) MATCH (target:`{tgt}`) "
+                f"MERGE (source)-[r:DIRECTED]->(target) SET r += $p{i}"
+                for i, (src, tgt) in enumerate(zip(sources, targets))
+            ],
+            {f"p{i}": edge_data for i, (_, _, edge_data) in enumerate(edges)},
+        )
+
     async def _node2vec_embed(self):
         print("Implemented but never called.")
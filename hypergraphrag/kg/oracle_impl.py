@@ -163,9 +163,27 @@ class OracleDB:
             print(data)
             raise
 
+    async def executemany(self, sql: str, data: list[dict]):
+        """一次往返批量执行同一条语句"""
+        if not data:
+            return
+        try:
+            async with self.pool.acquire() as connection:
+                connection.inputtypehandler = self.input_type_handler
+                connection.outputtypehandler = self.output_type_handler
+                with connection.cursor() as cursor:
+                    await cursor.executemany(sql, data)
+                    await connection.commit()
+        except Exception as e:
+            logger.error(f"Oracle database error: {e}")
+            print(sql)
+            raise
+
 
 @dataclass
 class OracleKVStorage(BaseKVStorage):
+    supported_namespaces = ("full_docs", "text_chunks")
+
     # should pass db object to self.db
     def __post_init__(self):
         self._data = {}
@@ -321,6 +339,46 @@ class OracleVectorDBStorage(BaseVectorStorage):
         # print("vector search result:",results)
         return results
 
+    async def query_batch(self, queries: list[str], top_k=5) -> list[list[dict]]:
+        """一次 UNION ALL 查询多个向量"""
+        if not queries:
+            return []
+        return await self.query_embeddings(await self._embed_queries(queries), top_k)
+
+    async def query_embeddings(
+        self, embeddings: np.ndarray, top_k=5
+    ) -> list[list[dict]]:
+        dtype = str(embeddings.dtype).upper()
+        dimension = embeddings.shape[1]
+
+        params = {
+            "workspace": self.db.workspace,
+            "top_k": top_k,
+            "better_than_threshold": self.cosine_better_than_threshold,
+        }
+        selects = []
+        for i, embedding in enumerate(embeddings):
+            params[f"embedding_string_{i}"] = (
+                "[" + ", ".join(map(str, embedding.tolist())) + "]"
+            )
+            SQL = (
+                SQL_TEMPLATES[self.namespace]
+                .format(dimension=dimension, dtype=dtype)
+                .replace(":embedding_string", f":embedding_string_{i}")
+            )
+            selects.append(f"SELECT {i} AS query_index, q.* FROM ({SQL}) q")
+
+        results = await self.db.query(
+            " UNION ALL ".join(selects), params=params, multirows=True
+        )
+        grouped = [[] for _ in embeddings]
+        for row in results or []:
+            grouped[row.pop("query_index")].append(row)
+        # UNION ALL does not keep the order of its subqueries
+        for rows in grouped:
+            rows.sort(key=lambda row: row["distance"])
+        return grouped
+
 
 @dataclass
 class OracleGraphStorage(BaseGraphStorage):
@@ -334,55 +392,15 @@ class OracleGraphStorage(BaseGraphStorage):
 
     async def upsert_node(self, node_id: str, node_data: dict[str, str]):
         """插入或更新节点"""
-        # print("go into upsert node method")
-        entity_name = node_id
-        entity_type = node_data["entity_type"]
-        description = node_data["description"]
-        source_id = node_data["source_id"]
-        logger.debug(f"entity_name:{entity_name}, entity_type:{entity_type}")
-
-        content = entity_name + description
-        contents = [content]
-        batches = [
-            contents[i : i + self._max_batch_size]
-            for i in range(0, len(contents), self._max_batch_size)
-        ]
-        embeddings_list = await asyncio.gather(
-            *[self.embedding_func(batch) for batch in batches]
-        )
-        embeddings = np.concatenate(embeddings_list)
-        content_vector = embeddings[0]
-        merge_sql = SQL_TEMPLATES["merge_node"]
-        data = {
-            "workspace": self.db.workspace,
-            "name": entity_name,
-            "entity_type": entity_type,
-            "description": description,
-            "source_chunk_id": source_id,
-            "content": content,
-            "content_vector": content_vector,
-        }
-        # print(merge_sql)
-        await self.db.execute(merge_sql, data)
-        # self._graph.add_node(node_id, **node_data)
+        await self.upsert_nodes([(node_id, node_data)])
 
     async def upsert_edge(
         self, source_node_id: str, target_node_id: str, edge_data: dict[str, str]
     ):
         """插入或更新边"""
-        # print("go into upsert edge method")
-        source_name = source_node_id
-        target_name = target_node_id
-        weight = edge_data["weight"]
-        keywords = edge_data["keywords"]
-        description = edge_data["description"]
-        source_chunk_id = edge_data["source_id"]
-        logger.debug(
-            f"source_name:{source_name}, target_name:{target_name}, keywords: {keywords}"
-        )
+        await self.upsert_edges([(source_node_id, target_node_id, edge_data)])
 
-        content = keywords + source_name + target_name + description
-        contents = [content]
+    async def _embed_contents(self, contents: list[str]) -> np.ndarray:
         batches = [
             contents[i : i + self._max_batch_size]
             for i in range(0, len(contents), self._max_batch_size)
@@ -390,23 +408,63 @@ class OracleGraphStorage(BaseGraphStorage):
         embeddings_list = await asyncio.gather(
             *[self.embedding_func(batch) for batch in batches]
         )
-        embeddings = np.concatenate(embeddings_list)
-        content_vector = embeddings[0]
-        merge_sql = SQL_TEMPLATES["merge_edge"]
-        data = {
-            "workspace": self.db.workspace,
-            "source_name": source_name,
-            "target_name": target_name,
-            "weight": weight,
-            "keywords": keywords,
-            "description": description,
-            "source_chunk_id": source_chunk_id,
-            "content": content,
-            "content_vector": content_vector,
-        }
-        # print(merge_sql)
-        await self.db.execute(merge_sql, data)
-        # self._graph.add_edge(source_node_id, target_node_id, **edge_data)
+        return np.concatenate(embeddings_list)
+
+    async def upsert_nodes(self, nodes: list[tuple[str, dict]]):
+        """批量插入或更新节点, 向量分批计算, 一次 executemany 写入
+
+        节点表是固定列, 不保存 summary/pending_description/pending_tokens;
+        读回的节点缺少这些字段, _merge_nodes 会把整个 description 当作待汇总内容.
+        """
+        if not nodes:
+            return
+        rows = []
+        for entity_name, node_data in nodes:
+            logger.debug(
+                f"entity_name:{entity_name}, entity_type:{node_data['entity_type']}"
+            )
+            rows.append(
+                {
+                    "workspace": self.db.workspace,
+                    "name": entity_name,
+                    "entity_type": node_data["entity_type"],
+                    "description": node_data["description"],
+                    "source_chunk_id": node_data["source_id"],
+                    "content": entity_name + node_data["description"],
+                }
+            )
+        embeddings = await self._embed_contents([row["content"] for row in rows])
+        for row, content_vector in zip(rows, embeddings):
+            row["content_vector"] = content_vector
+        await self.db.executemany(SQL_TEMPLATES["merge_node"], rows)
+
+    async def upsert_edges(self, edges: list[tuple[str, str, dict]]):
+        """批量插入或更新边, 向量分批计算, 一次 executemany 写入"""
+        if not edges:
+            return
+        rows = []
+        for source_name, target_name, edge_data in edges:
+            keywords = edge_data["keywords"]
+            description = edge_data["description"]
+            logger.debug(
+                f"source_name:{source_name}, target_name:{target_name}, keywords: {keywords}"
+            )
+            rows.append(
+                {
+                    "workspace": self.db.workspace,
+                    "source_name": source_name,
+                    "target_name": target_name,
+                    "weight": edge_data["weight"],
+                    "keywords": keywords,
+                    "description": description,
+                    "source_chunk_id": edge_data["source_id"],
+                    "content": keywords + source_name + target_name + description,
+                }
+            )
+        embeddings = await self._embed_contents([row["content"] for row in rows])
+        for row, content_vector in zip(rows, embeddings):
+            row["content_vector"] = content_vector
+        await self.db.executemany(SQL_TEMPLATES["merge_edge"], rows)
 
     async def embed_nodes(self, algorithm: str) -> tuple[np.ndarray, list[str]]:
         """为节点生成向量"""
@@ -529,6 +587,66 @@ class OracleGraphStorage(BaseGraphStorage):
                 # print("Node Edge not exist!",self.db.workspace, source_node_id)
                 return []
 
+    async def _query_in(self, template: str, keys: list, multirows: bool = True):
+        """按 IN (...) 批量查询, 每次最多绑定 ORACLE_IN_LIMIT 个键"""
+        rows = []
+        for start in range(0, len(keys), ORACLE_IN_LIMIT):
+            chunk = keys[start : start + ORACLE_IN_LIMIT]
+            params = {"workspace": self.db.workspace}
+            binds = []
+            for i, key in enumerate(chunk):
+                if isinstance(key, tuple):
+                    params[f"s{i}"], params[f"t{i}"] = key
+                    binds.append(f"(:s{i},:t{i})")
+                else:
+                    params[f"id{i}"] = key
+                    binds.append(f":id{i}")
+            SQL = template.format(ids=",".join(binds))
+            rows.extend(await self.db.query(sql=SQL, params=params, multirows=True))
+        return rows
+
+    async def get_nodes_batch(self, node_ids: list[str]) -> list[Union[dict, None]]:
+        """根据节点id列表批量获取节点数据"""
+        res = await self._query_in(SQL_TEMPLATES["get_nodes_batch"], list(node_ids))
+        nodes = {}
+        for row in res:
+            nodes.setdefault(row["name"], row)
+        return [nodes.get(node_id) for node_id in node_ids]
+
+    async def node_degrees_batch(self, node_ids: list[str]) -> list[int]:
+        """根据节点id列表批量获取节点的度"""
+        res = await self._query_in(SQL_TEMPLATES["node_degrees_batch"], list(node_ids))
+        degrees = {row["name"]: row["degree"] for row in res}
+        return [degrees.get(node_id, 0) for node_id in node_ids]
+
+    async def get_edges_batch(
+        self, edge_pairs: list[tuple[str, str]]
+    ) -> list[Union[dict, None]]:
+        """根据(源, 目标)节点id对批量获取边"""
+        res = await self._query_in(
+            SQL_TEMPLATES["get_edges_batch"], [tuple(pair) for pair in edge_pairs]
+        )
+        edges = {}
+        for row in res:
+            edges.setdefault((row.pop("source_name"), row.pop("target_name")), row)
+        return [edges.get(tuple(pair)) for pair in edge_pairs]
+
+    async def get_node_edges_batch(self, node_ids: list[str]):
+        """根据节点id列表批量获取节点的所有边"""
+        res = await self._query_in(SQL_TEMPLATES["get_node_edges_batch"], list(node_ids))
+        existing = set()
+        edges = {}
+        for row in res:
+            existing.add(row["name"])
+            if row["target_name"] is not None:
+                edges.setdefault(row["name"], []).append(
+                    (row["name"], row["target_name"])
+                )
+        return [
+            edges.get(node_id, []) if node_id in existing else None
+            for node_id in node_ids
+        ]
+
     async def get_all_nodes(self, limit: int):
         """查询所有节点"""
         SQL = SQL_TEMPLATES["get_all_nodes"]
@@ -553,6 +671,9 @@ class OracleGraphStorage(BaseGraphStorage):
             return res
 
 
+# Oracle 限制 IN 列表最多 1000 个表达式
+ORACLE_IN_LIMIT = 1000
+
 N_T = {
     "full_docs": "HYPERGRAPHRAG_DOC_FULL",
     "text_chunks": "HYPERGRAPHRAG_DOC_CHUNKS",
@@ -664,15 +785,15 @@ SQL_TEMPLATES = {
                     INSERT(id,content,workspace,tokens,chunk_order_index,full_doc_id,content_vector)
                     values (:id,:content,:workspace,:tokens,:chunk_order_index,:full_doc_id,:content_vector) """,
     # SQL for VectorStorage
-    "entities": """SELECT name as entity_name FROM
+    "entities": """SELECT name as entity_name, distance FROM
         (SELECT id,name,VECTOR_DISTANCE(content_vector,vector(:embedding_string,{dimension},{dtype}),COSINE) as distance
         FROM HYPERGRAPHRAG_GRAPH_NODES WHERE workspace=:workspace)
         WHERE distance>:better_than_threshold ORDER BY distance ASC FETCH FIRST :top_k ROWS ONLY""",
-    "relationships": """SELECT source_name as src_id, target_name as tgt_id FROM
+    "relationships": """SELECT source_name as src_id, target_name as tgt_id, distance FROM
         (SELECT id,source_name,target_name,VECTOR_DISTANCE(content_vector,vector(:embedding_string,{dimension},{dtype}),COSINE) as distance
         FROM HYPERGRAPHRAG_GRAPH_EDGES WHERE workspace=:workspace)
         WHERE distance>:better_than_threshold ORDER BY distance ASC FETCH FIRST :top_k ROWS ONLY""",
-    "chunks": """SELECT id FROM
+    "chunks": """SELECT id, distance FROM
         (SELECT id,VECTOR_DISTANCE(content_vector,vector(:embedding_string,{dimension},{dtype}),COSINE) as distance
         FROM HYPERGRAPHRAG_DOC_CHUNKS WHERE workspace=:workspace)
         WHERE distance>:better_than_threshold ORDER BY distance ASC FETCH FIRST :top_k ROWS ONLY""",
@@ -712,6 +833,25 @@ SQL_TEMPLATES = {
             WHERE e.workspace=:workspace and a.workspace=:workspace and b.workspace=:workspace
             AND a.name=:source_node_id
             COLUMNS (a.name as source_name,b.name as target_name))""",
+    "get_nodes_batch": """SELECT name,entity_type,source_chunk_id as source_id,NVL(description,'') AS description
+        FROM HYPERGRAPHRAG_GRAPH_NODES
+        WHERE workspace=:workspace AND name IN ({ids})""",
+    "node_degrees_batch": """SELECT name,count(1) as degree FROM (
+            SELECT source_name as name FROM HYPERGRAPHRAG_GRAPH_EDGES
+            WHERE workspace=:workspace AND source_name IN ({ids})
+            UNION ALL
+            SELECT target_name as name FROM HYPERGRAPHRAG_GRAPH_EDGES
+            WHERE workspace=:workspace AND target_name IN ({ids})
+        ) GROUP BY name""",
+    "get_edges_batch": """SELECT source_name,target_name,weight,source_chunk_id as source_id,
+        NVL(description,'') AS description,NVL(keywords,'') AS keywords
+        FROM HYPERGRAPHRAG_GRAPH_EDGES
+        WHERE workspace=:workspace AND (source_name,target_name) IN ({ids})""",
+    "get_node_edges_batch": """SELECT n.name,e.target_name
+        FROM (SELECT DISTINCT name FROM HYPERGRAPHRAG_GRAPH_NODES
+              WHERE workspace=:workspace AND name IN ({ids})) n
+        LEFT JOIN HYPERGRAPHRAG_GRAPH_EDGES e
+        ON e.workspace=:workspace AND e.source_name=n.name""",
     "merge_node": """MERGE INTO HYPERGRAPHRAG_GRAPH_NODES a
                     USING DUAL
                     ON (a.workspace = :workspace and a.name=:name and a.source_chunk_id=:source_chunk_id)
@@ -93,6 +93,8 @@ class TiDB(object):
 
 @dataclass
 class TiDBKVStorage(BaseKVStorage):
+    supported_namespaces = ("full_docs", "text_chunks")
+
     # should pass db object to self.db
     def __post_init__(self):
         self._data = {}
@@ -243,6 +245,41 @@ class TiDBVectorDBStorage(BaseVectorStorage):
             return []
         return results
 
+    async def query_batch(self, queries: list[str], top_k: int) -> list[list[dict]]:
+        """search several queries from tidb vector in one UNION ALL round-trip"""
+        if not queries:
+            return []
+        return await self.query_embeddings(await self._embed_queries(queries), top_k)
+
+    async def query_embeddings(
+        self, embeddings: np.ndarray, top_k: int
+    ) -> list[list[dict]]:
+        params = {
+            "top_k": top_k,
+            "better_than_threshold": self.cosine_better_than_threshold,
+        }
+        selects = []
+        for i, embedding in enumerate(embeddings):
+            params[f"embedding_string_{i}"] = (
+                "[" + ", ".join(map(str, embedding.tolist())) + "]"
+            )
+            sql = SQL_TEMPLATES[self.namespace].replace(
+                ":embedding_string", f":embedding_string_{i}"
+            )
+            selects.append(f"SELECT {i} AS query_index, q.* FROM ({sql}) q")
+
+        results = await self.db.query(
+            " UNION ALL ".join(selects), params=params, multirows=True
+        )
+        grouped = [[] for _ in embeddings]
+        for row in results or []:
+            grouped[row.pop("query_index")].append(row)
+        # UNION ALL does not keep the order of its subqueries; restore the
+        # per-query template's ORDER BY distance DESC
+        for rows in grouped:
+            rows.sort(key=lambda row: row["distance"], reverse=True)
+        return grouped
+
     ###### INSERT entities And relationships ######
     async def upsert(self, data: dict[str, dict]):
         # ignore, upsert in TiDBKVStorage already
@@ -425,15 +462,15 @@ SQL_TEMPLATES = {
         full_doc_id = VALUES(full_doc_id), content_vector = VALUES(content_vector), workspace = VALUES(workspace), updatetime = CURRENT_TIMESTAMP
         """,
     # SQL for VectorStorage
-    "entities": """SELECT n.name as entity_name FROM
+    "entities": """SELECT n.name as entity_name, n.distance FROM
         (SELECT entity_id as id, name, VEC_COSINE_DISTANCE(content_vector,:embedding_string) as distance
         FROM HYPERGRAPHRAG_GRAPH_NODES WHERE workspace = :workspace) n
         WHERE n.distance>:better_than_threshold ORDER BY n.distance DESC LIMIT :top_k""",
-    "relationships": """SELECT e.source_name as src_id, e.target_name as tgt_id FROM
+    "relationships": """SELECT e.source_name as src_id, e.target_name as tgt_id, e.distance FROM
         (SELECT source_name, target_name, VEC_COSINE_DISTANCE(content_vector, :embedding_string) as distance
         FROM HYPERGRAPHRAG_GRAPH_EDGES WHERE workspace = :workspace) e
         WHERE e.distance>:better_than_threshold ORDER BY e.distance DESC LIMIT :top_k""",
-    "chunks": """SELECT c.id FROM
+    "chunks": """SELECT c.id, c.distance FROM
         (SELECT chunk_id as id,VEC_COSINE_DISTANCE(content_vector, :embedding_string) as distance
         FROM HYPERGRAPHRAG_DOC_CHUNKS WHERE workspace = :workspace) c
         WHERE c.distance>:better_than_threshold ORDER BY c.distance DESC LIMIT :top_k""",
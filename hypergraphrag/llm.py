@@ -6,8 +6,10 @@ import re
 import struct
 from functools import lru_cache
 from typing import List, Dict, Callable, Any, Union, Optional
+import asyncio
 import aioboto3
 import aiohttp
+import httpx
 import numpy as np
 import ollama
 import torch
@@ -31,7 +33,9 @@ from .utils import (
     wrap_embedding_func_with_attrs,
     locate_json_string_body_from_string,
     safe_unicode_decode,
+    encode_string_by_tiktoken,
     logger,
+    RateController,
 )
 
 import sys
@@ -43,6 +47,182 @@ else:
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+_rate_controllers: dict[tuple, RateController] = {}
+_rate_controller_config: dict[tuple, dict] = {}
+
+
+def configure_rate_limits(
+    provider: str, model: str = None, base_url: str = None, **limits
+):
+    """Set `RateController` limits (rpm, tpm, max_window, latency_target, ...)
+    for calls to ``provider``/``model``/``base_url``.
+    """
+    key = (provider, model, base_url)
+    _rate_controller_config[key] = limits
+    _rate_controllers.pop(key, None)
+
+
+def get_rate_controller(
+    provider: str, model: str = None, base_url: str = None
+) -> RateController:
+    key = (provider, model, base_url)
+    if key not in _rate_controllers:
+        config = _rate_controller_config.get(
+            key, _rate_controller_config.get((provider, None, None), {})
+        )
+        _rate_controllers[key] = RateController(**config)
+    return _rate_controllers[key]
+
+
+def rate_controller_stats() -> dict:
+    return {"/".join(map(str, k)): c.stats() for k, c in _rate_controllers.items()}
+
+
+_http_client_config = {
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30.0,
+    "timeout": 600.0,
+}
+# (event loop, provider, base_url, api_key, ...) -> client
+_http_clients: dict[tuple, Any] = {}
+# tasks closing clients of closed loops, referenced until they finish
+_closing_clients: set[asyncio.Task] = set()
+
+
+def configure_http_clients(**options):
+    """Update pool size / keep-alive / timeout options for clients created
+    after this call (max_connections, max_keepalive_connections,
+    keepalive_expiry, timeout).
+    """
+    _http_client_config.update(options)
+
+
+def _client_key(*key) -> tuple:
+    loop = asyncio.get_running_loop()
+    # pools are bound to the loop they were opened on; close the ones left
+    # behind by loops that have been closed since
+    for stale in [k for k in _http_clients if k[0].is_closed()]:
+        task = loop.create_task(_close_client(_http_clients.pop(stale)))
+        _closing_clients.add(task)
+        task.add_done_callback(_closing_clients.discard)
+    return (loop, *key)
+
+
+async def _close_client(client):
+    try:
+        await client.close()
+    except Exception as e:
+        # connections opened on a closed loop cannot be shut down from another
+        # one; the client is still marked closed and they go with it
+        logger.debug(f"Error closing a pooled HTTP client: {e!r}")
+
+
+def _httpx_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=_http_client_config["max_connections"],
+            max_keepalive_connections=_http_client_config["max_keepalive_connections"],
+            keepalive_expiry=_http_client_config["keepalive_expiry"],
+        ),
+        timeout=_http_client_config["timeout"],
+    )
+
+
+def get_openai_client(base_url: str = None, api_key: str = None) -> AsyncOpenAI:
+    key = _client_key("openai", base_url, api_key)
+    if key not in _http_clients:
+        _http_clients[key] = AsyncOpenAI(
+            base_url=base_url, api_key=api_key, http_client=_httpx_client()
+        )
+    return _http_clients[key]
+
+
+def get_azure_openai_client(
+    base_url: str = None, api_key: str = None, api_version: str = None
+) -> AsyncAzureOpenAI:
+    base_url = base_url or os.getenv("AZURE_OPENAI_ENDPOINT")
+    api_key = api_key or os.getenv("AZURE_OPENAI_API_KEY")
+    api_version = api_version or os.getenv("AZURE_OPENAI_API_VERSION")
+    key = _client_key("azure_openai", base_url, api_key, api_version)
+    if key not in _http_clients:
+        _http_clients[key] = AsyncAzureOpenAI(
+            azure_endpoint=base_url,
+            api_key=api_key,
+            api_version=api_version,
+            http_client=_httpx_client(),
+        )
+    return _http_clients[key]
+
+
+def get_aiohttp_session(provider: str) -> aiohttp.ClientSession:
+    key = _client_key(provider, None, None)
+    if key not in _http_clients or _http_clients[key].closed:
+        _http_clients[key] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=_http_client_config["max_connections"],
+                keepalive_timeout=_http_client_config["keepalive_expiry"],
+            ),
+            timeout=aiohttp.ClientTimeout(total=_http_client_config["timeout"]),
+        )
+    return _http_clients[key]
+
+
+async def close_http_clients():
+    """Close every pooled client opened on the running event loop, and those
+    left behind by event loops that have been closed
+    """
+    loop = asyncio.get_running_loop()
+    for key in [k for k in _http_clients if k[0] is loop or k[0].is_closed()]:
+        await _close_client(_http_clients.pop(key))
+
+
+def _estimate_tokens(controller, *texts) -> int:
+    """Token estimate for ``controller``'s tpm budget; 0 (no tokenizing) without one"""
+    if controller.tpm is None:
+        return 0
+    return sum(
+        len(encode_string_by_tiktoken(t)) for t in texts if isinstance(t, str) and t
+    )
+
+
+class _ReleasingStream:
+    """Async iterator over a streamed response that holds a rate-controller
+    ticket until the stream is exhausted, fails or is closed."""
+
+    def __init__(self, chunks, controller, ticket):
+        self._chunks = chunks
+        self._controller = controller
+        self._ticket = ticket
+        self.used_tokens = None
+
+    def _release(self, rate_limited=False):
+        if self._ticket is not None:
+            ticket, self._ticket = self._ticket, None
+            self._controller.release(ticket, self.used_tokens, rate_limited)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._chunks.__anext__()
+        except BaseException as e:
+            self._release(isinstance(e, RateLimitError))
+            raise
+
+    async def aclose(self):
+        self._release()
+        await self._chunks.aclose()
+
+    def __del__(self):
+        self._release()
+
+
+def _usage_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
 
 @retry(
     stop=stop_after_attempt(3),
@@ -58,12 +238,7 @@ async def openai_complete_if_cache(
     api_key=None,
     **kwargs,
 ) -> str:
-    if api_key:
-        os.environ["OPENAI_API_KEY"] = api_key
-
-    openai_async_client = (
-        AsyncOpenAI() if base_url is None else AsyncOpenAI(base_url=base_url)
-    )
+    openai_async_client = get_openai_client(base_url, api_key)
     kwargs.pop("hashing_kv", None)
     kwargs.pop("keyword_extraction", None)
     messages = []
@@ -77,19 +252,39 @@ async def openai_complete_if_cache(
     logger.debug(f"Query: {prompt}")
     logger.debug(f"System prompt: {system_prompt}")
     logger.debug("Full context:")
-    if "response_format" in kwargs:
-        response = await openai_async_client.beta.chat.completions.parse(
-            model=model, messages=messages, **kwargs
-        )
-    else:
-        response = await openai_async_client.chat.completions.create(
-            model=model, messages=messages, **kwargs
-        )
-
-    if hasattr(response, "__aiter__"):
+    controller = get_rate_controller("openai", model, base_url)
+    ticket = await controller.acquire(
+        _estimate_tokens(controller, *[m["content"] for m in messages])
+        + (kwargs.get("max_tokens") or 0)
+    )
+    used_tokens, rate_limited, streaming = None, False, False
+    try:
+        if "response_format" in kwargs:
+            response = await openai_async_client.beta.chat.completions.parse(
+                model=model, messages=messages, **kwargs
+            )
+        else:
+            response = await openai_async_client.chat.completions.create(
+                model=model, messages=messages, **kwargs
+            )
+        used_tokens = _usage_tokens(response)
+        streaming = hasattr(response, "__aiter__")
+    except RateLimitError:
+        rate_limited = True
+        raise
+    finally:
+        # a stream keeps its ticket until it has been consumed
+        if not streaming:
+            controller.release(ticket, used_tokens, rate_limited)
+
+    if streaming:
 
         async def inner():
             async for chunk in response:
+                if _usage_tokens(chunk) is not None:
+                    stream.used_tokens = _usage_tokens(chunk)
+                if not chunk.choices:
+                    continue
                 content = chunk.choices[0].delta.content
                 if content is None:
                     continue
@@ -97,7 +292,8 @@ async def openai_complete_if_cache(
                     content = safe_unicode_decode(content.encode("utf-8"))
                 yield content
 
-        return inner()
+        stream = _ReleasingStream(inner(), controller, ticket)
+        return stream
     else:
         content = response.choices[0].message.content
         if r"\u" in content:
@@ -120,18 +316,7 @@ async def azure_openai_complete_if_cache(
     api_version=None,
     **kwargs,
 ):
-    if api_key:
-        os.environ["AZURE_OPENAI_API_KEY"] = api_key
-    if base_url:
-        os.environ["AZURE_OPENAI_ENDPOINT"] = base_url
-    if api_version:
-        os.environ["AZURE_OPENAI_API_VERSION"] = api_version
-
-    openai_async_client = AsyncAzureOpenAI(
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-    )
+    openai_async_client = get_azure_openai_client(base_url, api_key, api_version)
     kwargs.pop("hashing_kv", None)
     messages = []
     if system_prompt:
@@ -774,24 +959,29 @@ async def openai_embedding(
     base_url: str = None,
     api_key: str = None,
 ) -> np.ndarray:
-    if api_key:
-        os.environ["OPENAI_API_KEY"] = api_key
-
-    openai_async_client = (
-        AsyncOpenAI() if base_url is None else AsyncOpenAI(base_url=base_url)
-    )
-    response = await openai_async_client.embeddings.create(
-        model=model, input=texts, encoding_format="float"
-    )
+    openai_async_client = get_openai_client(base_url, api_key)
+    controller = get_rate_controller("openai", model, base_url)
+    ticket = await controller.acquire(_estimate_tokens(controller, *texts))
+    used_tokens, rate_limited = None, False
+    try:
+        response = await openai_async_client.embeddings.create(
+            model=model, input=texts, encoding_format="float"
+        )
+        used_tokens = _usage_tokens(response)
+    except RateLimitError:
+        rate_limited = True
+        raise
+    finally:
+        controller.release(ticket, used_tokens, rate_limited)
     return np.array([dp.embedding for dp in response.data])
 
 
 async def fetch_data(url, headers, data):
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=data) as response:
-            response_json = await response.json()
-            data_list = response_json.get("data", [])
-            return data_list
+    session = get_aiohttp_session("jina")
+    async with session.post(url, headers=headers, json=data) as response:
+        response_json = await response.json()
+        data_list = response_json.get("data", [])
+        return data_list
 
 
 async def jina_embedding(
@@ -801,12 +991,10 @@ async def jina_embedding(
     base_url: str = None,
     api_key: str = None,
 ) -> np.ndarray:
-    if api_key:
-        os.environ["JINA_API_KEY"] = api_key
     url = "https://api.jina.ai/v1/embeddings" if not base_url else base_url
     headers = {
         "Content-Type": "application/json",
-        "Authorization": f"Bearer {os.environ['JINA_API_KEY']}",
+        "Authorization": f"Bearer {api_key or os.environ['JINA_API_KEY']}",
     }
     data = {
         "model": "jina-embeddings-v3",
@@ -836,12 +1024,7 @@ async def nvidia_openai_embedding(
     trunc: str = "NONE",  # NONE or START or END
     encode: str = "float",  # float or base64
 ) -> np.ndarray:
-    if api_key:
-        os.environ["OPENAI_API_KEY"] = api_key
-
-    openai_async_client = (
-        AsyncOpenAI() if base_url is None else AsyncOpenAI(base_url=base_url)
-    )
+    openai_async_client = get_openai_client(base_url, api_key)
     response = await openai_async_client.embeddings.create(
         model=model,
         input=texts,
@@ -864,18 +1047,7 @@ async def azure_openai_embedding(
     api_key: str = None,
     api_version: str = None,
 ) -> np.ndarray:
-    if api_key:
-        os.environ["AZURE_OPENAI_API_KEY"] = api_key
-    if base_url:
-        os.environ["AZURE_OPENAI_ENDPOINT"] = base_url
-    if api_version:
-        os.environ["AZURE_OPENAI_API_VERSION"] = api_version
-
-    openai_async_client = AsyncAzureOpenAI(
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-    )
+    openai_async_client = get_azure_openai_client(base_url, api_key, api_version)
 
     response = await openai_async_client.embeddings.create(
         model=model, input=texts, encoding_format="float"
@@ -905,12 +1077,12 @@ async def siliconcloud_embedding(
     payload = {"model": model, "input": truncate_texts, "encoding_format": "base64"}
 
     base64_strings = []
-    async with aiohttp.ClientSession() as session:
-        async with session.post(base_url, headers=headers, json=payload) as response:
-            content = await response.json()
-            if "code" in content:
-                raise ValueError(content)
-            base64_strings = [item["embedding"] for item in content["data"]]
+    session = get_aiohttp_session("siliconcloud")
+    async with session.post(base_url, headers=headers, json=payload) as response:
+        content = await response.json()
+        if "code" in content:
+            raise ValueError(content)
+        base64_strings = [item["embedding"] for item in content["data"]]
 
     embeddings = []
     for string in base64_strings:
@@ -1108,7 +1280,6 @@ class MultiModel:
 
 
 if __name__ == "__main__":
-    import asyncio
 
     async def main():
         result = await gpt_4o_mini_complete("How are you?")
@@ -1,8 +1,10 @@
 import asyncio
 import json
 import re
+from functools import lru_cache
+import numpy as np
 from tqdm.asyncio import tqdm as tqdm_async
-from typing import Union
+from typing import AsyncIterable, Union
 from collections import Counter, defaultdict
 import warnings
 from .utils import (
@@ -16,9 +18,10 @@ from .utils import (
     pack_user_ass_to_openai_messages,
     split_string_by_multi_markers,
     truncate_list_by_token_size,
-    process_combine_contexts,
+    count_tokens,
     compute_args_hash,
     handle_cache,
+    response_cache,
     save_to_cache,
     CacheData,
 )
@@ -28,6 +31,10 @@ from .base import (
     BaseVectorStorage,
     TextChunkSchema,
     QueryParam,
+    QueryContext,
+    EntityContextRow,
+    RelationContextRow,
+    SourceContextRow,
 )
 from .prompt import GRAPH_FIELD_SEP, PROMPTS
 
@@ -55,9 +62,11 @@ def chunking_by_token_size(
 
 async def _handle_entity_relation_summary(
     entity_or_relation_name: str,
-    description: str,
+    summary: str,
+    fragments: list[str],
     global_config: dict,
 ) -> str:
+    """Fold pending description ``fragments`` into the previous ``summary``"""
     use_llm_func: callable = global_config["llm_model_func"]
     llm_max_tokens = global_config["llm_model_max_token_size"]
     tiktoken_model_name = global_config["tiktoken_model_name"]
@@ -66,9 +75,8 @@ async def _handle_entity_relation_summary(
         "language", PROMPTS["DEFAULT_LANGUAGE"]
     )
 
+    description = GRAPH_FIELD_SEP.join(([summary] if summary else []) + fragments)
     tokens = encode_string_by_tiktoken(description, model_name=tiktoken_model_name)
-    if len(tokens) < summary_max_tokens:  # No need for summary
-        return description
     prompt_template = PROMPTS["summarize_entity_descriptions"]
     use_description = decode_tokens_by_tiktoken(
         tokens[:llm_max_tokens], model_name=tiktoken_model_name
@@ -131,16 +139,15 @@ async def _handle_single_hyperrelation_extraction(
     )
     
 
-async def _merge_hyperedges_then_upsert(
+def _merge_hyperedge(
     hyperedge_name: str,
     nodes_data: list[dict],
-    knowledge_graph_inst: BaseGraphStorage,
+    already_hyperedge: Union[dict, None],
     global_config: dict,
-):
+) -> dict:
     already_weights = []
     already_source_ids = []
 
-    already_hyperedge = await knowledge_graph_inst.get_node(hyperedge_name)
     if already_hyperedge is not None:
         already_weights.append(already_hyperedge["weight"])
         already_source_ids.extend(
@@ -151,36 +158,71 @@ async def _merge_hyperedges_then_upsert(
     source_id = GRAPH_FIELD_SEP.join(
         set([dp["source_id"] for dp in nodes_data] + already_source_ids)
     )
-    node_data = dict(
+    name_tokens = (already_hyperedge or {}).get("name_tokens")
+    if name_tokens is None:
+        name_tokens = len(
+            encode_string_by_tiktoken(
+                hyperedge_name, model_name=global_config["tiktoken_model_name"]
+            )
+        )
+    return dict(
         role = "hyperedge",
         weight=weight,
         source_id=source_id,
+        name_tokens=name_tokens,
     )
-    await knowledge_graph_inst.upsert_node(
-        hyperedge_name,
-        node_data=node_data,
-    )
-    node_data["hyperedge_name"] = hyperedge_name
-    return node_data
 
 
-async def _merge_nodes_then_upsert(
+_SUMMARY_STATE_FIELDS = {"summary", "pending_description", "pending_tokens"}
+
+
+def _merge_nodes(
     entity_name: str,
     nodes_data: list[dict],
-    knowledge_graph_inst: BaseGraphStorage,
+    already_node: Union[dict, None],
     global_config: dict,
-):
+) -> dict:
+    """Merge extracted records into the stored entity, without summarizing.
+
+    Returns the new node state; ``needs_summary`` is set when the pending
+    fragments should be folded into the summary before upserting. Nodes without
+    the summary state (``summary``, ``pending_description`` and
+    ``pending_tokens``), e.g. from backends with a fixed node schema such as
+    Oracle, are read like nodes written before it was tracked: their whole
+    description is pending and summarized again once it reaches
+    ``entity_summary_to_max_tokens``.
+    """
     already_entity_types = []
     already_source_ids = []
-    already_description = []
+    # summary state: last summary plus the fragments not yet folded into it
+    summary = ""
+    summary_tokens = 0
+    pending = []
+    pending_tokens = 0
 
-    already_node = await knowledge_graph_inst.get_node(entity_name)
     if already_node is not None:
         already_entity_types.append(already_node["entity_type"])
         already_source_ids.extend(
             split_string_by_multi_markers(already_node["source_id"], [GRAPH_FIELD_SEP])
         )
-        already_description.append(already_node["description"])
+        if _SUMMARY_STATE_FIELDS <= already_node.keys():
+            summary = already_node["summary"]
+            pending = split_string_by_multi_markers(
+                already_node["pending_description"], [GRAPH_FIELD_SEP]
+            )
+            pending_tokens = already_node["pending_tokens"]
+            # the stored description is the summary followed by the pending text
+            summary_tokens = max(
+                0, already_node.get("description_tokens", 0) - pending_tokens
+            )
+        else:
+            # written before summary state was tracked
+            pending = split_string_by_multi_markers(
+                already_node["description"], [GRAPH_FIELD_SEP]
+            )
+            pending_tokens = sum(
+                count_tokens(pending, global_config["tiktoken_model_name"])
+            )
 
     entity_type = sorted(
         Counter(
@@ -189,121 +231,242 @@ async def _merge_nodes_then_upsert(
         key=lambda x: x[1],
         reverse=True,
     )[0][0]
-    description = GRAPH_FIELD_SEP.join(
-        sorted(set([dp["description"] for dp in nodes_data] + already_description))
+    known = set(pending) | {summary}
+    new_fragments = sorted(
+        set(dp["description"] for dp in nodes_data if dp["description"] not in known)
+    )
+    pending = sorted(pending + new_fragments)
+    pending_tokens += sum(
+        count_tokens(new_fragments, global_config["tiktoken_model_name"])
     )
     source_id = GRAPH_FIELD_SEP.join(
         set([dp["source_id"] for dp in nodes_data] + already_source_ids)
     )
-    description = await _handle_entity_relation_summary(
-        entity_name, description, global_config
+    # summarize once the unsummarized text is long enough, and afterwards only
+    # when enough new fragments have piled up since the last summary
+    threshold = (
+        global_config.get("entity_summary_refresh_tokens", 0)
+        if summary
+        else global_config["entity_summary_to_max_tokens"]
     )
-    node_data = dict(
-        role="entity",
+    return dict(
+        entity_name=entity_name,
         entity_type=entity_type,
-        description=description,
         source_id=source_id,
+        summary=summary,
+        summary_tokens=summary_tokens,
+        pending=pending,
+        pending_tokens=pending_tokens,
+        needs_summary=bool(pending) and pending_tokens >= threshold,
     )
-    await knowledge_graph_inst.upsert_node(
-        entity_name,
-        node_data=node_data,
-    )
-    node_data["entity_name"] = entity_name
-    return node_data
 
 
-async def _merge_edges_then_upsert(
-    entity_name: str,
-    nodes_data: list[dict],
-    knowledge_graph_inst: BaseGraphStorage,
-    global_config: dict,
-):
-    edge_data = []
-    
-    for node in nodes_data:
-        source_id = node["source_id"]
-        hyper_relation = node["hyper_relation"]
-        weight = node["weight"]
-        
-        already_weights = []
-        already_source_ids = []
-        
-        if await knowledge_graph_inst.has_edge(hyper_relation, entity_name):
-            already_edge = await knowledge_graph_inst.get_edge(hyper_relation, entity_name)
-            already_weights.append(already_edge["weight"])
-            already_source_ids.extend(
-                split_string_by_multi_markers(already_edge["source_id"], [GRAPH_FIELD_SEP])
+def _entity_node_data(state: dict, global_config: dict) -> dict:
+    summary, pending = state["summary"], state["pending"]
+    description = GRAPH_FIELD_SEP.join(([summary] if summary else []) + pending)
+    return dict(
+        role="entity",
+        entity_type=state["entity_type"],
+        description=description,
+        source_id=state["source_id"],
+        description_tokens=len(
+            encode_string_by_tiktoken(
+                description, model_name=global_config["tiktoken_model_name"]
             )
-        
-        weight = sum([weight] + already_weights)
-        source_id = GRAPH_FIELD_SEP.join(
-            set([source_id] + already_source_ids)
+        ),
+        summary=summary,
+        pending_description=GRAPH_FIELD_SEP.join(pending),
+        pending_tokens=state["pending_tokens"],
+    )
+
+
+async def _summarize_entities_batch(
+    states: list[dict], global_config: dict
+) -> list[Union[str, None]]:
+    """One LLM call summarizing several entities; None where a result is missing"""
+    use_llm_func: callable = global_config["llm_model_func"]
+    summary_max_tokens = global_config["entity_summary_to_max_tokens"]
+    language = global_config["addon_params"].get(
+        "language", PROMPTS["DEFAULT_LANGUAGE"]
+    )
+    items = "\n".join(
+        f"[{i}] Entities: {state['entity_name']}\n"
+        f"Description List: {([state['summary']] if state['summary'] else []) + state['pending']}"
+        for i, state in enumerate(states, start=1)
+    )
+    use_prompt = PROMPTS["summarize_entity_descriptions_batch"].format(
+        items=items, language=language
+    )
+    logger.debug(f"Trigger batched summary of {len(states)} entities")
+    result = await use_llm_func(
+        use_prompt, max_tokens=summary_max_tokens * len(states)
+    )
+    try:
+        parsed = json.loads(re.search(r"{.*}", result, re.DOTALL).group(0))
+    except (AttributeError, json.JSONDecodeError):
+        return [None] * len(states)
+    summaries = []
+    for i in range(1, len(states) + 1):
+        summary = parsed.get(str(i)) if isinstance(parsed, dict) else None
+        summaries.append(summary.strip() if isinstance(summary, str) else None)
+    return summaries
+
+
+async def _summarize_entities(states: list[dict], global_config: dict):
+    """Fold pending fragments into the summary of every state that needs it.
+
+    Entities are packed into batched requests of up to
+    ``entity_summary_batch_size`` entities and
+    ``entity_summary_batch_max_tokens`` input tokens, never more than fit in
+    ``llm_model_max_token_size``; an entity too long for that gets a call of
+    its own, which truncates it. Entities whose result cannot be parsed fall
+    back to a single-entity call.
+    """
+    todo = [state for state in states if state["needs_summary"]]
+    if not todo:
+        return
+    batch_size = global_config.get("entity_summary_batch_size", 1)
+    prompt_tokens = len(
+        encode_string_by_tiktoken(
+            PROMPTS["summarize_entity_descriptions_batch"],
+            model_name=global_config["tiktoken_model_name"],
         )
+    )
+    budget = min(
+        global_config.get("entity_summary_batch_max_tokens", 0),
+        global_config["llm_model_max_token_size"] - prompt_tokens,
+    )
 
-        await knowledge_graph_inst.upsert_edge(
-            hyper_relation,
-            entity_name,
-            edge_data=dict(
-                weight=weight,
-                source_id=source_id,
-            ),
+    batches, batch, batch_tokens = [], [], 0
+    for state in todo:
+        tokens = state["pending_tokens"] + state["summary_tokens"]
+        if batch and (len(batch) >= batch_size or batch_tokens + tokens > budget):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(state)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+
+    async def _run(batch: list[dict]):
+        summaries = (
+            await _summarize_entities_batch(batch, global_config)
+            if len(batch) > 1
+            else [None]
         )
+        for state, summary in zip(batch, summaries):
+            if summary is None:
+                summary = await _handle_entity_relation_summary(
+                    state["entity_name"],
+                    state["summary"],
+                    state["pending"],
+                    global_config,
+                )
+            state.update(summary=summary, pending=[], pending_tokens=0)
+            state["needs_summary"] = False
 
-        edge_data.append(dict(
-            src_id=hyper_relation,
-            tgt_id=entity_name,
-            weight=weight,
-        ))
+    await asyncio.gather(*[_run(batch) for batch in batches])
 
-    return edge_data
 
+def _merge_edge(
+    nodes_data: list[dict], already_edge: Union[dict, None]
+) -> dict:
+    already_weights = []
+    already_source_ids = []
 
-async def extract_entities(
-    chunks: dict[str, TextChunkSchema],
-    knowledge_graph_inst: BaseGraphStorage,
-    entity_vdb: BaseVectorStorage,
-    hyperedge_vdb: BaseVectorStorage,
-    global_config: dict,
-) -> Union[BaseGraphStorage, None]:
-    use_llm_func: callable = global_config["llm_model_func"]
-    entity_extract_max_gleaning = global_config["entity_extract_max_gleaning"]
+    if already_edge is not None:
+        already_weights.append(already_edge["weight"])
+        already_source_ids.extend(
+            split_string_by_multi_markers(already_edge["source_id"], [GRAPH_FIELD_SEP])
+        )
 
-    ordered_chunks = list(chunks.items())
-    # add language and example number params to prompt
-    language = global_config["addon_params"].get(
-        "language", PROMPTS["DEFAULT_LANGUAGE"]
+    weight = sum([dp["weight"] for dp in nodes_data] + already_weights)
+    source_id = GRAPH_FIELD_SEP.join(
+        set([dp["source_id"] for dp in nodes_data] + already_source_ids)
     )
-    entity_types = global_config["addon_params"].get(
-        "entity_types", PROMPTS["DEFAULT_ENTITY_TYPES"]
+    return dict(
+        weight=weight,
+        source_id=source_id,
     )
-    example_number = global_config["addon_params"].get("example_number", None)
-    if example_number and example_number < len(PROMPTS["entity_extraction_examples"]):
-        examples = "\n".join(
-            PROMPTS["entity_extraction_examples"][: int(example_number)]
-        )
-    else:
-        examples = "\n".join(PROMPTS["entity_extraction_examples"])
 
-    example_context_base = dict(
+
+async def _upsert_in_batches(upsert, items: list, batch_size: int, desc: str):
+    """Write `items` through a bulk graph upsert, `batch_size` rows per call"""
+    for start in tqdm_async(
+        range(0, len(items), batch_size), desc=desc, unit="batch"
+    ):
+        await upsert(items[start : start + batch_size])
+
+
+@lru_cache(maxsize=16)
+def _render_extraction_prompt(
+    template: str,
+    all_examples: tuple[str, ...],
+    language: str,
+    entity_types: tuple[str, ...],
+    example_number: Union[int, None],
+) -> tuple[str, str]:
+    if example_number and example_number < len(all_examples):
+        examples = "\n".join(all_examples[: int(example_number)])
+    else:
+        examples = "\n".join(all_examples)
+    delimiters = dict(
         tuple_delimiter=PROMPTS["DEFAULT_TUPLE_DELIMITER"],
         record_delimiter=PROMPTS["DEFAULT_RECORD_DELIMITER"],
         completion_delimiter=PROMPTS["DEFAULT_COMPLETION_DELIMITER"],
-        entity_types=",".join(entity_types),
-        language=language,
     )
     # add example's format
-    examples = examples.format(**example_context_base)
-
-    entity_extract_prompt = PROMPTS["entity_extraction"]
-    context_base = dict(
-        tuple_delimiter=PROMPTS["DEFAULT_TUPLE_DELIMITER"],
-        record_delimiter=PROMPTS["DEFAULT_RECORD_DELIMITER"],
-        completion_delimiter=PROMPTS["DEFAULT_COMPLETION_DELIMITER"],
-        # entity_types=",".join(entity_types),
-        examples=examples,
-        language=language,
+    examples = examples.format(
+        **delimiters, entity_types=",".join(entity_types), language=language
+    )
+    prompt = template.format(
+        **delimiters, examples=examples, language=language, input_text="{input_text}"
+    )
+    prefix, _, suffix = prompt.partition("{input_text}")
+    return prefix, suffix
+
+
+def _extraction_prompt(global_config: dict) -> tuple[str, str]:
+    """Entity-extraction prompt with its static parts rendered once per config.
+
+    Returns the text before and after the input, so building the prompt for a
+    chunk or query is a plain concatenation.
+    """
+    addon_params = global_config["addon_params"]
+    return _render_extraction_prompt(
+        PROMPTS["entity_extraction"],
+        tuple(PROMPTS["entity_extraction_examples"]),
+        addon_params.get("language", PROMPTS["DEFAULT_LANGUAGE"]),
+        tuple(addon_params.get("entity_types", PROMPTS["DEFAULT_ENTITY_TYPES"])),
+        addon_params.get("example_number", None),
     )
 
+
+async def extract_entities(
+    chunks: Union[
+        dict[str, TextChunkSchema], AsyncIterable[dict[str, TextChunkSchema]]
+    ],
+    knowledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage,
+    hyperedge_vdb: BaseVectorStorage,
+    global_config: dict,
+    extraction_checkpoint: BaseKVStorage = None,
+) -> Union[BaseGraphStorage, None]:
+    """Extract entities and hyperedges from ``chunks`` and merge them into the
+    graph and vector stores.
+
+    ``chunks`` is either a dict of chunks or an async iterable of such dicts;
+    extraction of each dict starts as soon as it is yielded, so chunking and
+    extraction overlap. The merge runs once every chunk is extracted.
+    """
+    use_llm_func: callable = global_config["llm_model_func"]
+    entity_extract_max_gleaning = global_config["entity_extract_max_gleaning"]
+
+    prompt_prefix, prompt_suffix = _extraction_prompt(global_config)
+    record_delimiter = PROMPTS["DEFAULT_RECORD_DELIMITER"]
+    completion_delimiter = PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+    tuple_delimiter = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+
     continue_prompt = PROMPTS["entiti_continue_extraction"]
     if_loop_prompt = PROMPTS["entiti_if_loop_extraction"]
 
@@ -316,10 +479,7 @@ async def extract_entities(
         chunk_key = chunk_key_dp[0]
         chunk_dp = chunk_key_dp[1]
         content = chunk_dp["content"]
-        # hint_prompt = entity_extract_prompt.format(**context_base, input_text=content)
-        hint_prompt = entity_extract_prompt.format(
-            **context_base, input_text="{input_text}"
-        ).format(**context_base, input_text=content)
+        hint_prompt = prompt_prefix + content + prompt_suffix
 
         final_result = await use_llm_func(hint_prompt)
         history = pack_user_ass_to_openai_messages(hint_prompt, final_result)
@@ -339,8 +499,7 @@ async def extract_entities(
                 break
 
         records = split_string_by_multi_markers(
-            final_result,
-            [context_base["record_delimiter"], context_base["completion_delimiter"]],
+            final_result, [record_delimiter, completion_delimiter]
         )
 
         maybe_nodes = defaultdict(list)
@@ -352,7 +511,7 @@ async def extract_entities(
                 continue
             record = record.group(1)
             record_attributes = split_string_by_multi_markers(
-                record, [context_base["tuple_delimiter"]]
+                record, [tuple_delimiter]
             )
             if_relation = await _handle_single_hyperrelation_extraction(
                 record_attributes, chunk_key
@@ -384,13 +543,85 @@ async def extract_entities(
         return dict(maybe_nodes), dict(maybe_edges)
 
     results = []
-    for result in tqdm_async(
-        asyncio.as_completed([_process_single_content(c) for c in ordered_chunks]),
-        total=len(ordered_chunks),
-        desc="Extracting entities from chunks",
-        unit="chunk",
-    ):
-        results.append(await result)
+
+    async def _pending_chunks(
+        ordered_chunks: list[tuple[str, TextChunkSchema]],
+    ) -> list[tuple[str, TextChunkSchema]]:
+        """Chunks without a checkpointed result; the others go to ``results``"""
+        if extraction_checkpoint is None:
+            return ordered_chunks
+        checkpointed = await extraction_checkpoint.get_by_ids(
+            [k for k, _ in ordered_chunks]
+        )
+        # some backends return only the records they found, in any order,
+        # so match them by the chunk key stored in each record
+        checkpointed = {
+            dp["chunk_key"]: dp
+            for dp in checkpointed or []
+            if dp is not None and "chunk_key" in dp
+        }
+        pending_chunks = []
+        for chunk_key_dp in ordered_chunks:
+            dp = checkpointed.get(chunk_key_dp[0])
+            if dp is None:
+                pending_chunks.append(chunk_key_dp)
+            else:
+                results.append((dp["maybe_nodes"], dp["maybe_edges"]))
+        return pending_chunks
+
+    checkpoint_interval = global_config.get("extraction_checkpoint_interval", 32)
+    checkpoint_lock = asyncio.Lock()
+    unflushed = 0
+
+    async def _process_and_checkpoint(chunk_key_dp: tuple[str, TextChunkSchema]):
+        nonlocal unflushed
+        m_nodes, m_edges = await _process_single_content(chunk_key_dp)
+        if extraction_checkpoint is not None:
+            await extraction_checkpoint.upsert(
+                {
+                    chunk_key_dp[0]: {
+                        "chunk_key": chunk_key_dp[0],
+                        "maybe_nodes": m_nodes,
+                        "maybe_edges": m_edges,
+                    }
+                }
+            )
+            unflushed += 1
+            if unflushed >= checkpoint_interval:
+                async with checkpoint_lock:
+                    if unflushed >= checkpoint_interval:
+                        unflushed = 0
+                        await extraction_checkpoint.index_done_callback()
+        return m_nodes, m_edges
+
+    async def _chunk_batches():
+        if isinstance(chunks, dict):
+            yield chunks
+        else:
+            async for batch in chunks:
+                yield batch
+
+    tasks = []
+    try:
+        async for batch in _chunk_batches():
+            for chunk_key_dp in await _pending_chunks(list(batch.items())):
+                tasks.append(asyncio.create_task(_process_and_checkpoint(chunk_key_dp)))
+        if results:
+            logger.info(f"Resuming from {len(results)} checkpointed chunks")
+        for result in tqdm_async(
+            asyncio.as_completed(tasks),
+            total=len(tasks),
+            desc="Extracting entities from chunks",
+            unit="chunk",
+        ):
+            results.append(await result)
+    finally:
+        for task in tasks:
+            task.cancel()
+    if extraction_checkpoint is not None and unflushed:
+        await extraction_checkpoint.index_done_callback()
+    if not results:
+        return None
 
     maybe_nodes = defaultdict(list)
     maybe_edges = defaultdict(list)
@@ -400,50 +631,69 @@ async def extract_entities(
         for k, v in m_edges.items():
             maybe_edges[k].extend(v)
             
+    # read every stored record once, merge in memory, write back in bulk
+    upsert_batch_size = global_config.get("graph_upsert_batch_size", 500)
+
     logger.info("Inserting hyperedges into storage...")
-    all_hyperedges_data = []
-    for result in tqdm_async(
-        asyncio.as_completed(
-            [
-                _merge_hyperedges_then_upsert(k, v, knowledge_graph_inst, global_config)
-                for k, v in maybe_edges.items()
-            ]
-        ),
-        total=len(maybe_edges),
-        desc="Inserting hyperedges",
-        unit="entity",
-    ):
-        all_hyperedges_data.append(await result)
-            
+    hyperedge_names = list(maybe_edges)
+    already_hyperedges = await knowledge_graph_inst.get_nodes_batch(hyperedge_names)
+    hyperedge_nodes = [
+        (k, _merge_hyperedge(k, maybe_edges[k], already, global_config))
+        for k, already in zip(hyperedge_names, already_hyperedges)
+    ]
+    await _upsert_in_batches(
+        knowledge_graph_inst.upsert_nodes,
+        hyperedge_nodes,
+        upsert_batch_size,
+        "Inserting hyperedges",
+    )
+    all_hyperedges_data = [
+        dict(node_data, hyperedge_name=k) for k, node_data in hyperedge_nodes
+    ]
+
     logger.info("Inserting entities into storage...")
-    all_entities_data = []
-    for result in tqdm_async(
-        asyncio.as_completed(
-            [
-                _merge_nodes_then_upsert(k, v, knowledge_graph_inst, global_config)
-                for k, v in maybe_nodes.items()
-            ]
-        ),
-        total=len(maybe_nodes),
-        desc="Inserting entities",
-        unit="entity",
-    ):
-        all_entities_data.append(await result)
+    entity_names = list(maybe_nodes)
+    already_nodes = await knowledge_graph_inst.get_nodes_batch(entity_names)
+    entity_states = [
+        _merge_nodes(k, maybe_nodes[k], already, global_config)
+        for k, already in zip(entity_names, already_nodes)
+    ]
+    await _summarize_entities(entity_states, global_config)
+    entity_nodes = [
+        (state["entity_name"], _entity_node_data(state, global_config))
+        for state in entity_states
+    ]
+    await _upsert_in_batches(
+        knowledge_graph_inst.upsert_nodes,
+        entity_nodes,
+        upsert_batch_size,
+        "Inserting entities",
+    )
+    all_entities_data = [
+        dict(node_data, entity_name=k) for k, node_data in entity_nodes
+    ]
 
     logger.info("Inserting relationships into storage...")
-    all_relationships_data = []
-    for result in tqdm_async(
-        asyncio.as_completed(
-            [
-                _merge_edges_then_upsert(k, v, knowledge_graph_inst, global_config)
-                for k, v in maybe_nodes.items()
-            ]
-        ),
-        total=len(maybe_nodes),
-        desc="Inserting relationships",
-        unit="relationship",
-    ):
-        all_relationships_data.append(await result)
+    maybe_links = defaultdict(list)
+    for entity_name, nodes_data in maybe_nodes.items():
+        for dp in nodes_data:
+            maybe_links[(dp["hyper_relation"], entity_name)].append(dp)
+    edge_pairs = list(maybe_links)
+    already_edges = await knowledge_graph_inst.get_edges_batch(edge_pairs)
+    edges = [
+        (src, tgt, _merge_edge(maybe_links[(src, tgt)], already))
+        for (src, tgt), already in zip(edge_pairs, already_edges)
+    ]
+    await _upsert_in_batches(
+        knowledge_graph_inst.upsert_edges,
+        edges,
+        upsert_batch_size,
+        "Inserting relationships",
+    )
+    all_relationships_data = [
+        dict(src_id=src, tgt_id=tgt, weight=edge_data["weight"])
+        for src, tgt, edge_data in edges
+    ]
 
     if not len(all_hyperedges_data) and not len(all_entities_data) and not len(all_relationships_data):
         logger.warning(
@@ -481,119 +731,178 @@ async def extract_entities(
     return knowledge_graph_inst
 
 
-async def kg_query(
-    query,
-    knowledge_graph_inst: BaseGraphStorage,
-    entities_vdb: BaseVectorStorage,
-    hyperedges_vdb: BaseVectorStorage,
-    text_chunks_db: BaseKVStorage[TextChunkSchema],
-    query_param: QueryParam,
-    global_config: dict,
-    hashing_kv: BaseKVStorage = None,
-) -> str:
-    # Handle cache
-    use_model_func = global_config["llm_model_func"]
-    args_hash = compute_args_hash(query_param.mode, query)
-    cached_response, quantized, min_val, max_val = await handle_cache(
-        hashing_kv, args_hash, query, query_param.mode
-    )
-    if cached_response is not None:
-        return cached_response
-    
-    language = global_config["addon_params"].get(
-        "language", PROMPTS["DEFAULT_LANGUAGE"]
-    )
-    entity_types = global_config["addon_params"].get(
-        "entity_types", PROMPTS["DEFAULT_ENTITY_TYPES"]
+def _normalize_query(query: str) -> str:
+    return " ".join(query.lower().split()).rstrip("?!.。？！ ")
+
+
+def _parse_query_keywords(result: str) -> tuple[list[str], list[str]]:
+    hl_keywords, ll_keywords = [], []
+    records = split_string_by_multi_markers(
+        result,
+        [PROMPTS["DEFAULT_RECORD_DELIMITER"], PROMPTS["DEFAULT_COMPLETION_DELIMITER"]],
     )
-    example_number = global_config["addon_params"].get("example_number", None)
-    if example_number and example_number < len(PROMPTS["entity_extraction_examples"]):
-        examples = "\n".join(
-            PROMPTS["entity_extraction_examples"][: int(example_number)]
+    for record in records:
+        record = re.search(r"\((.*)\)", record)
+        if record is None:
+            continue
+        record = record.group(1)
+        record_attributes = split_string_by_multi_markers(
+            record, [PROMPTS["DEFAULT_TUPLE_DELIMITER"]]
         )
-    else:
-        examples = "\n".join(PROMPTS["entity_extraction_examples"])
-
-    example_context_base = dict(
-        tuple_delimiter=PROMPTS["DEFAULT_TUPLE_DELIMITER"],
-        record_delimiter=PROMPTS["DEFAULT_RECORD_DELIMITER"],
-        completion_delimiter=PROMPTS["DEFAULT_COMPLETION_DELIMITER"],
-        entity_types=",".join(entity_types),
-        language=language,
+        if len(record_attributes) == 3 and record_attributes[0] == '"hyper-relation"':
+            hl_keywords.append("<hyperedge>"+clean_str(record_attributes[1]))
+        elif len(record_attributes) == 5 and record_attributes[0] == '"entity"':
+            ll_keywords.append(clean_str(record_attributes[1]).upper())
+    return hl_keywords, ll_keywords
+
+
+async def _extract_query_keywords(
+    query: str, global_config: dict, keywords_kv: BaseKVStorage = None
+) -> Union[tuple[list[str], list[str]], None]:
+    """High- and low-level keywords of `query`, cached per normalized query.
+
+    The keyword cache is separate from the answer cache, so context-only and
+    repeated queries skip the extraction call; with the embedding cache
+    enabled, paraphrased queries can hit it as well.
+    """
+    prompt_prefix, prompt_suffix = _extraction_prompt(global_config)
+    normalized = _normalize_query(query)
+    # keyed on the rendered prompt too, so changing the language, entity
+    # types or examples does not serve keywords extracted under the old ones
+    args_hash = compute_args_hash(
+        "keywords", prompt_prefix, prompt_suffix, normalized
     )
-    # add example's format
-    examples = examples.format(**example_context_base)
-
-    entity_extract_prompt = PROMPTS["entity_extraction"]
-    context_base = dict(
-        tuple_delimiter=PROMPTS["DEFAULT_TUPLE_DELIMITER"],
-        record_delimiter=PROMPTS["DEFAULT_RECORD_DELIMITER"],
-        completion_delimiter=PROMPTS["DEFAULT_COMPLETION_DELIMITER"],
-        # entity_types=",".join(entity_types),
-        examples=examples,
-        language=language,
+    cached, quantized, min_val, max_val = await handle_cache(
+        keywords_kv, args_hash, normalized, "keywords"
+    )
+    if cached is not None:
+        try:
+            keywords = json.loads(cached)
+            return keywords["hl_keywords"], keywords["ll_keywords"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            logger.warning("Discarding malformed keyword cache entry")
+
+    final_result = await global_config["llm_model_func"](
+        prompt_prefix + query + prompt_suffix
     )
-    
-    hint_prompt = entity_extract_prompt.format(
-        **context_base, input_text="{input_text}"
-    ).format(**context_base, input_text=query)
-
-    final_result = await use_model_func(hint_prompt)
-
     logger.info("kw_prompt result:")
     print(final_result)
-    hl_keywords, ll_keywords = [], []
     try:
-        records = split_string_by_multi_markers(
-            final_result,
-            [context_base["record_delimiter"], context_base["completion_delimiter"]],
-        )
-        for record in records:
-            record = re.search(r"\((.*)\)", record)
-            if record is None:
-                continue
-            record = record.group(1)
-            record_attributes = split_string_by_multi_markers(
-                record, [context_base["tuple_delimiter"]]
-            )
-            if len(record_attributes) == 3 and record_attributes[0] == '"hyper-relation"':
-                hl_keywords.append("<hyperedge>"+clean_str(record_attributes[1]))
-            elif len(record_attributes) == 5 and record_attributes[0] == '"entity"':
-                ll_keywords.append(clean_str(record_attributes[1]).upper())
-            else:
-                continue
+        hl_keywords, ll_keywords = _parse_query_keywords(final_result)
     # Handle parsing error
     except json.JSONDecodeError as e:
         print(f"JSON parsing error: {e} {final_result}")
-        return PROMPTS["fail_response"]
+        return None
+
+    if hl_keywords or ll_keywords:
+        await save_to_cache(
+            keywords_kv,
+            CacheData(
+                args_hash=args_hash,
+                content=json.dumps(
+                    {"hl_keywords": hl_keywords, "ll_keywords": ll_keywords},
+                    ensure_ascii=False,
+                ),
+                prompt=normalized,
+                quantized=quantized,
+                min_val=min_val,
+                max_val=max_val,
+                mode="keywords",
+            ),
+        )
+    return hl_keywords, ll_keywords
+
+
+def _context_args_hash(
+    query: str, query_param: QueryParam, storage_version: str
+) -> Union[str, None]:
+    """Context cache key, or None when the context format is not cacheable"""
+    if not isinstance(query_param.context_format, str):
+        return None
+    return compute_args_hash(
+        query,
+        query_param.mode,
+        query_param.top_k,
+        query_param.max_token_for_text_unit,
+        query_param.max_token_for_global_context,
+        query_param.max_token_for_local_context,
+        query_param.context_format,
+        storage_version,
+    )
+
+
+async def _lookup_query_cache(
+    query: str,
+    query_param: QueryParam,
+    hashing_kv: BaseKVStorage = None,
+    context_kv: BaseKVStorage = None,
+    storage_version: str = "",
+) -> tuple[Union[str, None], dict]:
+    """Cached answer or context of `query`, and the keys needed to store one"""
+    state = dict(hashing_kv=hashing_kv, context_kv=context_kv, context_hash=None)
+    if query_param.only_need_context:
+        # contexts are cached apart from answers, keyed on the storage version
+        # so that a finished insert or delete never serves a stale context
+        state["context_hash"] = _context_args_hash(query, query_param, storage_version)
+        if context_kv is not None and state["context_hash"] is not None:
+            cached_context = await response_cache(context_kv).get(
+                "context", state["context_hash"]
+            )
+            if cached_context is not None:
+                return cached_context["return"], state
+        state["hashing_kv"] = None
+    state["args_hash"] = compute_args_hash(query_param.mode, query)
+    cached_response, quantized, min_val, max_val = await handle_cache(
+        state["hashing_kv"], state["args_hash"], query, query_param.mode
+    )
+    state.update(quantized=quantized, min_val=min_val, max_val=max_val)
+    return cached_response, state
+
+
+async def _query_keywords(
+    query: str,
+    query_param: QueryParam,
+    global_config: dict,
+    keywords_kv: BaseKVStorage = None,
+) -> Union[tuple[str, str], None]:
+    """Joined (low level, high level) keywords, or None if the query can't be answered"""
+    keywords = await _extract_query_keywords(query, global_config, keywords_kv)
+    if keywords is None:
+        return None
+    hl_keywords, ll_keywords = keywords
 
     # Handdle keywords missing
     if hl_keywords == [] and ll_keywords == []:
         logger.warning("low_level_keywords and high_level_keywords is empty")
-        return PROMPTS["fail_response"]
+        return None
     if ll_keywords == [] and query_param.mode in ["hybrid"]:
         logger.warning("low_level_keywords is empty")
-        return PROMPTS["fail_response"]
-    else:
-        ll_keywords = ", ".join(ll_keywords)
+        return None
     if hl_keywords == [] and query_param.mode in ["hybrid"]:
         logger.warning("high_level_keywords is empty")
-        return PROMPTS["fail_response"]
-    else:
-        hl_keywords = ", ".join(hl_keywords)
+        return None
+    return ", ".join(ll_keywords), ", ".join(hl_keywords)
 
-    # Build context
-    keywords = [ll_keywords, hl_keywords]
-    context = await _build_query_context(
-        keywords,
-        knowledge_graph_inst,
-        entities_vdb,
-        hyperedges_vdb,
-        text_chunks_db,
-        query_param,
-    )
 
+async def _finish_query(
+    query: str,
+    context: str,
+    state: dict,
+    query_param: QueryParam,
+    global_config: dict,
+) -> str:
+    """Cache and return a context-only result, or generate and cache the answer"""
     if query_param.only_need_context:
+        if state["context_hash"] is not None:
+            await save_to_cache(
+                state["context_kv"],
+                CacheData(
+                    args_hash=state["context_hash"],
+                    content=context,
+                    prompt=query,
+                    mode="context",
+                ),
+            )
         return context
     if context is None:
         return PROMPTS["fail_response"]
@@ -603,7 +912,7 @@ async def kg_query(
     )
     if query_param.only_need_prompt:
         return sys_prompt
-    response = await use_model_func(
+    response = await global_config["llm_model_func"](
         query,
         system_prompt=sys_prompt,
         stream=query_param.stream,
@@ -621,139 +930,347 @@ async def kg_query(
 
     # Save to cache
     await save_to_cache(
-        hashing_kv,
+        state["hashing_kv"],
         CacheData(
-            args_hash=args_hash,
+            args_hash=state["args_hash"],
             content=response,
             prompt=query,
-            quantized=quantized,
-            min_val=min_val,
-            max_val=max_val,
+            quantized=state["quantized"],
+            min_val=state["min_val"],
+            max_val=state["max_val"],
             mode=query_param.mode,
         ),
     )
     return response
 
 
-async def _build_query_context(
-    query: list,
+async def kg_query(
+    query,
     knowledge_graph_inst: BaseGraphStorage,
     entities_vdb: BaseVectorStorage,
     hyperedges_vdb: BaseVectorStorage,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
-):
+    global_config: dict,
+    hashing_kv: BaseKVStorage = None,
+    keywords_kv: BaseKVStorage = None,
+    context_kv: BaseKVStorage = None,
+    storage_version: str = "",
+) -> str:
+    # Handle cache
+    cached_response, state = await _lookup_query_cache(
+        query, query_param, hashing_kv, context_kv, storage_version
+    )
+    if cached_response is not None:
+        return cached_response
+
+    keywords = await _query_keywords(query, query_param, global_config, keywords_kv)
+    if keywords is None:
+        return PROMPTS["fail_response"]
+
+    # Build context
+    context = await _build_query_context(
+        keywords,
+        knowledge_graph_inst,
+        entities_vdb,
+        hyperedges_vdb,
+        text_chunks_db,
+        query_param,
+    )
+    return await _finish_query(query, context, state, query_param, global_config)
+
 
-    ll_kewwords, hl_keywrds = query[0], query[1]
-    if query_param.mode in ["local", "hybrid"]:
-        if ll_kewwords == "":
-            ll_entities_context, ll_relations_context, ll_text_units_context = (
-                "",
-                "",
-                "",
+async def kg_query_batch(
+    queries: list[str],
+    knowledge_graph_inst: BaseGraphStorage,
+    entities_vdb: BaseVectorStorage,
+    hyperedges_vdb: BaseVectorStorage,
+    text_chunks_db: BaseKVStorage[TextChunkSchema],
+    query_param: QueryParam,
+    global_config: dict,
+    hashing_kv: BaseKVStorage = None,
+    keywords_kv: BaseKVStorage = None,
+    context_kv: BaseKVStorage = None,
+    storage_version: str = "",
+    max_concurrency: int = 16,
+) -> list[str]:
+    """`kg_query` for several queries, sharing work across the batch.
+
+    Cache lookups, keyword extraction and answer generation run per query, at
+    most `max_concurrency` at a time. The keyword strings of all queries are
+    embedded together, each vector store is searched once for the whole
+    batch, and graph and text chunk reads are memoized across queries.
+    Results are returned in the order of `queries`.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    results = [None] * len(queries)
+    states = [None] * len(queries)
+    keywords = [None] * len(queries)
+
+    async def _prepare(i: int):
+        async with semaphore:
+            results[i], states[i] = await _lookup_query_cache(
+                queries[i], query_param, hashing_kv, context_kv, storage_version
             )
-            warnings.warn(
-                "Low Level context is None. Return empty Low entity/relationship/source"
+            if results[i] is not None:
+                return
+            keywords[i] = await _query_keywords(
+                queries[i], query_param, global_config, keywords_kv
             )
-            query_param.mode = "global"
-        else:
-            (
-                ll_entities_context,
-                ll_relations_context,
-                ll_text_units_context,
-            ) = await _get_node_data(
-                ll_kewwords,
-                knowledge_graph_inst,
-                entities_vdb,
-                text_chunks_db,
+            if keywords[i] is None:
+                results[i] = PROMPTS["fail_response"]
+
+    await asyncio.gather(*[_prepare(i) for i in range(len(queries))])
+    pending = [i for i in range(len(queries)) if results[i] is None]
+
+    branches = {i: _query_branches(query_param, *keywords[i]) for i in pending}
+    local = [i for i in pending if branches[i][0]]
+    global_ = [i for i in pending if branches[i][1]]
+    ll_results, hl_results = await _search_keywords(
+        entities_vdb,
+        hyperedges_vdb,
+        [keywords[i][0] for i in local],
+        [keywords[i][1] for i in global_],
+        query_param.top_k,
+    )
+    ll_results, hl_results = dict(zip(local, ll_results)), dict(zip(global_, hl_results))
+    graph_reads = _GraphReads(knowledge_graph_inst)
+    text_chunk_reads = _TextChunkReads(text_chunks_db)
+
+    async def _answer(i: int):
+        async with semaphore:
+            context = await _assemble_query_context(
+                ll_results.get(i),
+                hl_results.get(i),
+                graph_reads,
+                text_chunk_reads,
                 query_param,
             )
-    if query_param.mode in ["global", "hybrid"]:
-        if hl_keywrds == "":
-            hl_entities_context, hl_relations_context, hl_text_units_context = (
-                "",
-                "",
-                "",
+            results[i] = await _finish_query(
+                queries[i], context, states[i], query_param, global_config
             )
-            warnings.warn(
-                "High Level context is None. Return empty High entity/relationship/source"
-            )
-            query_param.mode = "local"
-        else:
-            (
-                hl_entities_context,
-                hl_relations_context,
-                hl_text_units_context,
-            ) = await _get_edge_data(
-                hl_keywrds,
-                knowledge_graph_inst,
-                hyperedges_vdb,
-                text_chunks_db,
-                query_param,
-            )
-            if (
-                hl_entities_context == ""
-                and hl_relations_context == ""
-                and hl_text_units_context == ""
-            ):
-                logger.warn("No high level context found. Switching to local mode.")
-                query_param.mode = "local"
-    if query_param.mode == "hybrid":
-        entities_context, relations_context, text_units_context = combine_contexts(
-            [hl_entities_context, ll_entities_context],
-            [hl_relations_context, ll_relations_context],
-            [hl_text_units_context, ll_text_units_context],
+
+    await asyncio.gather(*[_answer(i) for i in pending])
+    return results
+
+
+class _ReadMemo:
+    """Memoizes keyed reads for one query, sharing in-flight fetches.
+
+    Concurrent retrieval branches asking for the same keys wait on a single
+    backend call instead of issuing their own.
+    """
+
+    def __init__(self):
+        self._results: dict = {}
+
+    async def _read(self, kind: str, keys: list, fetch) -> list:
+        loop = asyncio.get_running_loop()
+        missing = []
+        for key in dict.fromkeys(keys):
+            if (kind, key) not in self._results:
+                self._results[(kind, key)] = loop.create_future()
+                missing.append(key)
+        if missing:
+            try:
+                values = await fetch(missing)
+            except BaseException as e:
+                for key in missing:
+                    future = self._results.pop((kind, key))
+                    if isinstance(e, asyncio.CancelledError):
+                        future.cancel()
+                    else:
+                        future.set_exception(e)
+                        future.exception()  # re-raised below, don't log it twice
+                raise
+            for key, value in zip(missing, values):
+                self._results[(kind, key)].set_result(value)
+        return [await self._results[(kind, key)] for key in keys]
+
+
+class _GraphReads(_ReadMemo):
+    """Read-only view of a graph storage with per-query memoized batch reads"""
+
+    def __init__(self, graph: BaseGraphStorage):
+        super().__init__()
+        self._graph = graph
+
+    async def get_nodes_batch(self, node_ids: list[str]) -> list[Union[dict, None]]:
+        return await self._read("node", node_ids, self._graph.get_nodes_batch)
+
+    async def node_degrees_batch(self, node_ids: list[str]) -> list[int]:
+        return await self._read("degree", node_ids, self._graph.node_degrees_batch)
+
+    async def get_edges_batch(
+        self, edge_pairs: list[tuple[str, str]]
+    ) -> list[Union[dict, None]]:
+        return await self._read(
+            "edge", [tuple(pair) for pair in edge_pairs], self._graph.get_edges_batch
         )
-    elif query_param.mode == "local":
-        entities_context, relations_context, text_units_context = (
-            ll_entities_context,
-            ll_relations_context,
-            ll_text_units_context,
+
+    async def edge_degrees_batch(self, edge_pairs: list[tuple[str, str]]) -> list[int]:
+        degrees = await self.node_degrees_batch([n for pair in edge_pairs for n in pair])
+        return [(src or 0) + (tgt or 0) for src, tgt in zip(degrees[0::2], degrees[1::2])]
+
+    async def get_node_edges_batch(self, node_ids: list[str]):
+        return await self._read(
+            "node_edges", node_ids, self._graph.get_node_edges_batch
         )
-    elif query_param.mode == "global":
-        entities_context, relations_context, text_units_context = (
-            hl_entities_context,
-            hl_relations_context,
-            hl_text_units_context,
+
+
+class _TextChunkReads(_ReadMemo):
+    """Read-only view of the text chunk store with per-query memoized reads"""
+
+    def __init__(self, text_chunks_db: BaseKVStorage[TextChunkSchema]):
+        super().__init__()
+        self._text_chunks_db = text_chunks_db
+
+    async def _fetch(self, ids: list[str]) -> list:
+        return await asyncio.gather(*[self._text_chunks_db.get_by_id(i) for i in ids])
+
+    async def get_by_id(self, id: str) -> Union[TextChunkSchema, None]:
+        return (await self._read("chunk", [id], self._fetch))[0]
+
+
+async def _query_vdb_batch(
+    vdb: BaseVectorStorage, queries: list[str], embeddings: np.ndarray, top_k: int
+) -> list[list[dict]]:
+    if not queries:
+        return []
+    try:
+        return await vdb.query_embeddings(embeddings, top_k)
+    except NotImplementedError:
+        return await vdb.query_batch(queries, top_k=top_k)
+
+
+async def _search_keywords(
+    entities_vdb: BaseVectorStorage,
+    hyperedges_vdb: BaseVectorStorage,
+    ll_keywords: list[str],
+    hl_keywords: list[str],
+    top_k: int,
+) -> tuple[list[list[dict]], list[list[dict]]]:
+    """Search entities by `ll_keywords` and hyperedges by `hl_keywords`.
+
+    All keyword strings are embedded in one call and each store is searched
+    once for all of its queries.
+    """
+    if not ll_keywords and not hl_keywords:
+        return [], []
+    embeddings = await entities_vdb._embed_queries(ll_keywords + hl_keywords)
+    ll_results, hl_results = await asyncio.gather(
+        _query_vdb_batch(
+            entities_vdb, ll_keywords, embeddings[: len(ll_keywords)], top_k
+        ),
+        _query_vdb_batch(
+            hyperedges_vdb, hl_keywords, embeddings[len(ll_keywords) :], top_k
+        ),
+    )
+    return ll_results, hl_results
+
+
+def _query_branches(
+    query_param: QueryParam, ll_keywords: str, hl_keywords: str
+) -> tuple[bool, bool]:
+    """Whether the local and the global branch run for these keywords"""
+    use_local = query_param.mode in ["local", "hybrid"]
+    use_global = query_param.mode in ["global", "hybrid"]
+    # fall back to the other branch instead of switching query_param.mode, so
+    # both branches can be started together
+    if use_local and ll_keywords == "":
+        warnings.warn(
+            "Low Level context is None. Return empty Low entity/relationship/source"
         )
-    return f"""
------Entities-----
-```csv
-{entities_context}
-```
------Relationships-----
-```csv
-{relations_context}
-```
------Sources-----
-```csv
-{text_units_context}
-```
-"""
+        use_local, use_global = False, hl_keywords != ""
+    if use_global and hl_keywords == "":
+        warnings.warn(
+            "High Level context is None. Return empty High entity/relationship/source"
+        )
+        use_local, use_global = ll_keywords != "", False
+    return use_local, use_global
 
 
-async def _get_node_data(
-    query,
+async def _build_query_context(
+    query: list,
     knowledge_graph_inst: BaseGraphStorage,
     entities_vdb: BaseVectorStorage,
+    hyperedges_vdb: BaseVectorStorage,
+    text_chunks_db: BaseKVStorage[TextChunkSchema],
+    query_param: QueryParam,
+):
+    ll_keywords, hl_keywords = query[0], query[1]
+    use_local, use_global = _query_branches(query_param, ll_keywords, hl_keywords)
+    ll_results, hl_results = await _search_keywords(
+        entities_vdb,
+        hyperedges_vdb,
+        [ll_keywords] if use_local else [],
+        [hl_keywords] if use_global else [],
+        query_param.top_k,
+    )
+    return await _assemble_query_context(
+        ll_results[0] if use_local else None,
+        hl_results[0] if use_global else None,
+        _GraphReads(knowledge_graph_inst),
+        _TextChunkReads(text_chunks_db),
+        query_param,
+    )
+
+
+async def _assemble_query_context(
+    ll_results: Union[list[dict], None],
+    hl_results: Union[list[dict], None],
+    graph_reads: _GraphReads,
+    text_chunk_reads: _TextChunkReads,
+    query_param: QueryParam,
+) -> str:
+    """Expand the vector hits of both branches concurrently and render the context.
+
+    A branch whose results are None does not run; both branches read through
+    the same memoized views, so shared nodes and chunks are fetched once.
+    """
+    use_local, use_global = ll_results is not None, hl_results is not None
+
+    async def _empty():
+        return QueryContext()
+
+    ll_context, hl_context = await asyncio.gather(
+        _get_node_data(ll_results, graph_reads, text_chunk_reads, query_param)
+        if use_local
+        else _empty(),
+        _get_edge_data(hl_results, graph_reads, text_chunk_reads, query_param)
+        if use_global
+        else _empty(),
+    )
+    if use_global and hl_context.is_empty():
+        logger.warn("No high level context found. Switching to local mode.")
+        use_global = False
+
+    if use_local and use_global:
+        context = combine_contexts(hl_context, ll_context)
+    elif use_global:
+        context = hl_context
+    else:
+        context = ll_context
+    return render_context(context, query_param.context_format)
+
+
+async def _get_node_data(
+    results: list[dict],
+    knowledge_graph_inst: BaseGraphStorage,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
 ):
-    # get similar entities
-    results = await entities_vdb.query(query, top_k=query_param.top_k)
+    # results are the entities similar to the low level keywords
     if not len(results):
-        return "", "", ""
+        return QueryContext()
     # get entity information
-    node_datas = await asyncio.gather(
-        *[knowledge_graph_inst.get_node(r["entity_name"]) for r in results]
+    entity_names = [r["entity_name"] for r in results]
+    node_datas, node_degrees = await asyncio.gather(
+        knowledge_graph_inst.get_nodes_batch(entity_names),
+        knowledge_graph_inst.node_degrees_batch(entity_names),
     )
     if not all([n is not None for n in node_datas]):
         logger.warning("Some nodes are missing, maybe the storage is damaged")
-
-    # get entity degree
-    node_degrees = await asyncio.gather(
-        *[knowledge_graph_inst.node_degree(r["entity_name"]) for r in results]
-    )
     node_datas = [
         {**n, "entity_name": k["entity_name"], "rank": d}
         for k, n, d in zip(results, node_datas, node_degrees)
@@ -771,37 +1288,16 @@ async def _get_node_data(
         f"Local query uses {len(node_datas)} entites, {len(use_relations)} relations, {len(use_text_units)} text units"
     )
 
-    # build prompt
-    entites_section_list = [["id", "entity", "type", "description"]]
-    for i, n in enumerate(node_datas):
-        entites_section_list.append(
-            [
-                i,
-                n["entity_name"],
-                n.get("entity_type", "UNKNOWN"),
-                n.get("description", "UNKNOWN"),
-            ]
-        )
-    entities_context = list_of_list_to_csv(entites_section_list)
-
-    relations_section_list = [
-        ["id", "hyperedge", "related_entities"]
-    ]
-    for i, e in enumerate(use_relations):
-        relations_section_list.append(
-            [
-                i,
-                e["description"],
-                e["related_nodes"]
-            ]
-        )
-    relations_context = list_of_list_to_csv(relations_section_list)
-
-    text_units_section_list = [["id", "content"]]
-    for i, t in enumerate(use_text_units):
-        text_units_section_list.append([i, t["content"]])
-    text_units_context = list_of_list_to_csv(text_units_section_list)
-    return entities_context, relations_context, text_units_context
+    return QueryContext(
+        entities=[_entity_row(n) for n in node_datas],
+        relations=[
+            RelationContextRow(
+                hyperedge=e["description"], related_entities=e["related_nodes"]
+            )
+            for e in use_relations
+        ],
+        sources=[_source_row(t) for t in use_text_units],
+    )
 
 
 async def _find_most_related_text_unit_from_entities(
@@ -814,8 +1310,8 @@ async def _find_most_related_text_unit_from_entities(
         split_string_by_multi_markers(dp["source_id"], [GRAPH_FIELD_SEP])
         for dp in node_datas
     ]
-    edges = await asyncio.gather(
-        *[knowledge_graph_inst.get_node_edges(dp["entity_name"]) for dp in node_datas]
+    edges = await knowledge_graph_inst.get_node_edges_batch(
+        [dp["entity_name"] for dp in node_datas]
     )
     all_one_hop_nodes = set()
     for this_edges in edges:
@@ -824,8 +1320,8 @@ async def _find_most_related_text_unit_from_entities(
         all_one_hop_nodes.update([e[1] for e in this_edges])
 
     all_one_hop_nodes = list(all_one_hop_nodes)
-    all_one_hop_nodes_data = await asyncio.gather(
-        *[knowledge_graph_inst.get_node(e) for e in all_one_hop_nodes]
+    all_one_hop_nodes_data = await knowledge_graph_inst.get_nodes_batch(
+        all_one_hop_nodes
     )
 
     # Add null check for node data
@@ -872,9 +1368,10 @@ async def _find_most_related_text_unit_from_entities(
         all_text_units,
         key=lambda x: x["data"]["content"],
         max_token_size=query_param.max_token_for_text_unit,
+        token_key=lambda x: x["data"].get("tokens"),
     )
 
-    all_text_units = [t["data"] for t in all_text_units]
+    all_text_units = [{**t["data"], "id": t["id"]} for t in all_text_units]
     return all_text_units
 
 
@@ -883,8 +1380,8 @@ async def _find_most_related_edges_from_entities(
     query_param: QueryParam,
     knowledge_graph_inst: BaseGraphStorage,
 ):
-    all_related_edges = await asyncio.gather(
-        *[knowledge_graph_inst.get_node_edges(dp["entity_name"]) for dp in node_datas]
+    all_related_edges = await knowledge_graph_inst.get_node_edges_batch(
+        [dp["entity_name"] for dp in node_datas]
     )
     all_edges = []
     seen = set()
@@ -896,11 +1393,9 @@ async def _find_most_related_edges_from_entities(
                 seen.add(sorted_edge)
                 all_edges.append(sorted_edge)
 
-    all_edges_pack = await asyncio.gather(
-        *[knowledge_graph_inst.get_edge(e[0], e[1]) for e in all_edges]
-    )
-    all_edges_degree = await asyncio.gather(
-        *[knowledge_graph_inst.edge_degree(e[0], e[1]) for e in all_edges]
+    all_edges_pack, all_edges_degree = await asyncio.gather(
+        knowledge_graph_inst.get_edges_batch(all_edges),
+        knowledge_graph_inst.edge_degrees_batch(all_edges),
     )
     all_edges_data = [
         {"src_tgt": k, "rank": d, "description": k[1], **v}
@@ -915,8 +1410,8 @@ async def _find_most_related_edges_from_entities(
         key=lambda x: x["description"],
         max_token_size=query_param.max_token_for_global_context,
     )
-    all_related_nodes = await asyncio.gather(
-        *[knowledge_graph_inst.get_node_edges(edge["src_tgt"][1]) for edge in all_edges_data]
+    all_related_nodes = await knowledge_graph_inst.get_node_edges_batch(
+        [edge["src_tgt"][1] for edge in all_edges_data]
     )
     all_nodes = []
     for this_nodes in all_related_nodes:
@@ -929,19 +1424,17 @@ async def _find_most_related_edges_from_entities(
 
 
 async def _get_edge_data(
-    keywords,
+    results: list[dict],
     knowledge_graph_inst: BaseGraphStorage,
-    hyperedges_vdb: BaseVectorStorage,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
 ):
-    results = await hyperedges_vdb.query(keywords, top_k=query_param.top_k)
-
+    # results are the hyperedges similar to the high level keywords
     if not len(results):
-        return "", "", ""
+        return QueryContext()
 
-    edge_datas = await asyncio.gather(
-        *[knowledge_graph_inst.get_node(r["hyperedge_name"]) for r in results]
+    edge_datas = await knowledge_graph_inst.get_nodes_batch(
+        [r["hyperedge_name"] for r in results]
     )
 
     if not all([n is not None for n in edge_datas]):
@@ -961,9 +1454,10 @@ async def _get_edge_data(
         edge_datas,
         key=lambda x: x["hyperedge"],
         max_token_size=query_param.max_token_for_global_context,
+        token_key=lambda x: x.get("name_tokens"),
     )
-    all_related_nodes = await asyncio.gather(
-        *[knowledge_graph_inst.get_node_edges(edge["hyperedge"]) for edge in edge_datas]
+    all_related_nodes = await knowledge_graph_inst.get_node_edges_batch(
+        [edge["hyperedge"] for edge in edge_datas]
     )
     all_nodes = []
     for this_nodes in all_related_nodes:
@@ -983,36 +1477,16 @@ async def _get_edge_data(
         f"Global query uses {len(use_entities)} entites, {len(edge_datas)} relations, {len(use_text_units)} text units"
     )
 
-    relations_section_list = [
-        ["id", "hyperedge", "related_entities"]
-    ]
-    for i, e in enumerate(edge_datas):
-        relations_section_list.append(
-            [
-                i,
-                e["hyperedge"],
-                e['related_nodes']
-            ]
-        )
-    relations_context = list_of_list_to_csv(relations_section_list)
-
-    entites_section_list = [["id", "entity", "type", "description"]]
-    for i, n in enumerate(use_entities):
-        entites_section_list.append(
-            [
-                i,
-                n["entity_name"],
-                n.get("entity_type", "UNKNOWN"),
-                n.get("description", "UNKNOWN")
-            ]
-        )
-    entities_context = list_of_list_to_csv(entites_section_list)
-
-    text_units_section_list = [["id", "content"]]
-    for i, t in enumerate(use_text_units):
-        text_units_section_list.append([i, t["content"]])
-    text_units_context = list_of_list_to_csv(text_units_section_list)
-    return entities_context, relations_context, text_units_context
+    return QueryContext(
+        entities=[_entity_row(n) for n in use_entities],
+        relations=[
+            RelationContextRow(
+                hyperedge=e["hyperedge"], related_entities=e["related_nodes"]
+            )
+            for e in edge_datas
+        ],
+        sources=[_source_row(t) for t in use_text_units],
+    )
 
 
 async def _find_most_related_entities_from_relationships(
@@ -1021,8 +1495,8 @@ async def _find_most_related_entities_from_relationships(
     knowledge_graph_inst: BaseGraphStorage,
 ):
     
-    node_datas = await asyncio.gather(
-        *[knowledge_graph_inst.get_node_edges(edge["hyperedge"]) for edge in edge_datas]
+    node_datas = await knowledge_graph_inst.get_node_edges_batch(
+        [edge["hyperedge"] for edge in edge_datas]
     )
     
     entity_names = []
@@ -1034,12 +1508,9 @@ async def _find_most_related_entities_from_relationships(
                 entity_names.append(e[1])
                 seen.add(e[1])
 
-    node_datas = await asyncio.gather(
-        *[knowledge_graph_inst.get_node(entity_name) for entity_name in entity_names]
-    )
-
-    node_degrees = await asyncio.gather(
-        *[knowledge_graph_inst.node_degree(entity_name) for entity_name in entity_names]
+    node_datas, node_degrees = await asyncio.gather(
+        knowledge_graph_inst.get_nodes_batch(entity_names),
+        knowledge_graph_inst.node_degrees_batch(entity_names),
     )
     node_datas = [
         {**n, "entity_name": k, "rank": d}
@@ -1050,6 +1521,7 @@ async def _find_most_related_entities_from_relationships(
         node_datas,
         key=lambda x: x["description"],
         max_token_size=query_param.max_token_for_local_context,
+        token_key=lambda x: x.get("description_tokens"),
     )
 
     return node_datas
@@ -1098,27 +1570,128 @@ async def _find_related_text_unit_from_relationships(
         valid_text_units,
         key=lambda x: x["data"]["content"],
         max_token_size=query_param.max_token_for_text_unit,
+        token_key=lambda x: x["data"].get("tokens"),
     )
 
-    all_text_units: list[TextChunkSchema] = [t["data"] for t in truncated_text_units]
+    all_text_units: list[TextChunkSchema] = [
+        {**t["data"], "id": t["id"]} for t in truncated_text_units
+    ]
 
     return all_text_units
 
 
-def combine_contexts(entities, relationships, sources):
-    # Function to extract entities, relationships, and sources from context strings
-    hl_entities, ll_entities = entities[0], entities[1]
-    hl_relationships, ll_relationships = relationships[0], relationships[1]
-    hl_sources, ll_sources = sources[0], sources[1]
-    # Combine and deduplicate the entities
-    combined_entities = process_combine_contexts(hl_entities, ll_entities)
+def _entity_row(node_data: dict) -> EntityContextRow:
+    return EntityContextRow(
+        entity=node_data["entity_name"],
+        type=node_data.get("entity_type", "UNKNOWN"),
+        description=node_data.get("description", "UNKNOWN"),
+    )
+
+
+def _source_row(text_unit: dict) -> SourceContextRow:
+    return SourceContextRow(id=text_unit["id"], content=text_unit["content"])
+
+
+def _dedup_rows(rows: list[dict], key: str) -> list[dict]:
+    seen = set()
+    result = []
+    for row in rows:
+        if row[key] not in seen:
+            seen.add(row[key])
+            result.append(row)
+    return result
+
+
+def combine_contexts(hl: QueryContext, ll: QueryContext) -> QueryContext:
+    """Merge the global and local contexts, high level rows first, deduplicated by id"""
+    return QueryContext(
+        entities=_dedup_rows(hl.entities + ll.entities, "entity"),
+        relations=_dedup_rows(hl.relations + ll.relations, "hyperedge"),
+        sources=_dedup_rows(hl.sources + ll.sources, "id"),
+    )
+
+
+def _format_context_csv(context: QueryContext) -> str:
+    entities = list_of_list_to_csv(
+        [["id", "entity", "type", "description"]]
+        + [
+            [i, r["entity"], r["type"], r["description"]]
+            for i, r in enumerate(context.entities)
+        ]
+    )
+    relations = list_of_list_to_csv(
+        [["id", "hyperedge", "related_entities"]]
+        + [
+            [i, r["hyperedge"], r["related_entities"]]
+            for i, r in enumerate(context.relations)
+        ]
+    )
+    sources = list_of_list_to_csv(
+        [["id", "content"]] + [[i, r["content"]] for i, r in enumerate(context.sources)]
+    )
+    return f"""
+-----Entities-----
+```csv
+{entities}
+```
+-----Relationships-----
+```csv
+{relations}
+```
+-----Sources-----
+```csv
+{sources}
+```
+"""
+
+
+def _format_context_json(context: QueryContext) -> str:
+    sources = [{"content": r["content"]} for r in context.sources]
+    return f"""
+-----Entities-----
+```json
+{json.dumps(context.entities, ensure_ascii=False)}
+```
+-----Relationships-----
+```json
+{json.dumps(context.relations, ensure_ascii=False)}
+```
+-----Sources-----
+```json
+{json.dumps(sources, ensure_ascii=False)}
+```
+"""
+
 
-    # Combine and deduplicate the relationships
-    combined_relationships = process_combine_contexts(
-        hl_relationships, ll_relationships
+def _format_context_compact(context: QueryContext) -> str:
+    entities = "\n".join(
+        f"- {r['entity']} ({r['type']}): {r['description']}" for r in context.entities
+    )
+    relations = "\n".join(
+        f"- {r['hyperedge']} [{r['related_entities']}]" for r in context.relations
     )
+    sources = "\n".join(f"- {r['content']}" for r in context.sources)
+    return f"""
+-----Entities-----
+{entities}
+-----Relationships-----
+{relations}
+-----Sources-----
+{sources}
+"""
+
+
+CONTEXT_FORMATTERS = {
+    "csv": _format_context_csv,
+    "json": _format_context_json,
+    "compact": _format_context_compact,
+}
 
-    # Combine and deduplicate the sources
-    combined_sources = process_combine_contexts(hl_sources, ll_sources)
 
-    return combined_entities, combined_relationships, combined_sources
\ No newline at end of file
+def render_context(context: QueryContext, context_format="csv") -> str:
+    """Render `context` once, by name from CONTEXT_FORMATTERS or with a callable"""
+    if callable(context_format):
+        return context_format(context)
+    if context_format not in CONTEXT_FORMATTERS:
+        raise ValueError(f"Unknown context format: {context_format}")
+    return CONTEXT_FORMATTERS[context_format](context)
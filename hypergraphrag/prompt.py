@@ -175,6 +175,23 @@ Description List: {description_list}
 Output:
 """
 
+PROMPTS[
+    "summarize_entity_descriptions_batch"
+] = """You are a helpful assistant responsible for generating comprehensive summaries of the data provided below.
+Each numbered item gives one or two entities and a list of descriptions, all related to the same entity or group of entities.
+For every item separately, concatenate all of its descriptions into a single, comprehensive description. Make sure to include information collected from all the descriptions of that item.
+If the provided descriptions are contradictory, please resolve the contradictions and provide a single, coherent summary.
+Make sure each summary is written in third person, and include the entity names so we the have full context.
+Use {language} as output language.
+Return only a JSON object whose keys are the item numbers as strings and whose values are the summaries, e.g. {{"1": "...", "2": "..."}}.
+
+#######
+-Data-
+{items}
+#######
+Output:
+"""
+
 PROMPTS[
     "entiti_continue_extraction"
 ] = """MANY knowdge fragements with entities were missed in the last extraction.  Add them below using the same format:
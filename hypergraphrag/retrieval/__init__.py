@@ -5,9 +5,6 @@ This module provides functionality for efficient hyperedge retrieval using
 entity type filtering and quality-aware ranking.
 """
 
-from .entity_filter import EntityTypeFilter
-from .quality_ranker import QualityAwareRanker, rank_by_quality
-from .lite_retriever import LiteRetriever
 from .performance_monitor import (
     PerformanceMonitor,
     RetrievalTracker,
@@ -17,10 +14,6 @@ from .performance_monitor import (
 )
 
 __all__ = [
-    'EntityTypeFilter',
-    'QualityAwareRanker',
-    'rank_by_quality',
-    'LiteRetriever',
     'PerformanceMonitor',
     'RetrievalTracker',
     'RetrievalMetrics',
@@ -29,7 +22,4 @@ __all__ = [
 ]
 
 # Implemented:
-# - Task 10: EntityTypeFilter ✓
-# - Task 11: QualityAwareRanker ✓
-# - Task 12: LiteRetriever ✓
 # - Task 13.2: PerformanceMonitor ✓
@@ -1,6 +1,11 @@
 import asyncio
 import html
+import inspect
+import json
 import os
+import re
+from functools import partial
+from hashlib import md5
 from tqdm.asyncio import tqdm as tqdm_async
 from dataclasses import dataclass
 from typing import Any, Union, cast
@@ -13,6 +18,7 @@ from .utils import (
     load_json,
     write_json,
     compute_mdhash_id,
+    EmbeddingFunc,
 )
 
 from .base import (
@@ -22,6 +28,157 @@ from .base import (
 )
 
 
+class EmbeddingVectorCache:
+    """Content-addressed, append-only on-disk cache of embeddings.
+
+    Records are a 16-byte md5 of the text followed by ``embedding_dim``
+    float32s, in one ``embedding_cache_<model>_<dim>.bin`` file per model and
+    dimension, so a cache directory can be shared by several working dirs.
+    `wrap` returns an `EmbeddingFunc` that only sends cache misses to the
+    provider and splices the cached rows back in order. Once the file holds
+    more than ``max_bytes`` it is compacted to half that, keeping the vectors
+    used since it was opened and then the newest ones.
+    """
+
+    def __init__(
+        self, cache_dir: str, model: str, embedding_dim: int, max_bytes: int = None
+    ):
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model)
+        self._file_name = os.path.join(
+            cache_dir, f"embedding_cache_{slug}_{embedding_dim}.bin"
+        )
+        self._dtype = np.dtype([("key", "V16"), ("vec", "<f4", (embedding_dim,))])
+        self._max_entries = (
+            None if max_bytes is None else max(2, max_bytes // self._dtype.itemsize)
+        )
+        self._used: set[bytes] = set()
+        self._load()
+        logger.info(f"Load embedding cache {self._file_name} with {len(self)} vectors")
+
+    @staticmethod
+    def model_id(func) -> Union[str, None]:
+        """``<function>_<model>`` for an embedding function, None if the model is unknown.
+
+        The model comes from the ``model`` keyword of a (nested) `partial`, or
+        from the default of the function's ``model`` parameter.
+        """
+        if isinstance(func, EmbeddingFunc):
+            func = func.func
+        keywords = {}
+        while isinstance(func, partial):
+            keywords = {**func.keywords, **keywords}
+            func = func.func
+        if isinstance(func, EmbeddingFunc):
+            return EmbeddingVectorCache.model_id(partial(func.func, **keywords))
+        model = keywords.get("model")
+        if model is None:
+            try:
+                default = inspect.signature(func).parameters.get("model")
+            except (TypeError, ValueError):
+                default = None
+            if default is not None and isinstance(default.default, str):
+                model = default.default
+        if not model:
+            return None
+        return f"{getattr(func, '__name__', 'embedding')}_{model}"
+
+    def _load(self):
+        self._records = None
+        self._index: dict[bytes, int] = {}
+        self._new: dict[bytes, np.ndarray] = {}
+        if os.path.exists(self._file_name):
+            size = os.path.getsize(self._file_name)
+            if size % self._dtype.itemsize:
+                # torn tail from an interrupted append
+                size -= size % self._dtype.itemsize
+                os.truncate(self._file_name, size)
+            if size:
+                self._records = np.memmap(
+                    self._file_name, dtype=self._dtype, mode="r"
+                )
+                self._index = {
+                    k.tobytes(): i for i, k in enumerate(self._records["key"])
+                }
+
+    def __len__(self):
+        return len(self._index) + len(self._new)
+
+    def get(self, key: bytes) -> Union[np.ndarray, None]:
+        row = self._index.get(key)
+        if row is not None:
+            self._used.add(key)
+            return self._records["vec"][row]
+        return self._new.get(key)
+
+    def put(self, keys: list[bytes], vectors: np.ndarray):
+        records = np.empty(len(keys), dtype=self._dtype)
+        records["key"] = np.frombuffer(b"".join(keys), dtype="V16")
+        records["vec"] = vectors
+        with open(self._file_name, "ab") as f:
+            f.write(records.tobytes())
+        self._new.update(zip(keys, records["vec"]))
+        if self._max_entries is not None and len(self) > self._max_entries:
+            self.compact(self._max_entries // 2)
+
+    def compact(self, keep: int):
+        """Rewrite the file with at most ``keep`` vectors.
+
+        Vectors used since the cache was opened are kept first, then the most
+        recently appended ones; file order is preserved.
+        """
+        count = os.path.getsize(self._file_name) // self._dtype.itemsize
+        records = np.fromfile(self._file_name, dtype=self._dtype, count=count)
+        keys = [k.tobytes() for k in records["key"]]
+        newest_first = range(len(keys) - 1, -1, -1)
+        selected, seen = [], set()
+        for prefer_used in (True, False):
+            for i in newest_first:
+                if len(selected) >= keep:
+                    break
+                if keys[i] not in seen and (keys[i] in self._used) == prefer_used:
+                    seen.add(keys[i])
+                    selected.append(i)
+        tmp_file_name = self._file_name + ".tmp"
+        records[np.sort(np.array(selected, dtype=np.int64))].tofile(tmp_file_name)
+        self._records = None
+        os.replace(tmp_file_name, self._file_name)
+        self._load()
+        self._used &= self._index.keys()
+        logger.info(
+            f"Compacted embedding cache {self._file_name} from {count} to {len(self)} vectors"
+        )
+
+    def wrap(self, embedding_func: EmbeddingFunc) -> EmbeddingFunc:
+        async def cached_func(texts: list[str], *args, **kwargs) -> np.ndarray:
+            keys = [md5(t.encode()).digest() for t in texts]
+            cached = [self.get(k) for k in keys]
+            misses = {}
+            for i, (k, vec) in enumerate(zip(keys, cached)):
+                if vec is None:
+                    misses.setdefault(k, []).append(i)
+            if misses:
+                fresh = np.asarray(
+                    await embedding_func(
+                        [texts[rows[0]] for rows in misses.values()], *args, **kwargs
+                    ),
+                    dtype=np.float32,
+                )
+                self.put(list(misses.keys()), fresh)
+                for rows, vec in zip(misses.values(), fresh):
+                    for i in rows:
+                        cached[i] = vec
+            if not cached:
+                return np.empty((0, embedding_func.embedding_dim), dtype=np.float32)
+            return np.stack(cached)
+
+        return EmbeddingFunc(
+            embedding_dim=embedding_func.embedding_dim,
+            max_token_size=embedding_func.max_token_size,
+            func=cached_func,
+            concurrent_limit=0,
+        )
+
+
 @dataclass
 class JsonKVStorage(BaseKVStorage):
     def __post_init__(self):
@@ -59,10 +216,263 @@ class JsonKVStorage(BaseKVStorage):
         self._data.update(left_data)
         return left_data
 
+    async def delete(self, ids: list[str]):
+        for id in ids:
+            self._data.pop(id, None)
+
     async def drop(self):
         self._data = {}
 
 
+@dataclass
+class JsonLogKVStorage(BaseKVStorage):
+    """Append-only KV store backed by a log of tab-separated key/value records.
+
+    Each record is one line ``<json key>\\t<json value>``, so startup only
+    decodes the keys to build an offset index. Values are decoded on first
+    access and the least recently used flushed ones are evicted beyond
+    ``cache_max_values``, so a value mutated in place must be upserted again
+    before it is evicted. ``index_done_callback`` appends the keys changed since
+    the last flush and deletions as ``null`` tombstones.
+    The log is rewritten once superseded records exceed ``compaction_ratio``
+    of its size.
+    """
+
+    compaction_ratio: float = 0.5
+    compaction_min_bytes: int = 4 * 1024 * 1024
+    cache_max_values: int = 10_000
+
+    def __post_init__(self):
+        working_dir = self.global_config["working_dir"]
+        self._file_name = os.path.join(working_dir, f"kv_store_{self.namespace}.log")
+        self._legacy_file_name = os.path.join(
+            working_dir, f"kv_store_{self.namespace}.json"
+        )
+        self.compaction_ratio = self.global_config.get(
+            "kv_compaction_ratio", self.compaction_ratio
+        )
+        self.cache_max_values = self.global_config.get(
+            "kv_cache_max_values", self.cache_max_values
+        )
+        # key -> (value offset, value length, record length)
+        self._index: dict[str, tuple[int, int, int]] = None
+        # unflushed values, and decoded ones from least to most recently used
+        self._values: dict[str, Any] = {}
+        self._dirty: set[str] = set()
+        self._deleted: set[str] = set()
+        self._dead_bytes = 0
+        self._dropped = False
+
+    def _ensure_index(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        self._log_size = 0
+        if not os.path.exists(self._file_name):
+            legacy = load_json(self._legacy_file_name)
+            if legacy:
+                logger.info(
+                    f"Migrating {len(legacy)} records of {self.namespace} to segment log"
+                )
+                self._values.update(legacy)
+                self._dirty.update(legacy.keys())
+            return
+        offset = 0
+        with open(self._file_name, "rb") as f:
+            for line in f:
+                if line.find(b"\t") < 0 or not line.endswith(b"\n"):
+                    break
+                self._index_record(json.loads(line[: line.find(b"\t")]), offset, line)
+                offset += len(line)
+        if offset < os.path.getsize(self._file_name):
+            # torn tail from an interrupted flush
+            logger.warning(
+                f"Dropping incomplete record at offset {offset} in {self._file_name}"
+            )
+            os.truncate(self._file_name, offset)
+        self._log_size = offset
+        logger.info(f"Load KV {self.namespace} with {len(self._index)} data")
+
+    def _index_record(self, key: str, offset: int, record: bytes):
+        previous = self._index.get(key)
+        if previous is not None:
+            self._dead_bytes += previous[2]
+        sep = record.find(b"\t")
+        if record[sep + 1 :] == b"null\n":
+            self._index.pop(key, None)
+            self._dead_bytes += len(record)
+            return
+        self._index[key] = (offset + sep + 1, len(record) - sep - 2, len(record))
+
+    def _read_values(self, keys: list[str]):
+        missing = []
+        for k in keys:
+            if k in self._values:
+                # move to the most recently used end
+                self._values[k] = self._values.pop(k)
+            elif k in self._index:
+                missing.append(k)
+        if not missing:
+            return
+        with open(self._file_name, "rb") as f:
+            for k in missing:
+                value_offset, value_length, _ = self._index[k]
+                f.seek(value_offset)
+                self._values[k] = json.loads(f.read(value_length))
+        self._evict()
+
+    def _evict(self):
+        """Drop the least recently used flushed values beyond cache_max_values"""
+        excess = len(self._values) - len(self._dirty) - self.cache_max_values
+        if excess <= 0:
+            return
+        # evict a quarter more than needed so the scan is not repeated per read
+        excess += self.cache_max_values // 4
+        evicted = []
+        for k in self._values:
+            if k not in self._dirty and k in self._index:
+                evicted.append(k)
+                if len(evicted) == excess:
+                    break
+        for k in evicted:
+            del self._values[k]
+
+    def _has_key(self, key: str) -> bool:
+        return key in self._values or key in self._index
+
+    async def all_keys(self) -> list[str]:
+        self._ensure_index()
+        return list(self._index.keys() | self._values.keys())
+
+    async def get_by_id(self, id):
+        self._ensure_index()
+        self._read_values([id])
+        return self._values.get(id, None)
+
+    async def get_by_ids(self, ids, fields=None):
+        self._ensure_index()
+        self._read_values(ids)
+        if fields is None:
+            return [self._values.get(id, None) for id in ids]
+        return [
+            (
+                {k: v for k, v in self._values[id].items() if k in fields}
+                if self._values.get(id, None)
+                else None
+            )
+            for id in ids
+        ]
+
+    async def filter_keys(self, data: list[str]) -> set[str]:
+        self._ensure_index()
+        return set([s for s in data if not self._has_key(s)])
+
+    async def upsert(self, data: dict[str, dict]):
+        self._ensure_index()
+        left_data = {}
+        for k, v in data.items():
+            if not self._has_key(k):
+                left_data[k] = v
+            elif self._values.get(k) is v:
+                # the caller mutated a value previously returned by get_by_id,
+                # which JsonKVStorage persists implicitly on its full rewrite
+                self._dirty.add(k)
+        self._values.update(left_data)
+        self._dirty.update(left_data.keys())
+        self._deleted.difference_update(left_data.keys())
+        return left_data
+
+    async def delete(self, ids: list[str]):
+        self._ensure_index()
+        for k in ids:
+            self._values.pop(k, None)
+            self._dirty.discard(k)
+            previous = self._index.pop(k, None)
+            if previous is not None:
+                self._dead_bytes += previous[2]
+                self._deleted.add(k)
+
+    async def drop(self):
+        self._index = {}
+        self._values = {}
+        self._dirty = set()
+        self._deleted = set()
+        self._dropped = True
+
+    @staticmethod
+    def _encode_record(key: str, value: Any) -> bytes:
+        return (
+            json.dumps(key, ensure_ascii=False).encode("utf-8")
+            + b"\t"
+            + json.dumps(value, ensure_ascii=False).encode("utf-8")
+            + b"\n"
+        )
+
+    def _compact(self):
+        tmp_file_name = self._file_name + ".compact"
+        old_index, self._index = self._index, {}
+        self._dead_bytes = 0
+        offset = 0
+        with open(tmp_file_name, "wb") as out:
+            if old_index:
+                with open(self._file_name, "rb") as src:
+                    for k, (value_offset, value_length, _) in old_index.items():
+                        if k in self._dirty:
+                            continue
+                        src.seek(value_offset)
+                        record = (
+                            json.dumps(k, ensure_ascii=False).encode("utf-8")
+                            + b"\t"
+                            + src.read(value_length)
+                            + b"\n"
+                        )
+                        out.write(record)
+                        self._index_record(k, offset, record)
+                        offset += len(record)
+            for k in self._dirty:
+                record = self._encode_record(k, self._values[k])
+                out.write(record)
+                self._index_record(k, offset, record)
+                offset += len(record)
+        os.replace(tmp_file_name, self._file_name)
+        self._log_size = offset
+        self._dropped = False
+        logger.info(f"Compacted KV {self.namespace} log to {offset} bytes")
+
+    async def index_done_callback(self):
+        if self._index is None or (
+            not self._dirty and not self._deleted and not self._dropped
+        ):
+            return
+        if self._dropped or not os.path.exists(self._file_name):
+            self._compact()
+            self._dirty = set()
+            self._deleted = set()
+            self._evict()
+            return
+        offset = self._log_size
+        with open(self._file_name, "ab") as f:
+            for k in self._deleted:
+                record = self._encode_record(k, None)
+                f.write(record)
+                self._index_record(k, offset, record)
+                offset += len(record)
+            self._deleted = set()
+            for k in self._dirty:
+                record = self._encode_record(k, self._values[k])
+                f.write(record)
+                self._index_record(k, offset, record)
+                offset += len(record)
+        self._log_size = offset
+        self._dirty = set()
+        self._evict()
+        if (
+            self._log_size >= self.compaction_min_bytes
+            and self._dead_bytes > self.compaction_ratio * self._log_size
+        ):
+            self._compact()
+
+
 @dataclass
 class NanoVectorDBStorage(BaseVectorStorage):
     cosine_better_than_threshold: float = 0.2
@@ -133,6 +543,35 @@ class NanoVectorDBStorage(BaseVectorStorage):
         ]
         return results
 
+    async def query_batch(self, queries: list[str], top_k=5):
+        if not queries:
+            return []
+        return await self.query_embeddings(await self._embed_queries(queries), top_k)
+
+    async def query_embeddings(self, embeddings: np.ndarray, top_k=5):
+        storage = self.client_storage
+        if not len(storage["data"]):
+            return [[] for _ in embeddings]
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        # one matrix-matrix product instead of a scan per query
+        scores = storage["matrix"] @ embeddings.T.astype(storage["matrix"].dtype)
+        results = []
+        for column in scores.T:
+            sort_index = np.argsort(column)[-top_k:][::-1]
+            results.append(
+                [
+                    {
+                        **storage["data"][i],
+                        "__metrics__": column[i],
+                        "id": storage["data"][i]["__id__"],
+                        "distance": column[i],
+                    }
+                    for i in sort_index
+                    if column[i] >= self.cosine_better_than_threshold
+                ]
+            )
+        return results
+
     @property
     def client_storage(self):
         return getattr(self._client, "_NanoVectorDB__storage")
@@ -174,18 +613,671 @@ class NanoVectorDBStorage(BaseVectorStorage):
         self._client.save()
 
 
+def _normalize_queries(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=-1, keepdims=True)
+
+
+@dataclass
+class MmapVectorDBStorage(BaseVectorStorage):
+    """Vector storage keeping normalized embeddings in a memory-mapped ``.npy``.
+
+    Ids, meta fields and the number of live rows live in a
+    ``vdb_<namespace>.meta.json`` sidecar, written after the matrix so it only
+    ever names rows that are on disk. The matrix file keeps spare rows: inserts
+    fill them, and a flush writes just the new and updated rows in place. When
+    the file is full or deleted rows are compacted away, a new generation of the
+    file is written and the sidecar switched to it. Queries run directly over
+    the mapped matrix; pass ``{"dtype": "float16"}`` through
+    ``vector_db_storage_cls_kwargs`` to halve the resident size.
+    """
+
+    cosine_better_than_threshold: float = 0.2
+    # rows scored per block when the matrix is not stored as float32
+    query_block_size: int = 65536
+    # capacity multiplier when the matrix runs out of spare rows
+    capacity_growth: float = 2.0
+
+    def __post_init__(self):
+        working_dir = self.global_config["working_dir"]
+        self._matrix_file_name = os.path.join(working_dir, f"vdb_{self.namespace}.npy")
+        self._meta_file_name = os.path.join(
+            working_dir, f"vdb_{self.namespace}.meta.json"
+        )
+        self._max_batch_size = self.global_config["embedding_batch_num"]
+        self.cosine_better_than_threshold = self.global_config.get(
+            "cosine_better_than_threshold", self.cosine_better_than_threshold
+        )
+        config = self.global_config.get("vector_db_storage_cls_kwargs", {})
+        self._dtype = np.dtype(config.get("dtype", "float32"))
+        self._load()
+
+    def _generation_file_name(self, generation: int) -> str:
+        return os.path.join(
+            self.global_config["working_dir"],
+            f"vdb_{self.namespace}.{generation}.npy",
+        )
+
+    def _load(self):
+        meta = load_json(self._meta_file_name)
+        self._generation = 0
+        if meta is not None:
+            self._generation = meta.get("generation", 0)
+            # files written before generations were added have no number
+            if self._generation:
+                self._matrix_file_name = self._generation_file_name(self._generation)
+        if meta is not None and os.path.exists(self._matrix_file_name):
+            assert (
+                meta["embedding_dim"] == self.embedding_func.embedding_dim
+            ), f"Embedding dim mismatch, expected: {self.embedding_func.embedding_dim}, but loaded: {meta['embedding_dim']}"
+            # copy-on-write mapping: in-place updates never touch the file
+            self._buffer = np.load(self._matrix_file_name, mmap_mode="c")
+            self._ids = meta["ids"]
+            self._metadata = meta["metadata"]
+            rows = meta.get("rows", len(self._ids))
+            if rows != len(self._ids) or rows > len(self._buffer):
+                rows = min(len(self._ids), len(self._buffer))
+                logger.warning(
+                    f"Vectors of {self.namespace} do not match {self._meta_file_name}, "
+                    f"keeping the first {rows} rows"
+                )
+                self._ids = self._ids[:rows]
+                self._metadata = self._metadata[:rows]
+            self._dirty = False
+        else:
+            self._buffer = np.zeros(
+                (0, self.embedding_func.embedding_dim), dtype=self._dtype
+            )
+            self._ids = []
+            self._metadata = []
+            self._dirty = self._import_nano_vectordb()
+        self._matrix = self._buffer[: len(self._ids)]
+        # rows [0, _flushed_rows) are in the file; _changed_rows of them differ
+        self._flushed_rows = 0 if self._dirty else len(self._ids)
+        self._changed_rows: set[int] = set()
+        self._id_to_row = {k: i for i, k in enumerate(self._ids)}
+        self._deleted_rows: set[int] = set()
+        logger.info(f"Load {self.namespace} vectors with shape {self._matrix.shape}")
+
+    def _import_nano_vectordb(self):
+        legacy_file_name = os.path.join(
+            self.global_config["working_dir"], f"vdb_{self.namespace}.json"
+        )
+        if not os.path.exists(legacy_file_name):
+            return False
+        client = NanoVectorDB(
+            self.embedding_func.embedding_dim, storage_file=legacy_file_name
+        )
+        storage = getattr(client, "_NanoVectorDB__storage")
+        logger.info(
+            f"Importing {len(storage['data'])} vectors of {self.namespace} from {legacy_file_name}"
+        )
+        self._buffer = storage["matrix"].astype(self._dtype)
+        self._ids = [dp["__id__"] for dp in storage["data"]]
+        self._metadata = [
+            {k: v for k, v in dp.items() if k != "__id__"} for dp in storage["data"]
+        ]
+        return True
+
+    async def upsert(self, data: dict[str, dict]):
+        logger.info(f"Inserting {len(data)} vectors to {self.namespace}")
+        if not len(data):
+            logger.warning("You insert an empty data to vector DB")
+            return []
+        contents = [v["content"] for v in data.values()]
+        batches = [
+            contents[i : i + self._max_batch_size]
+            for i in range(0, len(contents), self._max_batch_size)
+        ]
+
+        async def wrapped_task(batch):
+            result = await self.embedding_func(batch)
+            pbar.update(1)
+            return result
+
+        embedding_tasks = [wrapped_task(batch) for batch in batches]
+        pbar = tqdm_async(
+            total=len(embedding_tasks), desc="Generating embeddings", unit="batch"
+        )
+        embeddings_list = await asyncio.gather(*embedding_tasks)
+
+        embeddings = np.concatenate(embeddings_list)
+        if len(embeddings) != len(data):
+            # sometimes the embedding is not returned correctly. just log it.
+            logger.error(
+                f"embedding is not 1-1 with data, {len(embeddings)} != {len(data)}"
+            )
+            return
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        embeddings = embeddings.astype(self._dtype)
+
+        report = {"update": [], "insert": []}
+        new_rows = []
+        for (k, v), embedding in zip(data.items(), embeddings):
+            meta = {k1: v1 for k1, v1 in v.items() if k1 in self.meta_fields}
+            row = self._id_to_row.get(k)
+            if row is not None and row not in self._deleted_rows:
+                self._matrix[row] = embedding
+                self._metadata[row] = meta
+                self._changed_rows.add(row)
+                report["update"].append(k)
+                continue
+            if row is not None:
+                # re-inserted after a delete: un-tombstone and reuse its old row
+                self._deleted_rows.discard(row)
+                self._matrix[row] = embedding
+                self._metadata[row] = meta
+                self._changed_rows.add(row)
+                report["insert"].append(k)
+                continue
+            self._id_to_row[k] = len(self._ids)
+            new_rows.append(embedding)
+            self._ids.append(k)
+            self._metadata.append(meta)
+            report["insert"].append(k)
+        if new_rows:
+            self._append_rows(np.stack(new_rows))
+        self._dirty = True
+        return report
+
+    def _append_rows(self, rows: np.ndarray):
+        """Write ``rows`` into the spare capacity, growing it geometrically"""
+        n = len(self._matrix)
+        if n + len(rows) > len(self._buffer):
+            capacity = max(n + len(rows), int(len(self._buffer) * self.capacity_growth))
+            buffer = np.empty((capacity, self._buffer.shape[1]), dtype=self._dtype)
+            buffer[:n] = self._matrix
+            self._buffer = buffer
+        self._buffer[n : n + len(rows)] = rows
+        self._matrix = self._buffer[: n + len(rows)]
+
+    def _scores(self, embedding: np.ndarray) -> np.ndarray:
+        """Score every row against one ``(dim,)`` or several ``(dim, n)`` queries."""
+        if self._matrix.dtype == np.float32:
+            return self._matrix @ embedding
+        scores = np.empty((len(self._matrix),) + embedding.shape[1:], dtype=np.float32)
+        for start in range(0, len(self._matrix), self.query_block_size):
+            block = self._matrix[start : start + self.query_block_size]
+            scores[start : start + len(block)] = block.astype(np.float32) @ embedding
+        return scores
+
+    def _top_k(
+        self, scores: np.ndarray, top_k: int, rows: np.ndarray = None
+    ) -> list[dict]:
+        """Pick the best ``top_k`` rows; ``rows`` maps scores to matrix rows."""
+        if rows is None:
+            rows = np.arange(len(scores))
+        if self._deleted_rows:
+            scores[np.isin(rows, list(self._deleted_rows))] = -np.inf
+        if top_k < len(scores):
+            candidates = np.argpartition(-scores, top_k)[:top_k]
+        else:
+            candidates = np.arange(len(scores))
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [
+            {
+                **self._metadata[rows[i]],
+                "__id__": self._ids[rows[i]],
+                "id": self._ids[rows[i]],
+                "distance": float(scores[i]),
+            }
+            for i in candidates
+            if scores[i] >= self.cosine_better_than_threshold
+        ]
+
+    async def query(self, query: str, top_k=5):
+        embedding = await self.embedding_func([query])
+        return self._search(_normalize_queries(embedding), top_k)[0]
+
+    async def query_batch(self, queries: list[str], top_k=5):
+        if not queries:
+            return []
+        return await self.query_embeddings(await self._embed_queries(queries), top_k)
+
+    async def query_embeddings(self, embeddings: np.ndarray, top_k=5):
+        return self._search(_normalize_queries(embeddings), top_k)
+
+    def _search(self, embeddings: np.ndarray, top_k: int) -> list[list[dict]]:
+        if not len(self._matrix):
+            return [[] for _ in embeddings]
+        scores = self._scores(embeddings.T)
+        return [self._top_k(scores[:, i], top_k) for i in range(len(embeddings))]
+
+    def _live_rows(self) -> list[int]:
+        return [i for i in range(len(self._ids)) if i not in self._deleted_rows]
+
+    def _delete_ids(self, ids: list[str]):
+        for k in ids:
+            row = self._id_to_row.get(k)
+            if row is not None:
+                self._deleted_rows.add(row)
+        self._dirty = True
+
+    async def delete_entity(self, entity_name: str):
+        try:
+            entity_id = compute_mdhash_id(entity_name, prefix="ent-")
+            row = self._id_to_row.get(entity_id)
+            if row is not None and row not in self._deleted_rows:
+                self._delete_ids([entity_id])
+                logger.info(f"Entity {entity_name} have been deleted.")
+            else:
+                logger.info(f"No entity found with name {entity_name}.")
+        except Exception as e:
+            logger.error(f"Error while deleting entity {entity_name}: {e}")
+
+    async def delete_relation(self, entity_name: str):
+        try:
+            ids_to_delete = [
+                k
+                for i, k in enumerate(self._ids)
+                if i not in self._deleted_rows
+                and entity_name
+                in (self._metadata[i].get("src_id"), self._metadata[i].get("tgt_id"))
+            ]
+            if ids_to_delete:
+                self._delete_ids(ids_to_delete)
+                logger.info(
+                    f"All relations related to entity {entity_name} have been deleted."
+                )
+            else:
+                logger.info(f"No relations found for entity {entity_name}.")
+        except Exception as e:
+            logger.error(
+                f"Error while deleting relations for entity {entity_name}: {e}"
+            )
+
+    async def index_done_callback(self):
+        if not self._dirty:
+            return
+        if self._deleted_rows:
+            keep = self._live_rows()
+            self._buffer = self._matrix[keep]
+            self._matrix = self._buffer
+            self._ids = [self._ids[i] for i in keep]
+            self._metadata = [self._metadata[i] for i in keep]
+            self._write_generation()
+        elif self._fits_in_place():
+            self._write_in_place()
+        else:
+            self._write_generation()
+        tmp_file_name = self._meta_file_name + ".tmp"
+        with open(tmp_file_name, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "embedding_dim": self.embedding_func.embedding_dim,
+                    "dtype": self._dtype.name,
+                    "generation": self._generation,
+                    "rows": len(self._ids),
+                    "ids": self._ids,
+                    "metadata": self._metadata,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        # the sidecar goes last: until it is replaced, the previous one still
+        # describes rows that are intact on disk
+        os.replace(tmp_file_name, self._meta_file_name)
+        self._load()
+        self._remove_old_generations()
+
+    def _fits_in_place(self) -> bool:
+        if not os.path.exists(self._matrix_file_name):
+            return False
+        current = np.load(self._matrix_file_name, mmap_mode="r")
+        return current.dtype == self._dtype and len(current) >= len(self._matrix)
+
+    def _write_in_place(self):
+        """Write new and updated rows into the spare rows of the current file"""
+        n = len(self._matrix)
+        rows = sorted(r for r in self._changed_rows if r < self._flushed_rows)
+        target = np.load(self._matrix_file_name, mmap_mode="r+")
+        if rows:
+            target[rows] = self._matrix[rows]
+        target[self._flushed_rows : n] = self._matrix[self._flushed_rows : n]
+        target.flush()
+        del target
+
+    def _write_generation(self):
+        """Write the matrix, with spare rows, to the file of a new generation"""
+        n = len(self._matrix)
+        capacity = max(n, len(self._buffer))
+        self._generation += 1
+        self._matrix_file_name = self._generation_file_name(self._generation)
+        tmp_file_name = self._matrix_file_name + ".tmp"
+        target = np.lib.format.open_memmap(
+            tmp_file_name,
+            mode="w+",
+            dtype=self._dtype,
+            shape=(capacity, self.embedding_func.embedding_dim),
+        )
+        target[:n] = self._matrix
+        target.flush()
+        del target
+        os.replace(tmp_file_name, self._matrix_file_name)
+
+    def _remove_old_generations(self):
+        working_dir = self.global_config["working_dir"]
+        pattern = re.compile(rf"vdb_{re.escape(self.namespace)}(\.\d+)?\.npy$")
+        current = os.path.basename(self._matrix_file_name)
+        for file_name in os.listdir(working_dir):
+            if pattern.fullmatch(file_name) and file_name != current:
+                os.remove(os.path.join(working_dir, file_name))
+
+
+def _spherical_kmeans(
+    vectors: np.ndarray, n_clusters: int, n_iter: int, seed: int = 0
+) -> np.ndarray:
+    """Cluster unit vectors by cosine similarity, returning normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=n_clusters)
+        empty = counts == 0
+        if empty.any():
+            # re-seed empty clusters so every list stays usable
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = sums / np.linalg.norm(sums, axis=-1, keepdims=True)
+    return centroids.astype(np.float32)
+
+
+@dataclass
+class IVFVectorDBStorage(MmapVectorDBStorage):
+    """MmapVectorDBStorage with an in-process IVF-flat approximate index.
+
+    Rows are partitioned by spherical k-means; a query scores the centroids and
+    only scans the ``nprobe`` closest lists. The index lives in
+    ``vdb_<namespace>.ivf.npz`` and is built once the store holds
+    ``ivf_min_train_size`` vectors, with brute force below that. Knobs are read
+    from ``vector_db_storage_cls_kwargs``: ``ivf_nlist`` (default ``sqrt(n)``),
+    ``ivf_nprobe``, ``ivf_min_train_size``, ``ivf_train_sample_size``,
+    ``ivf_kmeans_iters`` and ``ivf_retrain_growth``.
+    """
+
+    nprobe: int = 8
+    min_train_size: int = 10000
+    train_sample_size: int = 100000
+    kmeans_iters: int = 20
+    # retrain once the store grows by this factor since the last training
+    retrain_growth: float = 2.0
+
+    def __post_init__(self):
+        config = self.global_config.get("vector_db_storage_cls_kwargs", {})
+        self._nlist = config.get("ivf_nlist")
+        self.nprobe = config.get("ivf_nprobe", self.nprobe)
+        self.min_train_size = config.get("ivf_min_train_size", self.min_train_size)
+        self.train_sample_size = config.get(
+            "ivf_train_sample_size", self.train_sample_size
+        )
+        self.kmeans_iters = config.get("ivf_kmeans_iters", self.kmeans_iters)
+        self.retrain_growth = config.get("ivf_retrain_growth", self.retrain_growth)
+        self._index_file_name = os.path.join(
+            self.global_config["working_dir"], f"vdb_{self.namespace}.ivf.npz"
+        )
+        super().__post_init__()
+
+    def _load(self):
+        super()._load()
+        self._centroids = None
+        self._assign = None
+        self._trained_size = 0
+        if os.path.exists(self._index_file_name):
+            index = np.load(self._index_file_name)
+            if len(index["assign"]) == len(self._ids):
+                self._centroids = index["centroids"]
+                self._assign = index["assign"]
+                self._trained_size = int(index["trained_size"])
+            else:
+                logger.warning(
+                    f"IVF index of {self.namespace} is out of sync with the vectors, rebuilding"
+                )
+                self._dirty = True
+        self._build_lists()
+
+    def _build_lists(self):
+        if self._centroids is None:
+            self._lists = None
+            return
+        order = np.argsort(self._assign, kind="stable")
+        bounds = np.searchsorted(
+            self._assign[order], np.arange(len(self._centroids) + 1)
+        )
+        self._lists = [
+            order[bounds[i] : bounds[i + 1]] for i in range(len(self._centroids))
+        ]
+
+    def _nearest_centroids(self, rows: np.ndarray) -> np.ndarray:
+        assign = np.empty(len(rows), dtype=np.int32)
+        for start in range(0, len(rows), self.query_block_size):
+            block = self._matrix[rows[start : start + self.query_block_size]]
+            assign[start : start + len(block)] = np.argmax(
+                block.astype(np.float32) @ self._centroids.T, axis=1
+            )
+        return assign
+
+    def _train(self, rows: np.ndarray):
+        nlist = self._nlist or max(1, int(np.sqrt(len(rows))))
+        rng = np.random.default_rng(0)
+        sample = rows
+        if len(rows) > self.train_sample_size:
+            sample = np.sort(rng.choice(rows, self.train_sample_size, replace=False))
+        logger.info(
+            f"Training IVF index of {self.namespace} with {nlist} lists on {len(sample)} vectors"
+        )
+        self._centroids = _spherical_kmeans(
+            self._matrix[sample].astype(np.float32),
+            min(nlist, len(sample)),
+            self.kmeans_iters,
+        )
+        self._trained_size = len(rows)
+
+    async def upsert(self, data: dict[str, dict]):
+        report = await super().upsert(data)
+        if report and self._centroids is not None:
+            rows = np.array(
+                [self._id_to_row[k] for k in report["update"] + report["insert"]],
+                dtype=np.int64,
+            )
+            if len(self._assign) < len(self._ids):
+                self._assign = np.concatenate(
+                    [
+                        self._assign,
+                        np.zeros(len(self._ids) - len(self._assign), dtype=np.int32),
+                    ]
+                )
+            self._assign[rows] = self._nearest_centroids(rows)
+            self._build_lists()
+        return report
+
+    def _search(self, embeddings: np.ndarray, top_k: int) -> list[list[dict]]:
+        if self._lists is None:
+            return super()._search(embeddings, top_k)
+        probes = np.argsort(-(embeddings @ self._centroids.T), axis=1)[:, : self.nprobe]
+        _mark_ann_used()
+        results = []
+        for embedding, probe in zip(embeddings, probes):
+            rows = np.sort(np.concatenate([self._lists[i] for i in probe]))
+            if not len(rows):
+                results.append([])
+                continue
+            scores = self._matrix[rows].astype(np.float32) @ embedding
+            results.append(self._top_k(scores, top_k, rows=rows))
+        return results
+
+    async def index_done_callback(self):
+        if not self._dirty:
+            return
+        rows = np.array(self._live_rows(), dtype=np.int64)
+        if self._centroids is not None and len(self._assign) == len(self._ids):
+            assign = self._assign[rows]
+        else:
+            assign = None
+        if len(rows) >= self.min_train_size and (
+            assign is None or len(rows) >= self.retrain_growth * self._trained_size
+        ):
+            self._train(rows)
+            assign = None
+        if self._centroids is not None and len(rows):
+            if assign is None:
+                assign = self._nearest_centroids(rows)
+            np.savez(
+                self._index_file_name,
+                centroids=self._centroids,
+                assign=assign,
+                trained_size=self._trained_size,
+            )
+        elif os.path.exists(self._index_file_name):
+            os.remove(self._index_file_name)
+        await super().index_done_callback()
+
+
+def _mark_ann_used():
+    """Flag the retrieval currently tracked by the global monitor, if any."""
+    from .retrieval import performance_monitor
+
+    monitor = performance_monitor._global_monitor
+    if monitor is not None:
+        performance_monitor.RetrievalTracker(monitor).set_ann_used(True)
+
+
+GRAPH_SNAPSHOT_FORMAT = "hypergraphrag-graph"
+GRAPH_SNAPSHOT_VERSION = 1
+
+
+def _json_array(obj) -> np.ndarray:
+    def _default(o):
+        if isinstance(o, np.generic):
+            return o.item()
+        raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+    return np.frombuffer(
+        json.dumps(obj, ensure_ascii=False, default=_default).encode("utf-8"),
+        dtype=np.uint8,
+    )
+
+
+def _from_json_array(data: np.ndarray):
+    return json.loads(data.tobytes().decode("utf-8"))
+
+
+def _to_columns(records: list[dict]) -> dict[str, list]:
+    columns = {}
+    for i, record in enumerate(records):
+        for key, value in record.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * len(records)
+            column[i] = value
+    return columns
+
+
+def write_graph_snapshot(
+    file_name: str,
+    node_ids: list[str],
+    node_columns: dict[str, list],
+    edge_src,
+    edge_tgt,
+    edge_columns: dict[str, list],
+):
+    """Write a graph as a versioned ``.npz`` snapshot.
+
+    Edges are int64 arrays of node positions; node and edge attributes are
+    stored column-wise as JSON blobs. The file is replaced atomically.
+    """
+    header = {"format": GRAPH_SNAPSHOT_FORMAT, "version": GRAPH_SNAPSHOT_VERSION}
+    tmp_file_name = file_name + ".tmp"
+    with open(tmp_file_name, "wb") as f:
+        np.savez(
+            f,
+            header=_json_array(header),
+            node_ids=_json_array(node_ids),
+            node_columns=_json_array(node_columns),
+            edge_src=np.asarray(edge_src, dtype=np.int64),
+            edge_tgt=np.asarray(edge_tgt, dtype=np.int64),
+            edge_columns=_json_array(edge_columns),
+        )
+    os.replace(tmp_file_name, file_name)
+
+
+def load_graph_snapshot(file_name: str) -> Union[dict, None]:
+    """Read a snapshot written by `write_graph_snapshot`, None if the file is missing"""
+    if not os.path.exists(file_name):
+        return None
+    with np.load(file_name) as data:
+        header = _from_json_array(data["header"])
+        if (
+            header.get("format") != GRAPH_SNAPSHOT_FORMAT
+            or header.get("version", 0) > GRAPH_SNAPSHOT_VERSION
+        ):
+            raise ValueError(f"Unsupported graph snapshot {file_name}: {header}")
+        return {
+            "node_ids": _from_json_array(data["node_ids"]),
+            "node_columns": _from_json_array(data["node_columns"]),
+            "edge_src": data["edge_src"],
+            "edge_tgt": data["edge_tgt"],
+            "edge_columns": _from_json_array(data["edge_columns"]),
+        }
+
+
 @dataclass
 class NetworkXStorage(BaseGraphStorage):
     @staticmethod
     def load_nx_graph(file_name) -> nx.Graph:
+        snapshot = load_graph_snapshot(file_name)
+        if snapshot is None:
+            return None
+        node_ids = snapshot["node_ids"]
+        node_columns = snapshot["node_columns"].items()
+        edge_columns = snapshot["edge_columns"].items()
+        graph = nx.Graph()
+        graph.add_nodes_from(
+            (
+                node_id,
+                {k: column[i] for k, column in node_columns if column[i] is not None},
+            )
+            for i, node_id in enumerate(node_ids)
+        )
+        graph.add_edges_from(
+            (
+                node_ids[src],
+                node_ids[tgt],
+                {k: column[i] for k, column in edge_columns if column[i] is not None},
+            )
+            for i, (src, tgt) in enumerate(
+                zip(snapshot["edge_src"].tolist(), snapshot["edge_tgt"].tolist())
+            )
+        )
+        return graph
+
+    @staticmethod
+    def write_nx_graph(graph: nx.Graph, file_name):
+        logger.info(
+            f"Writing graph with {graph.number_of_nodes()} nodes, {graph.number_of_edges()} edges"
+        )
+        node_ids = list(graph.nodes)
+        position = {node_id: i for i, node_id in enumerate(node_ids)}
+        edges = list(graph.edges(data=True))
+        write_graph_snapshot(
+            file_name,
+            node_ids,
+            _to_columns([data for _, data in graph.nodes(data=True)]),
+            [position[src] for src, _, _ in edges],
+            [position[tgt] for _, tgt, _ in edges],
+            _to_columns([data for _, _, data in edges]),
+        )
+
+    @staticmethod
+    def load_graphml(file_name) -> nx.Graph:
         if os.path.exists(file_name):
             return nx.read_graphml(file_name)
         return None
 
     @staticmethod
-    def write_nx_graph(graph: nx.Graph, file_name):
+    def write_graphml(graph: nx.Graph, file_name):
         logger.info(
-            f"Writing graph with {graph.number_of_nodes()} nodes, {graph.number_of_edges()} edges"
+            f"Exporting graph with {graph.number_of_nodes()} nodes, {graph.number_of_edges()} edges to {file_name}"
         )
         nx.write_graphml(graph, file_name)
 
@@ -238,13 +1330,22 @@ class NetworkXStorage(BaseGraphStorage):
         return fixed_graph
 
     def __post_init__(self):
+        working_dir = self.global_config["working_dir"]
+        self._snapshot_file = os.path.join(working_dir, f"graph_{self.namespace}.npz")
         self._graphml_xml_file = os.path.join(
-            self.global_config["working_dir"], f"graph_{self.namespace}.graphml"
+            working_dir, f"graph_{self.namespace}.graphml"
         )
-        preloaded_graph = NetworkXStorage.load_nx_graph(self._graphml_xml_file)
+        preloaded_graph = NetworkXStorage.load_nx_graph(self._snapshot_file)
+        if preloaded_graph is None:
+            preloaded_graph = NetworkXStorage.load_graphml(self._graphml_xml_file)
+            if preloaded_graph is not None:
+                logger.info(
+                    f"Migrating {self._graphml_xml_file} to {self._snapshot_file}"
+                )
+                NetworkXStorage.write_nx_graph(preloaded_graph, self._snapshot_file)
         if preloaded_graph is not None:
             logger.info(
-                f"Loaded graph from {self._graphml_xml_file} with {preloaded_graph.number_of_nodes()} nodes, {preloaded_graph.number_of_edges()} edges"
+                f"Loaded graph from {self._snapshot_file} with {preloaded_graph.number_of_nodes()} nodes, {preloaded_graph.number_of_edges()} edges"
             )
         self._graph = preloaded_graph or nx.Graph()
         self._node_embed_algorithms = {
@@ -252,7 +1353,11 @@ class NetworkXStorage(BaseGraphStorage):
         }
 
     async def index_done_callback(self):
-        NetworkXStorage.write_nx_graph(self._graph, self._graphml_xml_file)
+        NetworkXStorage.write_nx_graph(self._graph, self._snapshot_file)
+
+    def export_graphml(self, file_name: str = None):
+        """Write the graph as GraphML, by default to ``graph_<namespace>.graphml``"""
+        NetworkXStorage.write_graphml(self._graph, file_name or self._graphml_xml_file)
 
     async def has_node(self, node_id: str) -> bool:
         return self._graph.has_node(node_id)
@@ -264,10 +1369,11 @@ class NetworkXStorage(BaseGraphStorage):
         return self._graph.nodes.get(node_id)
 
     async def node_degree(self, node_id: str) -> int:
-        return self._graph.degree(node_id)
+        # networkx returns a DegreeView instead of raising for unknown nodes
+        return self._graph.degree(node_id) if node_id in self._graph else 0
 
     async def edge_degree(self, src_id: str, tgt_id: str) -> int:
-        return self._graph.degree(src_id) + self._graph.degree(tgt_id)
+        return await self.node_degree(src_id) + await self.node_degree(tgt_id)
 
     async def get_edge(
         self, source_node_id: str, target_node_id: str
@@ -279,6 +1385,26 @@ class NetworkXStorage(BaseGraphStorage):
             return list(self._graph.edges(source_node_id))
         return None
 
+    async def get_nodes_batch(self, node_ids: list[str]) -> list[Union[dict, None]]:
+        nodes = self._graph.nodes
+        return [nodes.get(node_id) for node_id in node_ids]
+
+    async def node_degrees_batch(self, node_ids: list[str]) -> list[int]:
+        degree = self._graph.degree
+        return [degree(node_id) if node_id in self._graph else 0 for node_id in node_ids]
+
+    async def get_edges_batch(
+        self, edge_pairs: list[tuple[str, str]]
+    ) -> list[Union[dict, None]]:
+        edges = self._graph.edges
+        return [edges.get(pair) for pair in edge_pairs]
+
+    async def get_node_edges_batch(self, node_ids: list[str]):
+        return [
+            list(self._graph.edges(node_id)) if node_id in self._graph else None
+            for node_id in node_ids
+        ]
+
     async def upsert_node(self, node_id: str, node_data: dict[str, str]):
         self._graph.add_node(node_id, **node_data)
 
@@ -287,6 +1413,12 @@ class NetworkXStorage(BaseGraphStorage):
     ):
         self._graph.add_edge(source_node_id, target_node_id, **edge_data)
 
+    async def upsert_nodes(self, nodes: list[tuple[str, dict]]):
+        self._graph.add_nodes_from(nodes)
+
+    async def upsert_edges(self, edges: list[tuple[str, str, dict]]):
+        self._graph.add_edges_from(edges)
+
     async def delete_node(self, node_id: str):
         """
         Delete a node from the graph based on the specified node_id.
@@ -315,3 +1447,617 @@ class NetworkXStorage(BaseGraphStorage):
 
         nodes_ids = [self._graph.nodes[node_id]["id"] for node_id in nodes]
         return embeddings, nodes_ids
+
+
+def _reserve(buffer: np.ndarray, size: int, fill=0) -> np.ndarray:
+    """`buffer`, or a geometrically grown copy of it, with room for `size` rows"""
+    if size <= len(buffer):
+        return buffer
+    grown = np.full(max(size, 2 * len(buffer), 64), fill, dtype=buffer.dtype)
+    grown[: len(buffer)] = buffer
+    return grown
+
+
+def _edge_key(src: int, tgt: int) -> int:
+    # an undirected edge packed into one int64, the smaller row in the high half
+    return (min(src, tgt) << 32) | max(src, tgt)
+
+
+def _edge_keys(src: np.ndarray, tgt: np.ndarray) -> np.ndarray:
+    return (np.minimum(src, tgt) << 32) | np.maximum(src, tgt)
+
+
+class _AttributeColumns:
+    """Typed, sparse attribute columns over the rows of a node or edge table.
+
+    A column whose first value is a float is stored as float64, NaN for missing
+    values. Any other column is dictionary-encoded as int64 codes into its
+    distinct values, -1 for missing; a float column is re-encoded that way when
+    it receives a value of another type.
+    """
+
+    def __init__(self, size: int = 0):
+        self.size = size
+        self._columns: dict[str, np.ndarray] = {}
+        # distinct values of the encoded columns, and their codes
+        self._values: dict[str, list] = {}
+        self._codes: dict[str, dict] = {}
+
+    @classmethod
+    def from_lists(cls, columns: dict[str, list], size: int) -> "_AttributeColumns":
+        table = cls(size)
+        for key, column in columns.items():
+            for row, value in enumerate(column):
+                if value is not None:
+                    table._set_value(key, row, value)
+        return table
+
+    def resize(self, size: int):
+        """Make room for rows up to `size`; new rows have no attributes"""
+        self.size = size
+        for key, column in self._columns.items():
+            self._columns[key] = _reserve(column, size, self._missing(key))
+
+    def set(self, row: int, data: dict):
+        for key, value in data.items():
+            self._set_value(key, row, value)
+
+    def get(self, row: int) -> dict:
+        data = {}
+        for key, column in self._columns.items():
+            value = column[row]
+            if key in self._values:
+                if value >= 0:
+                    data[key] = self._values[key][value]
+            elif not np.isnan(value):
+                data[key] = float(value)
+        return data
+
+    def clear(self, rows):
+        for key, column in self._columns.items():
+            column[rows] = self._missing(key)
+
+    def to_lists(self, rows: np.ndarray) -> dict[str, list]:
+        """The columns of `rows` as lists, None for missing values"""
+        columns = {}
+        for key, column in self._columns.items():
+            picked = column[rows].tolist()
+            if key in self._values:
+                values = self._values[key]
+                columns[key] = [None if c < 0 else values[c] for c in picked]
+            else:
+                columns[key] = [None if np.isnan(v) else v for v in picked]
+        return columns
+
+    def equals(self, key: str, value) -> np.ndarray:
+        """Boolean mask of the rows whose `key` attribute is `value`"""
+        column = self._columns.get(key)
+        if column is None:
+            return np.zeros(self.size, dtype=bool)
+        if key not in self._values:
+            return column[: self.size] == value
+        code = self._codes[key].get((type(value), value))
+        if code is None:
+            return np.zeros(self.size, dtype=bool)
+        return column[: self.size] == code
+
+    def _missing(self, key: str):
+        return -1 if key in self._values else np.nan
+
+    def _set_value(self, key: str, row: int, value):
+        if key not in self._columns:
+            if isinstance(value, float):
+                empty = np.zeros(0, dtype=np.float64)
+                self._columns[key] = _reserve(empty, self.size, np.nan)
+            else:
+                self._add_encoded(key)
+        elif key not in self._values and not isinstance(value, (float, type(None))):
+            self._encode(key)
+        if key in self._values:
+            self._columns[key][row] = self._code(key, value)
+        else:
+            self._columns[key][row] = np.nan if value is None else value
+
+    def _add_encoded(self, key: str):
+        self._values[key], self._codes[key] = [], {}
+        self._columns[key] = _reserve(np.zeros(0, dtype=np.int64), self.size, -1)
+
+    def _encode(self, key: str):
+        floats = self._columns[key]
+        self._add_encoded(key)
+        codes = self._columns[key]
+        for row in np.flatnonzero(~np.isnan(floats[: self.size])).tolist():
+            codes[row] = self._code(key, float(floats[row]))
+
+    def _code(self, key: str, value) -> int:
+        if value is None:
+            return -1
+        values, codes = self._values[key], self._codes[key]
+        token = (type(value), value)
+        try:
+            code = codes.get(token)
+        except TypeError:
+            # unhashable values, e.g. lists, are stored without deduplication
+            token = code = None
+        if code is None:
+            code = len(values)
+            values.append(value)
+            if token is not None:
+                codes[token] = code
+        return code
+
+
+@dataclass
+class IncidenceGraphStorage(BaseGraphStorage):
+    """Hypergraph storage backed by a sparse hyperedge x entity incidence structure.
+
+    Node ids are interned to integer rows. Edge endpoints, liveness flags and
+    node degrees are growable numpy arrays, and node/edge attributes are typed
+    columns (`_AttributeColumns`). Edges are found by a packed int64 key in a
+    sorted array; edges added since it was sorted wait in a small pending map
+    that is merged in batches. The CSR adjacency behind `incidence` is extended
+    with new edges rather than rebuilt, and only rebuilt once deleted edges make
+    up a quarter of it. State lives in the same ``graph_<namespace>.npz``
+    snapshot as `NetworkXStorage`; an existing ``graph_<namespace>.graphml`` is
+    imported on first load.
+    """
+
+    # minimum number of pending edges merged into the sorted key index at once
+    edge_index_batch: int = 1024
+
+    def __post_init__(self):
+        working_dir = self.global_config["working_dir"]
+        self._snapshot_file = os.path.join(working_dir, f"graph_{self.namespace}.npz")
+        self._graphml_xml_file = os.path.join(
+            working_dir, f"graph_{self.namespace}.graphml"
+        )
+        self._load()
+
+    def _load(self):
+        self._node_ids: list[str] = []
+        self._node_index: dict[str, int] = {}
+        self._node_alive = np.zeros(0, dtype=bool)
+        self._degree = np.zeros(0, dtype=np.int64)
+        self._node_attrs = _AttributeColumns()
+        self._edge_count = 0
+        self._edge_src = np.zeros(0, dtype=np.int64)
+        self._edge_tgt = np.zeros(0, dtype=np.int64)
+        self._edge_alive = np.zeros(0, dtype=bool)
+        self._edge_attrs = _AttributeColumns()
+        # packed keys of the indexed edges in sorted order, and their edge rows
+        self._sorted_keys = np.zeros(0, dtype=np.int64)
+        self._sorted_rows = np.zeros(0, dtype=np.int64)
+        # packed key -> edge row for edges added since the index was sorted
+        self._pending_edges: dict[int, int] = {}
+        # (indptr, neighbour rows, edge rows, number of edge rows covered)
+        self._csr = None
+        self._csr_dead = 0
+        self._version = 0
+        self._nx_snapshot = None
+
+        snapshot = load_graph_snapshot(self._snapshot_file)
+        if snapshot is not None:
+            self._node_ids = snapshot["node_ids"]
+            self._node_index = {k: i for i, k in enumerate(self._node_ids)}
+            n = len(self._node_ids)
+            self._node_alive = np.ones(n, dtype=bool)
+            self._node_attrs = _AttributeColumns.from_lists(
+                snapshot["node_columns"], n
+            )
+            src = snapshot["edge_src"].astype(np.int64)
+            tgt = snapshot["edge_tgt"].astype(np.int64)
+            self._edge_count = len(src)
+            self._edge_src, self._edge_tgt = src, tgt
+            self._edge_alive = np.ones(len(src), dtype=bool)
+            self._edge_attrs = _AttributeColumns.from_lists(
+                snapshot["edge_columns"], len(src)
+            )
+            # a self-loop counts twice, as in networkx
+            self._degree = np.bincount(src, minlength=n) + np.bincount(
+                tgt, minlength=n
+            )
+            keys = _edge_keys(src, tgt)
+            self._sorted_rows = np.argsort(keys, kind="stable")
+            self._sorted_keys = keys[self._sorted_rows]
+            self._dirty = False
+        else:
+            self._dirty = self._import_graphml()
+        logger.info(
+            f"Loaded graph {self.namespace} with {len(self._node_index)} nodes, {len(self._sorted_keys)} edges"
+        )
+
+    def _import_graphml(self):
+        graph = NetworkXStorage.load_graphml(self._graphml_xml_file)
+        if graph is None:
+            return False
+        logger.info(f"Importing graph {self.namespace} from {self._graphml_xml_file}")
+        for node_id, node_data in graph.nodes(data=True):
+            self._set_node(node_id, node_data)
+        for source_node_id, target_node_id, edge_data in graph.edges(data=True):
+            self._set_edge(source_node_id, target_node_id, edge_data)
+        return True
+
+    async def index_done_callback(self):
+        if not self._dirty:
+            return
+        node_rows = np.flatnonzero(self._node_alive[: len(self._node_ids)])
+        edge_rows = np.flatnonzero(self._edge_alive[: self._edge_count])
+        remap = np.full(len(self._node_ids), -1, dtype=np.int64)
+        remap[node_rows] = np.arange(len(node_rows))
+
+        logger.info(
+            f"Writing graph with {len(node_rows)} nodes, {len(edge_rows)} edges"
+        )
+        write_graph_snapshot(
+            self._snapshot_file,
+            [self._node_ids[r] for r in node_rows],
+            self._node_attrs.to_lists(node_rows),
+            remap[self._edge_src[edge_rows]],
+            remap[self._edge_tgt[edge_rows]],
+            self._edge_attrs.to_lists(edge_rows),
+        )
+        self._load()
+
+    def export_graphml(self, file_name: str = None):
+        """Write the graph as GraphML, by default to ``graph_<namespace>.graphml``"""
+        NetworkXStorage.write_graphml(
+            self.to_networkx(), file_name or self._graphml_xml_file
+        )
+
+    ################ row / column helpers ################
+
+    def _intern(self, node_id: str) -> int:
+        row = self._node_index.get(node_id)
+        if row is None:
+            row = len(self._node_ids)
+            self._node_ids.append(node_id)
+            self._node_index[node_id] = row
+            self._node_alive = _reserve(self._node_alive, row + 1)
+            self._node_alive[row] = True
+            self._degree = _reserve(self._degree, row + 1)
+            self._node_attrs.resize(row + 1)
+        return row
+
+    def _set_node(self, node_id: str, node_data: dict):
+        row = self._intern(node_id)
+        self._node_attrs.set(row, node_data)
+        self._version += 1
+
+    def _set_edge(self, source_node_id: str, target_node_id: str, edge_data: dict):
+        src, tgt = self._intern(source_node_id), self._intern(target_node_id)
+        edge = self._find_edge(src, tgt)
+        if edge < 0:
+            edge = self._edge_count
+            self._edge_count += 1
+            self._edge_src = _reserve(self._edge_src, self._edge_count)
+            self._edge_tgt = _reserve(self._edge_tgt, self._edge_count)
+            self._edge_alive = _reserve(self._edge_alive, self._edge_count)
+            self._edge_src[edge], self._edge_tgt[edge] = src, tgt
+            self._edge_alive[edge] = True
+            self._edge_attrs.resize(self._edge_count)
+            # a self-loop counts twice, as in networkx
+            self._degree[src] += 1
+            self._degree[tgt] += 1
+            self._pending_edges[_edge_key(src, tgt)] = edge
+            if len(self._pending_edges) >= max(
+                self.edge_index_batch, len(self._sorted_keys) // 8
+            ):
+                self._sort_edge_index()
+        self._edge_attrs.set(edge, edge_data)
+        self._version += 1
+
+    def _sort_edge_index(self):
+        """Merge the pending edges into the sorted key index, dropping dead edges"""
+        alive = self._edge_alive[self._sorted_rows]
+        keys, rows = self._sorted_keys[alive], self._sorted_rows[alive]
+        count = len(self._pending_edges)
+        new_keys = np.fromiter(self._pending_edges.keys(), dtype=np.int64, count=count)
+        new_rows = np.fromiter(
+            self._pending_edges.values(), dtype=np.int64, count=count
+        )
+        order = np.argsort(new_keys)
+        at = np.searchsorted(keys, new_keys[order])
+        self._sorted_keys = np.insert(keys, at, new_keys[order])
+        self._sorted_rows = np.insert(rows, at, new_rows[order])
+        self._pending_edges = {}
+
+    def _find_edge(self, src: int, tgt: int) -> int:
+        """Row of the live edge between node rows `src` and `tgt`, -1 if none"""
+        key = _edge_key(src, tgt)
+        edge = self._pending_edges.get(key)
+        if edge is not None:
+            return edge
+        at = int(np.searchsorted(self._sorted_keys, key))
+        if at < len(self._sorted_keys) and self._sorted_keys[at] == key:
+            edge = int(self._sorted_rows[at])
+            if self._edge_alive[edge]:
+                return edge
+        return -1
+
+    def _find_edges(self, src: np.ndarray, tgt: np.ndarray) -> np.ndarray:
+        """Vectorized `_find_edge`; node rows of -1 give -1"""
+        keys = _edge_keys(src, tgt)
+        edges = np.full(len(keys), -1, dtype=np.int64)
+        if len(self._sorted_keys):
+            at = np.searchsorted(self._sorted_keys, keys)
+            at = np.minimum(at, len(self._sorted_keys) - 1)
+            hit = self._sorted_keys[at] == keys
+            edges[hit] = self._sorted_rows[at[hit]]
+            dead = edges >= 0
+            dead[dead] = ~self._edge_alive[edges[dead]]
+            edges[dead] = -1
+        if self._pending_edges:
+            for i, key in enumerate(keys.tolist()):
+                edges[i] = self._pending_edges.get(key, edges[i])
+        edges[(src < 0) | (tgt < 0)] = -1
+        return edges
+
+    def _edge_row(self, source_node_id: str, target_node_id: str) -> Union[int, None]:
+        src = self._node_index.get(source_node_id)
+        tgt = self._node_index.get(target_node_id)
+        if src is None or tgt is None:
+            return None
+        edge = self._find_edge(src, tgt)
+        return None if edge < 0 else edge
+
+    def _rows(self, node_ids: list[str]) -> np.ndarray:
+        """Node rows for `node_ids`, -1 for unknown ids"""
+        return np.fromiter(
+            (self._node_index.get(node_id, -1) for node_id in node_ids),
+            dtype=np.int64,
+            count=len(node_ids),
+        )
+
+    def _compile(self):
+        """CSR adjacency over node rows as ``(indptr, neighbour_rows, edge_rows)``.
+
+        Edges added since the last call are merged into the existing CSR, after
+        the entries already listed for each node. The CSR is rebuilt from scratch
+        only once deleted edges, which `_gather` skips, make up a quarter of it.
+        """
+        n = len(self._node_ids)
+        if self._csr is None or 4 * self._csr_dead > len(self._csr[1]):
+            empty = np.zeros(0, dtype=np.int64)
+            self._csr = (np.zeros(1, dtype=np.int64), empty, empty, 0)
+            self._csr_dead = 0
+        indptr, neighbours, edges, covered = self._csr
+        if covered == self._edge_count and len(indptr) == n + 1:
+            return indptr, neighbours, edges
+
+        new = np.arange(covered, self._edge_count)
+        new = new[self._edge_alive[new]]
+        src, tgt = self._edge_src[new], self._edge_tgt[new]
+        # undirected: each edge is listed under both endpoints, self-loops once
+        twin = src != tgt
+        rows = np.concatenate([src, tgt[twin]])
+        order = np.lexsort((np.concatenate([new, new[twin]]), rows))
+        rows = rows[order]
+        new_neighbours = np.concatenate([tgt, src[twin]])[order]
+        new_edges = np.concatenate([new, new[twin]])[order]
+
+        old_counts = np.zeros(n, dtype=np.int64)
+        old_counts[: len(indptr) - 1] = np.diff(indptr)
+        new_counts = np.bincount(rows, minlength=n)
+        merged = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(old_counts + new_counts, out=merged[1:])
+        # existing entries move with the start of their row, new ones follow them
+        old_rows = np.repeat(np.arange(n), old_counts)
+        old_at = np.arange(len(neighbours)) - indptr[old_rows] + merged[old_rows]
+        new_starts = np.cumsum(new_counts) - new_counts
+        new_at = (
+            merged[rows] + old_counts[rows] + np.arange(len(rows)) - new_starts[rows]
+        )
+        merged_neighbours = np.empty(merged[-1], dtype=np.int64)
+        merged_edges = np.empty(merged[-1], dtype=np.int64)
+        merged_neighbours[old_at] = neighbours
+        merged_neighbours[new_at] = new_neighbours
+        merged_edges[old_at] = edges
+        merged_edges[new_at] = new_edges
+        self._csr = (merged, merged_neighbours, merged_edges, self._edge_count)
+        return merged, merged_neighbours, merged_edges
+
+    def _gather(self, rows: np.ndarray):
+        """Concatenated neighbourhoods of `rows` as ``(offsets, neighbour_rows, edge_rows)``"""
+        indptr, neighbours, edges = self._compile()
+        known = rows >= 0
+        starts = indptr[np.where(known, rows, 0)]
+        counts = np.where(known, indptr[np.where(known, rows, 0) + 1] - starts, 0)
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        flat = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+        neighbours, edges = neighbours[flat], edges[flat]
+        if self._csr_dead:
+            alive = self._edge_alive[edges]
+            owners = np.repeat(np.arange(len(rows)), counts)
+            np.cumsum(np.bincount(owners[alive], minlength=len(rows)), out=offsets[1:])
+            neighbours, edges = neighbours[alive], edges[alive]
+        return offsets, neighbours, edges
+
+    ################ vectorized operations ################
+
+    def degrees(self, node_ids: list[str]) -> np.ndarray:
+        """Degrees of `node_ids` as an int64 array, 0 for unknown ids"""
+        rows = self._rows(node_ids)
+        known = rows >= 0
+        degrees = np.zeros(len(rows), dtype=np.int64)
+        degrees[known] = self._degree[rows[known]]
+        return degrees
+
+    def neighbours(self, node_ids: list[str]) -> tuple[np.ndarray, list[str]]:
+        """Neighbourhoods of `node_ids` in CSR form.
+
+        Returns ``(offsets, neighbour_ids)``: the neighbours of ``node_ids[i]`` are
+        ``neighbour_ids[offsets[i]:offsets[i + 1]]``.
+        """
+        offsets, neighbours, _ = self._gather(self._rows(node_ids))
+        return offsets, [self._node_ids[r] for r in neighbours.tolist()]
+
+    def incidence(
+        self, transpose: bool = False
+    ) -> tuple[np.ndarray, np.ndarray, list[str], list[str]]:
+        """The hyperedge x entity incidence matrix in CSR form.
+
+        Returns ``(indptr, indices, row_ids, col_ids)``. Rows are hyperedge nodes
+        (``role == "hyperedge"``) and columns all other nodes; ``transpose=True``
+        gives the entity x hyperedge matrix, i.e. the CSC view.
+        """
+        hyperedge_mask = self._node_attrs.equals("role", "hyperedge")
+        node_alive = self._node_alive[: len(self._node_ids)]
+        row_mask = hyperedge_mask & node_alive
+        col_mask = ~hyperedge_mask & node_alive
+        if transpose:
+            row_mask, col_mask = col_mask, row_mask
+        rows, cols = np.flatnonzero(row_mask), np.flatnonzero(col_mask)
+        positions = np.full(len(self._node_ids), -1, dtype=np.int64)
+        positions[cols] = np.arange(len(cols))
+
+        offsets, neighbours, _ = self._gather(rows)
+        owners = np.repeat(np.arange(len(rows)), np.diff(offsets))
+        indices = positions[neighbours]
+        keep = indices >= 0
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(owners[keep], minlength=len(rows)), out=indptr[1:])
+        return (
+            indptr,
+            indices[keep],
+            [self._node_ids[r] for r in rows.tolist()],
+            [self._node_ids[c] for c in cols.tolist()],
+        )
+
+    def to_networkx(self) -> nx.Graph:
+        graph = nx.Graph()
+        graph.add_nodes_from(
+            (node_id, self._node_attrs.get(row))
+            for node_id, row in self._node_index.items()
+        )
+        edge_rows = np.flatnonzero(self._edge_alive[: self._edge_count])
+        graph.add_edges_from(
+            (self._node_ids[src], self._node_ids[tgt], self._edge_attrs.get(edge))
+            for edge, src, tgt in zip(
+                edge_rows.tolist(),
+                self._edge_src[edge_rows].tolist(),
+                self._edge_tgt[edge_rows].tolist(),
+            )
+        )
+        return graph
+
+    @property
+    def _graph(self) -> nx.Graph:
+        # read-only snapshot for callers that reach into NetworkXStorage._graph
+        if self._nx_snapshot is None or self._nx_snapshot[0] != self._version:
+            self._nx_snapshot = (self._version, self.to_networkx())
+        return self._nx_snapshot[1]
+
+    ################ BaseGraphStorage ################
+
+    async def has_node(self, node_id: str) -> bool:
+        return node_id in self._node_index
+
+    async def has_edge(self, source_node_id: str, target_node_id: str) -> bool:
+        return self._edge_row(source_node_id, target_node_id) is not None
+
+    async def get_node(self, node_id: str) -> Union[dict, None]:
+        row = self._node_index.get(node_id)
+        if row is None:
+            return None
+        return self._node_attrs.get(row)
+
+    async def node_degree(self, node_id: str) -> int:
+        return int(self.degrees([node_id])[0])
+
+    async def edge_degree(self, src_id: str, tgt_id: str) -> int:
+        return int(self.degrees([src_id, tgt_id]).sum())
+
+    async def get_edge(
+        self, source_node_id: str, target_node_id: str
+    ) -> Union[dict, None]:
+        edge = self._edge_row(source_node_id, target_node_id)
+        if edge is None:
+            return None
+        return self._edge_attrs.get(edge)
+
+    async def get_node_edges(self, source_node_id: str):
+        return (await self.get_node_edges_batch([source_node_id]))[0]
+
+    async def get_nodes_batch(self, node_ids: list[str]) -> list[Union[dict, None]]:
+        return [
+            None if row < 0 else self._node_attrs.get(row)
+            for row in self._rows(node_ids).tolist()
+        ]
+
+    async def node_degrees_batch(self, node_ids: list[str]) -> list[int]:
+        return self.degrees(node_ids).tolist()
+
+    async def get_edges_batch(
+        self, edge_pairs: list[tuple[str, str]]
+    ) -> list[Union[dict, None]]:
+        edges = self._find_edges(
+            self._rows([src for src, _ in edge_pairs]),
+            self._rows([tgt for _, tgt in edge_pairs]),
+        )
+        return [
+            None if edge < 0 else self._edge_attrs.get(edge) for edge in edges.tolist()
+        ]
+
+    async def edge_degrees_batch(self, edge_pairs: list[tuple[str, str]]) -> list[int]:
+        degrees = self.degrees([n for pair in edge_pairs for n in pair])
+        return (degrees[0::2] + degrees[1::2]).tolist()
+
+    async def get_node_edges_batch(self, node_ids: list[str]):
+        rows = self._rows(node_ids)
+        offsets, neighbours, _ = self._gather(rows)
+        offsets, neighbours = offsets.tolist(), neighbours.tolist()
+        return [
+            None
+            if row < 0
+            else [
+                (node_id, self._node_ids[r])
+                for r in neighbours[offsets[i] : offsets[i + 1]]
+            ]
+            for i, (node_id, row) in enumerate(zip(node_ids, rows.tolist()))
+        ]
+
+    async def upsert_node(self, node_id: str, node_data: dict[str, str]):
+        self._set_node(node_id, node_data)
+        self._dirty = True
+
+    async def upsert_edge(
+        self, source_node_id: str, target_node_id: str, edge_data: dict[str, str]
+    ):
+        self._set_edge(source_node_id, target_node_id, edge_data)
+        self._dirty = True
+
+    async def upsert_nodes(self, nodes: list[tuple[str, dict]]):
+        for node_id, node_data in nodes:
+            self._set_node(node_id, node_data)
+        self._dirty = True
+
+    async def upsert_edges(self, edges: list[tuple[str, str, dict]]):
+        for source_node_id, target_node_id, edge_data in edges:
+            self._set_edge(source_node_id, target_node_id, edge_data)
+        self._dirty = True
+
+    async def delete_node(self, node_id: str):
+        """
+        Delete a node and its incident edges from the graph.
+
+        :param node_id: The node_id to delete
+        """
+        row = self._node_index.get(node_id)
+        if row is None:
+            logger.warning(f"Node {node_id} not found in the graph for deletion.")
+            return
+        _, neighbours, edges = self._gather(np.array([row], dtype=np.int64))
+        self._edge_alive[edges] = False
+        self._edge_attrs.clear(edges)
+        np.subtract.at(self._degree, neighbours, 1)
+        self._csr_dead += len(edges)
+        for key in _edge_keys(self._edge_src[edges], self._edge_tgt[edges]).tolist():
+            self._pending_edges.pop(key, None)
+        del self._node_index[node_id]
+        self._node_alive[row] = False
+        self._degree[row] = 0
+        self._node_attrs.clear(row)
+        self._version += 1
+        self._dirty = True
+        logger.info(f"Node {node_id} deleted from the graph.")
@@ -6,8 +6,14 @@ import json
 import logging
 import os
 import re
+import time
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass
 from functools import wraps
+from itertools import accumulate
 from hashlib import md5
 from typing import Any, Union, List, Optional
 import xml.etree.ElementTree as ET
@@ -111,23 +117,226 @@ def compute_mdhash_id(content, prefix: str = ""):
     return prefix + md5(content.encode()).hexdigest()
 
 
-def limit_async_func_call(max_size: int, waitting_time: float = 0.0001):
-    """Add restriction of maximum async calling times for a async func"""
+PRIORITY_QUERY = 0
+PRIORITY_BULK = 1
+
+_admission_priority: ContextVar[int] = ContextVar(
+    "admission_priority", default=PRIORITY_BULK
+)
+
+
+@contextmanager
+def admission_priority(priority: int):
+    """Run calls made in this context (and tasks it spawns) at ``priority``"""
+    token = _admission_priority.set(priority)
+    try:
+        yield
+    finally:
+        _admission_priority.reset(token)
+
+
+class AdmissionScheduler:
+    """Caps in-flight calls, admitting waiters FIFO within priority classes.
+
+    Lower priority values are admitted first. A released slot is handed
+    directly to the next waiter, so nothing polls while the cap is reached.
+    Futures are created from the running loop on demand, which keeps one
+    scheduler usable across event loops.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._in_flight = 0
+        self._waiters: dict[int, deque] = {}
+        self._admitted = 0
+        self._queued = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _queue_depth(self) -> int:
+        return sum(len(q) for q in self._waiters.values())
+
+    async def acquire(self, priority: int = PRIORITY_BULK):
+        if self._in_flight < self.max_size and not self._queue_depth():
+            self._in_flight += 1
+            self._admitted += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(priority, deque()).append(future)
+        start = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # admitted just before the cancellation landed
+                self.release()
+            elif future in self._waiters[priority]:
+                self._waiters[priority].remove(future)
+            raise
+        waited = time.perf_counter() - start
+        self._queued += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+
+    def release(self):
+        self._in_flight -= 1
+        self._wake()
+
+    def resize(self, max_size: int):
+        """Change the cap; waiters are admitted at once if it grew"""
+        self.max_size = max_size
+        self._wake()
+
+    def _wake(self):
+        for priority in sorted(self._waiters):
+            queue = self._waiters[priority]
+            while queue and self._in_flight < self.max_size:
+                future = queue.popleft()
+                if future.done():
+                    continue
+                self._in_flight += 1
+                self._admitted += 1
+                future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "max_size": self.max_size,
+            "in_flight": self._in_flight,
+            "queue_depth": {p: len(q) for p, q in sorted(self._waiters.items())},
+            "admitted": self._admitted,
+            "queued": self._queued,
+            "avg_wait": self._total_wait / self._queued if self._queued else 0.0,
+            "max_wait": self._max_wait,
+        }
+
+
+class RateController:
+    """Adaptive admission for one provider: an AIMD in-flight window plus
+    requests-per-minute and tokens-per-minute budgets.
+
+    The window grows by roughly one slot per window of successful calls and is
+    halved on a rate-limit error, or when latency exceeds ``latency_target``,
+    at most once per ``decrease_interval`` seconds. Calls whose estimated
+    tokens would overrun the last minute's budgets sleep until it frees up;
+    the time spent there is reported as ``throttle_time``.
+    """
+
+    def __init__(
+        self,
+        rpm: int = None,
+        tpm: int = None,
+        max_window: int = 16,
+        min_window: int = 1,
+        latency_target: float = None,
+        decrease_interval: float = 5.0,
+    ):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_window = max_window
+        self.min_window = min_window
+        self.latency_target = latency_target
+        self.decrease_interval = decrease_interval
+        self._window = float(max_window)
+        self._scheduler = AdmissionScheduler(max_window)
+        # [start time, tokens] of calls started in the last minute
+        self._recent: deque = deque()
+        self._recent_tokens = 0
+        self._last_decrease = 0.0
+        self._throttle_time = 0.0
+        self._rate_limited = 0
+        self._completed = 0
+        self._total_latency = 0.0
+
+    def _expire(self, now: float):
+        while self._recent and self._recent[0][0] <= now - 60:
+            self._recent_tokens -= self._recent.popleft()[1]
+
+    def _budget_wait(self, tokens: int, now: float) -> float:
+        self._expire(now)
+        if not self._recent:
+            return 0.0
+        if self.rpm is not None and len(self._recent) >= self.rpm:
+            return self._recent[0][0] + 60 - now
+        if self.tpm is not None and self._recent_tokens + tokens > self.tpm:
+            return self._recent[0][0] + 60 - now
+        return 0.0
+
+    async def acquire(self, estimated_tokens: int = 0) -> list:
+        """Wait for a window slot and budget; returns a ticket for `release`"""
+        await self._scheduler.acquire(_admission_priority.get())
+        try:
+            while (wait := self._budget_wait(estimated_tokens, time.monotonic())) > 0:
+                self._throttle_time += wait
+                await asyncio.sleep(wait)
+        except BaseException:
+            self._scheduler.release()
+            raise
+        ticket = [time.monotonic(), estimated_tokens]
+        self._recent.append(ticket)
+        self._recent_tokens += estimated_tokens
+        return ticket
+
+    def release(self, ticket: list, used_tokens: int = None, rate_limited=False):
+        now = time.monotonic()
+        if used_tokens is not None and ticket[0] > now - 60:
+            self._recent_tokens += used_tokens - ticket[1]
+            ticket[1] = used_tokens
+        latency = now - ticket[0]
+        if rate_limited:
+            self._rate_limited += 1
+            self._decrease(now)
+        else:
+            self._completed += 1
+            self._total_latency += latency
+            if self.latency_target is not None and latency > self.latency_target:
+                self._decrease(now)
+            else:
+                self._window = min(self.max_window, self._window + 1 / self._window)
+        self._scheduler.resize(int(self._window))
+        self._scheduler.release()
+
+    def _decrease(self, now: float):
+        if now - self._last_decrease < self.decrease_interval:
+            return
+        self._last_decrease = now
+        self._window = max(self.min_window, self._window / 2)
+
+    def stats(self) -> dict:
+        self._expire(time.monotonic())
+        return {
+            "window": int(self._window),
+            "rpm_limit": self.rpm,
+            "tpm_limit": self.tpm,
+            "requests_last_minute": len(self._recent),
+            "tokens_last_minute": self._recent_tokens,
+            "throttle_time": self._throttle_time,
+            "rate_limited": self._rate_limited,
+            "completed": self._completed,
+            "avg_latency": (
+                self._total_latency / self._completed if self._completed else 0.0
+            ),
+            "admission": self._scheduler.stats(),
+        }
+
+
+def limit_async_func_call(max_size: int):
+    """Add restriction of maximum async calling times for a async func
+
+    The wrapped function exposes its `AdmissionScheduler` as ``.scheduler``.
+    """
 
     def final_decro(func):
-        """Not using async.Semaphore to aovid use nest-asyncio"""
-        __current_size = 0
+        scheduler = AdmissionScheduler(max_size)
 
         @wraps(func)
         async def wait_func(*args, **kwargs):
-            nonlocal __current_size
-            while __current_size >= max_size:
-                await asyncio.sleep(waitting_time)
-            __current_size += 1
-            result = await func(*args, **kwargs)
-            __current_size -= 1
-            return result
+            await scheduler.acquire(_admission_priority.get())
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                scheduler.release()
 
+        wait_func.scheduler = scheduler
         return wait_func
 
     return final_decro
@@ -203,16 +412,40 @@ def is_float_regex(value):
     return bool(re.match(r"^[-+]?[0-9]*\.?[0-9]+$", value))
 
 
-def truncate_list_by_token_size(list_data: list, key: callable, max_token_size: int):
-    """Truncate a list of data by token size"""
+def count_tokens(contents: list[str], model_name: str = "gpt-4o") -> list[int]:
+    """Token counts of ``contents``, encoded as one batch on tiktoken's thread pool"""
+    global ENCODER
+    if ENCODER is None:
+        ENCODER = tiktoken.encoding_for_model(model_name)
+    if not contents:
+        return []
+    return [len(tokens) for tokens in ENCODER.encode_batch(contents)]
+
+
+def truncate_list_by_token_size(
+    list_data: list,
+    key: callable,
+    max_token_size: int,
+    token_key: callable = None,
+):
+    """Truncate a list of data by token size
+
+    ``token_key`` returns a precomputed token count for an item (or None);
+    only items without one are tokenized, in a single batch.
+    """
     if max_token_size <= 0:
         return []
-    tokens = 0
-    for i, data in enumerate(list_data):
-        tokens += len(encode_string_by_tiktoken(key(data)))
-        if tokens > max_token_size:
-            return list_data[:i]
-    return list_data
+    counts = [token_key(data) for data in list_data] if token_key else None
+    if counts is None:
+        counts = count_tokens([key(data) for data in list_data])
+    else:
+        missing = [i for i, c in enumerate(counts) if c is None]
+        if missing:
+            for i, c in zip(
+                missing, count_tokens([key(list_data[i]) for i in missing])
+            ):
+                counts[i] = c
+    return list_data[: bisect_right(list(accumulate(counts)), max_token_size)]
 
 
 def list_of_list_to_csv(data: List[List[str]]) -> str:
@@ -293,43 +526,6 @@ def xml_to_json(xml_file):
         return None
 
 
-def process_combine_contexts(hl, ll):
-    header = None
-    list_hl = csv_string_to_list(hl.strip())
-    list_ll = csv_string_to_list(ll.strip())
-
-    if list_hl:
-        header = list_hl[0]
-        list_hl = list_hl[1:]
-    if list_ll:
-        header = list_ll[0]
-        list_ll = list_ll[1:]
-    if header is None:
-        return ""
-
-    if list_hl:
-        list_hl = [",".join(item[1:]) for item in list_hl if item]
-    if list_ll:
-        list_ll = [",".join(item[1:]) for item in list_ll if item]
-
-    combined_sources = []
-    seen = set()
-
-    for item in list_hl + list_ll:
-        if item and item not in seen:
-            combined_sources.append(item)
-            seen.add(item)
-
-    combined_sources_result = [",\t".join(header)]
-
-    for i, item in enumerate(combined_sources, start=1):
-        combined_sources_result.append(f"{i},\t{item}")
-
-    combined_sources_result = "\n".join(combined_sources_result)
-
-    return combined_sources_result
-
-
 async def get_best_cached_response(
     hashing_kv,
     current_embedding,
@@ -339,37 +535,16 @@ async def get_best_cached_response(
     llm_func=None,
     original_prompt=None,
 ) -> Union[str, None]:
-    # Get mode-specific cache
-    mode_cache = await hashing_kv.get_by_id(mode)
-    if not mode_cache:
+    # Only entries of this mode, scored in one pass over its quantized matrix
+    cache = response_cache(hashing_kv)
+    best_cache_id, best_similarity = await cache.best_match(mode, current_embedding)
+    if best_cache_id is None:
         return None
-
-    best_similarity = -1
-    best_response = None
-    best_prompt = None
-    best_cache_id = None
-
-    # Only iterate through cache entries for this mode
-    for cache_id, cache_data in mode_cache.items():
-        if cache_data["embedding"] is None:
-            continue
-
-        # Convert cached embedding list to ndarray
-        cached_quantized = np.frombuffer(
-            bytes.fromhex(cache_data["embedding"]), dtype=np.uint8
-        ).reshape(cache_data["embedding_shape"])
-        cached_embedding = dequantize_embedding(
-            cached_quantized,
-            cache_data["embedding_min"],
-            cache_data["embedding_max"],
-        )
-
-        similarity = cosine_similarity(current_embedding, cached_embedding)
-        if similarity > best_similarity:
-            best_similarity = similarity
-            best_response = cache_data["return"]
-            best_prompt = cache_data["original_prompt"]
-            best_cache_id = cache_id
+    cache_data = await hashing_kv.get_by_id(best_cache_id)
+    if cache_data is None:
+        return None
+    best_response = cache_data["return"]
+    best_prompt = cache_data["original_prompt"]
 
     if best_similarity > similarity_threshold:
         # If LLM check is enabled and all required parameters are provided
@@ -414,6 +589,7 @@ async def get_best_cached_response(
             "original_prompt": prompt_display,
         }
         logger.info(json.dumps(log_data, ensure_ascii=False))
+        cache.touch(best_cache_id)
         return best_response
     return None
 
@@ -447,6 +623,335 @@ def dequantize_embedding(
     return (quantized * scale + min_val).astype(np.float32)
 
 
+class SemanticCacheMatrix:
+    """Quantized query embeddings of one cache mode in a contiguous matrix.
+
+    Rows are the uint8 codes from `quantize_embedding` with a per-row scale
+    and offset, so ``row · v = scale * (codes · v) + offset * sum(v)`` and a
+    lookup is one blocked matrix-vector product. Rows are appended into spare
+    capacity and removals are tombstoned until they outnumber live rows.
+    """
+
+    block_size = 4096
+
+    def __init__(self, dim: int, capacity: int = 64):
+        self._codes = np.zeros((capacity, dim), dtype=np.uint8)
+        self._scale = np.zeros(capacity, dtype=np.float32)
+        self._offset = np.zeros(capacity, dtype=np.float32)
+        self._norm = np.ones(capacity, dtype=np.float32)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._keys: list[str] = []
+        self._rows: dict[str, int] = {}
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, key: str, codes: np.ndarray, min_val: float, max_val: float):
+        if key in self._rows:
+            self.remove(key)
+        if len(self._keys) == len(self._codes):
+            self._grow()
+        row = len(self._keys)
+        self._keys.append(key)
+        self._rows[key] = row
+        self._codes[row] = codes
+        self._scale[row] = (max_val - min_val) / 255
+        self._offset[row] = min_val
+        self._norm[row] = np.linalg.norm(
+            dequantize_embedding(codes, min_val, max_val)
+        ) or 1.0
+        self._alive[row] = True
+
+    def remove(self, key: str):
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        self._alive[row] = False
+        if len(self._keys) > 64 and len(self._rows) < len(self._keys) // 2:
+            self._compact()
+
+    def _grow(self):
+        capacity = max(64, 2 * len(self._codes))
+        for name in ("_codes", "_scale", "_offset", "_norm", "_alive"):
+            old = getattr(self, name)
+            new = np.zeros((capacity, *old.shape[1:]), dtype=old.dtype)
+            new[: len(old)] = old
+            setattr(self, name, new)
+
+    def _compact(self):
+        live = np.flatnonzero(self._alive[: len(self._keys)])
+        for name in ("_codes", "_scale", "_offset", "_norm", "_alive"):
+            old = getattr(self, name)
+            new = np.zeros_like(old)
+            new[: len(live)] = old[live]
+            setattr(self, name, new)
+        self._keys = [self._keys[r] for r in live]
+        self._rows = {k: i for i, k in enumerate(self._keys)}
+
+    def best(self, embedding: np.ndarray) -> tuple[Union[str, None], float]:
+        n = len(self._keys)
+        if not self._rows:
+            return None, -1.0
+        v = np.asarray(embedding, dtype=np.float32)
+        v_norm = np.linalg.norm(v) or 1.0
+        v_sum = v.sum()
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, self.block_size):
+            end = min(n, start + self.block_size)
+            scores[start:end] = self._codes[start:end] @ v
+        scores = (self._scale[:n] * scores + self._offset[:n] * v_sum) / (
+            self._norm[:n] * v_norm
+        )
+        scores[~self._alive[:n]] = -np.inf
+        row = int(np.argmax(scores))
+        return self._keys[row], float(scores[row])
+
+
+class ResponseCacheIndex:
+    """LRU/TTL bookkeeping for an ``llm_response_cache`` KV store.
+
+    Each response is its own ``<mode>:<args_hash>`` record, so lookups and
+    inserts touch one key. Key sizes and insert times are kept in memory in
+    LRU order; inserts evict from the cold end once ``llm_cache_max_bytes`` or
+    ``llm_cache_max_entries`` is exceeded, and records older than
+    ``llm_cache_ttl`` seconds are treated as misses and removed. Every record
+    carries its own ``size``, ``created_at`` and ``last_used``, so the index is
+    rebuilt on first use from those fields alone; `save` rewrites only the
+    records used since the last save. Records without them, including the
+    legacy one-dict-per-mode layout, are read in full and migrated.
+    """
+
+    meta_fields = {"size", "created_at", "last_used"}
+
+    def __init__(self, hashing_kv):
+        self.kv = hashing_kv
+        config = hashing_kv.global_config
+        self.max_bytes = config.get("llm_cache_max_bytes")
+        self.max_entries = config.get("llm_cache_max_entries")
+        self.ttl = config.get("llm_cache_ttl")
+        # key -> (record bytes, created_at)
+        self._entries: OrderedDict[str, tuple[int, float]] = None
+        self._bytes = 0
+        # key -> last use not yet written to its record
+        self._touched: dict[str, float] = {}
+        self._can_delete = True
+        self._semantic: dict[str, SemanticCacheMatrix] = {}
+
+    @staticmethod
+    def key(mode: str, args_hash: str) -> str:
+        return f"{mode}:{args_hash}"
+
+    async def _ensure_loaded(self):
+        if self._entries is not None:
+            return
+        self._entries, self._bytes = OrderedDict(), 0
+        all_keys = await self.kv.all_keys()
+        keys = [k for k in all_keys if ":" in k]
+        metas = await self.kv.get_by_ids(keys, fields=self.meta_fields) if keys else []
+        tracked = []
+        untracked = []
+        for k, meta in zip(keys, metas):
+            if meta is None:
+                continue
+            if "size" in meta and "created_at" in meta:
+                tracked.append((k, meta))
+            else:
+                untracked.append(k)
+        records = await self.kv.get_by_ids(untracked) if untracked else []
+        for k, record in zip(untracked, records):
+            if record is None:
+                continue
+            created_at = record.get("created_at", 0.0)
+            meta = {
+                "size": self._size(record),
+                "created_at": created_at,
+                "last_used": record.get("last_used", created_at),
+            }
+            tracked.append((k, meta))
+            # the next save writes the missing fields into the record
+            self._touched[k] = meta["last_used"]
+        for k, meta in sorted(
+            tracked, key=lambda x: x[1].get("last_used", x[1]["created_at"])
+        ):
+            self._entries[k] = (meta["size"], meta["created_at"])
+            self._bytes += meta["size"]
+        await self._migrate_legacy([k for k in all_keys if ":" not in k])
+
+    async def _migrate_legacy(self, legacy_keys: list[str]):
+        if not legacy_keys:
+            return
+        legacy = dict(zip(legacy_keys, await self.kv.get_by_ids(legacy_keys)))
+        logger.info(f"Migrating LLM cache modes {legacy_keys} to per-entry records")
+        await self._delete(legacy_keys)
+        for mode, mode_cache in legacy.items():
+            for args_hash, record in (mode_cache or {}).items():
+                if isinstance(record, dict):
+                    await self.put(mode, args_hash, record)
+
+    @staticmethod
+    def _size(record: dict) -> int:
+        return len(json.dumps(record, ensure_ascii=False, default=str))
+
+    def touch(self, key: str):
+        """Mark ``key`` as most recently used"""
+        if self._entries is not None and key in self._entries:
+            self._entries.move_to_end(key)
+            self._touched[key] = time.time()
+
+    async def save(self):
+        """Write the use times of records used since the last save into them;
+        call before flushing the KV store"""
+        touched = {k: t for k, t in self._touched.items() if k in self._entries}
+        self._touched = {}
+        if not touched or not self._can_delete:
+            return
+        keys = list(touched)
+        records = await self.kv.get_by_ids(keys)
+        updated = {
+            k: {
+                **record,
+                "size": self._entries[k][0],
+                "created_at": self._entries[k][1],
+                "last_used": touched[k],
+            }
+            for k, record in zip(keys, records)
+            if record is not None
+        }
+        # upsert only inserts new keys
+        await self._delete(list(updated))
+        await self.kv.upsert(updated)
+
+    async def _delete(self, keys: list[str]):
+        if not self._can_delete:
+            return
+        try:
+            await self.kv.delete(keys)
+        except NotImplementedError:
+            logger.warning(
+                f"{type(self.kv).__name__} cannot delete records, "
+                f"{self.kv.namespace} entries are no longer evicted"
+            )
+            self._can_delete = False
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    async def _remove(self, keys: list[str]):
+        for k in keys:
+            self._bytes -= self._entries.pop(k)[0]
+            matrix = self._semantic.get(k.split(":", 1)[0])
+            if matrix is not None:
+                matrix.remove(k)
+        await self._delete(keys)
+
+    def _add_semantic(self, matrix: SemanticCacheMatrix, key: str, record: dict):
+        if record.get("embedding") is None:
+            return
+        codes = np.frombuffer(bytes.fromhex(record["embedding"]), dtype=np.uint8)
+        matrix.add(key, codes, record["embedding_min"], record["embedding_max"])
+
+    async def best_match(
+        self, mode: str, embedding: np.ndarray
+    ) -> tuple[Union[str, None], float]:
+        """Key and cosine similarity of the closest cached query of ``mode``"""
+        await self._ensure_loaded()
+        matrix = self._semantic.get(mode)
+        if matrix is None:
+            # decode the mode's stored embeddings once, then keep it current
+            matrix = self._semantic[mode] = SemanticCacheMatrix(len(embedding))
+            for key, record in await self.records(mode):
+                self._add_semantic(matrix, key, record)
+        else:
+            await self._expire_mode(mode)
+        return matrix.best(embedding)
+
+    async def get(self, mode: str, args_hash: str) -> Union[dict, None]:
+        await self._ensure_loaded()
+        key = self.key(mode, args_hash)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry[1]):
+            await self._remove([key])
+            return None
+        self.touch(key)
+        return await self.kv.get_by_id(key)
+
+    async def records(self, mode: str) -> list[tuple[str, dict]]:
+        """All live records of ``mode``, for similarity lookups"""
+        await self._ensure_loaded()
+        await self._expire_mode(mode)
+        prefix = f"{mode}:"
+        keys = [k for k in self._entries if k.startswith(prefix)]
+        return list(zip(keys, await self.kv.get_by_ids(keys))) if keys else []
+
+    async def _expire_mode(self, mode: str):
+        if self.ttl is None:
+            return
+        prefix = f"{mode}:"
+        expired = [
+            k
+            for k, (_, created_at) in self._entries.items()
+            if k.startswith(prefix) and self._expired(created_at)
+        ]
+        if expired:
+            await self._remove(expired)
+
+    async def drop_mode(self, mode: str):
+        """Remove every record of ``mode``"""
+        await self._ensure_loaded()
+        prefix = f"{mode}:"
+        keys = [k for k in self._entries if k.startswith(prefix)]
+        if keys:
+            await self._remove(keys)
+
+    async def put(self, mode: str, args_hash: str, record: dict):
+        await self._ensure_loaded()
+        key = self.key(mode, args_hash)
+        record.setdefault("created_at", time.time())
+        record["last_used"] = time.time()
+        record["size"] = self._size(record)
+        if key in self._entries:
+            await self._remove([key])
+        await self.kv.upsert({key: record})
+        self._entries[key] = (record["size"], record["created_at"])
+        self._bytes += record["size"]
+        self._touched.pop(key, None)
+        if mode in self._semantic:
+            self._add_semantic(self._semantic[mode], key, record)
+        evict = []
+        count, total = len(self._entries), self._bytes
+        for k, (size, _) in self._entries.items():
+            if (self.max_bytes is None or total <= self.max_bytes) and (
+                self.max_entries is None or count <= self.max_entries
+            ):
+                break
+            if k == key:
+                break
+            evict.append(k)
+            count -= 1
+            total -= size
+        if evict and self._can_delete:
+            await self._remove(evict)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries or ()),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+        }
+
+
+def response_cache(hashing_kv) -> ResponseCacheIndex:
+    """The `ResponseCacheIndex` of ``hashing_kv``, created on first use"""
+    index = getattr(hashing_kv, "_response_cache_index", None)
+    if index is None:
+        index = hashing_kv._response_cache_index = ResponseCacheIndex(hashing_kv)
+    return index
+
+
 async def handle_cache(hashing_kv, args_hash, prompt, mode="default"):
     """Generic cache handling function"""
     if hashing_kv is None:
@@ -454,9 +959,9 @@ async def handle_cache(hashing_kv, args_hash, prompt, mode="default"):
 
     # For naive mode, only use simple cache matching
     if mode == "naive":
-        mode_cache = await hashing_kv.get_by_id(mode) or {}
-        if args_hash in mode_cache:
-            return mode_cache[args_hash]["return"], None, None, None
+        cached = await response_cache(hashing_kv).get(mode, args_hash)
+        if cached is not None:
+            return cached["return"], None, None, None
         return None, None, None, None
 
     # Get embedding cache configuration
@@ -488,9 +993,9 @@ async def handle_cache(hashing_kv, args_hash, prompt, mode="default"):
             return best_cached_response, None, None, None
     else:
         # Use regular cache
-        mode_cache = await hashing_kv.get_by_id(mode) or {}
-        if args_hash in mode_cache:
-            return mode_cache[args_hash]["return"], None, None, None
+        cached = await response_cache(hashing_kv).get(mode, args_hash)
+        if cached is not None:
+            return cached["return"], None, None, None
 
     return None, quantized, min_val, max_val
 
@@ -510,22 +1015,22 @@ async def save_to_cache(hashing_kv, cache_data: CacheData):
     if hashing_kv is None or hasattr(cache_data.content, "__aiter__"):
         return
 
-    mode_cache = await hashing_kv.get_by_id(cache_data.mode) or {}
-
-    mode_cache[cache_data.args_hash] = {
-        "return": cache_data.content,
-        "embedding": cache_data.quantized.tobytes().hex()
-        if cache_data.quantized is not None
-        else None,
-        "embedding_shape": cache_data.quantized.shape
-        if cache_data.quantized is not None
-        else None,
-        "embedding_min": cache_data.min_val,
-        "embedding_max": cache_data.max_val,
-        "original_prompt": cache_data.prompt,
-    }
-
-    await hashing_kv.upsert({cache_data.mode: mode_cache})
+    await response_cache(hashing_kv).put(
+        cache_data.mode,
+        cache_data.args_hash,
+        {
+            "return": cache_data.content,
+            "embedding": cache_data.quantized.tobytes().hex()
+            if cache_data.quantized is not None
+            else None,
+            "embedding_shape": cache_data.quantized.shape
+            if cache_data.quantized is not None
+            else None,
+            "embedding_min": cache_data.min_val,
+            "embedding_max": cache_data.max_val,
+            "original_prompt": cache_data.prompt,
+        },
+    )
 
 
 def safe_unicode_decode(content):
@@ -39,7 +39,10 @@ def test_graph_api():
         
         # Check if data exists
         import os
-        if not os.path.exists("expr/example/graph_chunk_entity_relation.graphml"):
+        if not any(
+            os.path.exists(f"expr/example/graph_chunk_entity_relation.{ext}")
+            for ext in ("npz", "graphml")
+        ):
             print("   ⚠️  Warning: No data found in expr/example/")
             print("   Skipping endpoint tests (run script_construct.py first)")
             print()
@@ -33,7 +33,10 @@ def test_query_api():
         
         # Check if data exists
         import os
-        if not os.path.exists("expr/example/graph_chunk_entity_relation.graphml"):
+        if not any(
+            os.path.exists(f"expr/example/graph_chunk_entity_relation.{ext}")
+            for ext in ("npz", "graphml")
+        ):
             print("   ⚠️  Warning: No data found in expr/example/")
             print("   Skipping query tests (run script_construct.py first)")
             print()
@@ -0,0 +1,108 @@
+"""
+Shared fixtures for the HyperGraphRAG unit tests
+
+Provides an offline tokenizer and a HyperGraphRAG instance wired to a
+deterministic fake LLM and embedding function.
+"""
+
+import re
+import types
+
+import numpy as np
+import pytest
+
+from hypergraphrag import utils
+from hypergraphrag.utils import EmbeddingFunc
+
+EMBEDDING_DIM = 8
+
+TUPLE = "<|>"
+RECORD = "##"
+COMPLETE = "<|COMPLETE|>"
+
+
+class CharEncoder:
+    """One token per character, so token counts are predictable"""
+
+    def encode(self, text: str) -> list[int]:
+        return [ord(c) for c in text]
+
+    def decode(self, tokens: list[int]) -> str:
+        return "".join(chr(t) for t in tokens)
+
+    def encode_batch(self, texts: list[str]) -> list[list[int]]:
+        return [self.encode(t) for t in texts]
+
+
+@pytest.fixture
+def char_encoder(monkeypatch):
+    """Replace the tiktoken encoder, which needs network access to load"""
+    monkeypatch.setattr(utils, "ENCODER", CharEncoder())
+
+
+def extraction_output(text: str) -> str:
+    """Extraction records for a document written as ``"<fact>: NAME NAME ..."``
+
+    The fact becomes a hyper-relation and every upper-case word an entity.
+    """
+    fact, _, names = text.partition(":")
+    records = [f'("hyper-relation"{TUPLE}{fact.strip()}{TUPLE}5)']
+    for name in names.split():
+        records.append(
+            f'("entity"{TUPLE}{name}{TUPLE}person{TUPLE}{name} in {fact.strip()}'
+            f"{TUPLE}80)"
+        )
+    return RECORD.join(records) + COMPLETE
+
+
+class FakeLLM:
+    """Answers extraction prompts from the document text, records every call"""
+
+    def __init__(self):
+        self.prompts = []
+
+    def __deepcopy__(self, memo):
+        # asdict() copies the config; every copy should record to this one
+        return self
+
+    async def __call__(self, prompt, system_prompt=None, history_messages=[], **kwargs):
+        self.prompts.append(prompt)
+        document = re.search(r"<<(.*?)>>", prompt, re.S)
+        if document is not None:
+            return extraction_output(document.group(1))
+        return "answer"
+
+
+async def fake_embed(texts: list[str]) -> np.ndarray:
+    """Bag of characters embedding, so equal texts get equal vectors"""
+    vectors = np.zeros((len(texts), EMBEDDING_DIM))
+    for row, text in enumerate(texts):
+        for c in text:
+            vectors[row, ord(c) % EMBEDDING_DIM] += 1.0
+    return vectors
+
+
+@pytest.fixture
+def make_rag(tmp_path, monkeypatch, char_encoder):
+    """Build HyperGraphRAG instances on ``tmp_path`` with the fake models"""
+    from hypergraphrag import HyperGraphRAG
+
+    # the logger writes hypergraphrag.log to the working directory
+    monkeypatch.chdir(tmp_path)
+
+    def make(**kwargs):
+        llm = kwargs.pop("llm_model_func", None) or FakeLLM()
+        config = dict(
+            working_dir=str(tmp_path / "rag"),
+            llm_model_func=llm,
+            embedding_func=EmbeddingFunc(
+                embedding_dim=EMBEDDING_DIM, max_token_size=8192, func=fake_embed
+            ),
+            chunking_executor="none",
+            entity_extract_max_gleaning=0,
+        )
+        config.update(kwargs)
+        rag = HyperGraphRAG(**config)
+        return types.SimpleNamespace(rag=rag, llm=llm)
+
+    return make
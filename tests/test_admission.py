@@ -0,0 +1,210 @@
+"""
+Unit tests for the admission scheduler
+
+Tests that AdmissionScheduler caps in-flight calls, admits query calls before
+bulk calls and in FIFO order within a class, and cleans up after cancelled
+waiters, plus the limit_async_func_call wrapper built on it.
+"""
+
+import asyncio
+
+import pytest
+
+from hypergraphrag.utils import (
+    PRIORITY_BULK,
+    PRIORITY_QUERY,
+    AdmissionScheduler,
+    admission_priority,
+    limit_async_func_call,
+)
+
+# Mark all tests in this module as unit tests
+pytestmark = pytest.mark.unit
+
+
+async def settle():
+    """Let every runnable task reach its next await"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def queue_waiters(scheduler, names_and_priorities, admitted):
+    async def wait(name, priority):
+        await scheduler.acquire(priority)
+        admitted.append(name)
+
+    tasks = []
+    for name, priority in names_and_priorities:
+        tasks.append(asyncio.create_task(wait(name, priority)))
+        await settle()
+    return tasks
+
+
+class TestAdmissionScheduler:
+    """Tests for AdmissionScheduler"""
+
+    def test_priority_then_fifo(self):
+        """Query waiters go first, each class in arrival order"""
+
+        async def run():
+            scheduler = AdmissionScheduler(1)
+            await scheduler.acquire()
+            admitted = []
+            tasks = await queue_waiters(
+                scheduler,
+                [
+                    ("bulk-1", PRIORITY_BULK),
+                    ("query-1", PRIORITY_QUERY),
+                    ("bulk-2", PRIORITY_BULK),
+                    ("query-2", PRIORITY_QUERY),
+                ],
+                admitted,
+            )
+            assert scheduler.stats()["queue_depth"] == {
+                PRIORITY_QUERY: 2,
+                PRIORITY_BULK: 2,
+            }
+            for _ in range(4):
+                scheduler.release()
+                await settle()
+            await asyncio.gather(*tasks)
+            assert admitted == ["query-1", "query-2", "bulk-1", "bulk-2"]
+
+        asyncio.run(run())
+
+    def test_release_hands_over_the_slot(self):
+        """A released slot goes to the next waiter, not to a newcomer"""
+
+        async def run():
+            scheduler = AdmissionScheduler(1)
+            await scheduler.acquire()
+            admitted = []
+            tasks = await queue_waiters(
+                scheduler, [("waiter", PRIORITY_BULK)], admitted
+            )
+            scheduler.release()
+            newcomer = asyncio.create_task(scheduler.acquire())
+            await settle()
+
+            assert admitted == ["waiter"]
+            assert not newcomer.done()
+            assert scheduler.stats()["in_flight"] == 1
+            scheduler.release()
+            await newcomer
+            await asyncio.gather(*tasks)
+
+        asyncio.run(run())
+
+    def test_resize_admits_waiters(self):
+        """Growing the cap admits queued waiters at once"""
+
+        async def run():
+            scheduler = AdmissionScheduler(1)
+            await scheduler.acquire()
+            admitted = []
+            tasks = await queue_waiters(
+                scheduler, [("a", PRIORITY_BULK), ("b", PRIORITY_BULK)], admitted
+            )
+            scheduler.resize(3)
+            await settle()
+            await asyncio.gather(*tasks)
+
+            assert admitted == ["a", "b"]
+            assert scheduler.stats()["in_flight"] == 3
+
+        asyncio.run(run())
+
+    def test_cancelled_waiter_leaves_the_queue(self):
+        """A cancelled waiter neither holds a slot nor blocks the next one"""
+
+        async def run():
+            scheduler = AdmissionScheduler(1)
+            await scheduler.acquire()
+            admitted = []
+            cancelled, kept = await queue_waiters(
+                scheduler, [("a", PRIORITY_BULK), ("b", PRIORITY_BULK)], admitted
+            )
+            cancelled.cancel()
+            await settle()
+            assert scheduler.stats()["queue_depth"] == {PRIORITY_BULK: 1}
+
+            scheduler.release()
+            await kept
+            assert admitted == ["b"]
+            assert scheduler.stats()["in_flight"] == 1
+
+        asyncio.run(run())
+
+    def test_cancelled_after_admission_releases(self):
+        """A waiter cancelled right after being admitted gives its slot back"""
+
+        async def run():
+            scheduler = AdmissionScheduler(1)
+            await scheduler.acquire()
+            waiter = asyncio.create_task(scheduler.acquire())
+            await settle()
+            # admit and cancel before the waiter gets to run
+            scheduler.release()
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+            assert scheduler.stats()["in_flight"] == 0
+
+        asyncio.run(run())
+
+
+class TestLimitAsyncFuncCall:
+    """Tests for limit_async_func_call"""
+
+    def test_caps_concurrency(self):
+        """No more than max_size calls run at once and all of them finish"""
+        running = 0
+        peak = 0
+
+        @limit_async_func_call(2)
+        async def call(i):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.001)
+            running -= 1
+            return i
+
+        async def run():
+            return await asyncio.gather(*[call(i) for i in range(10)])
+
+        assert asyncio.run(run()) == list(range(10))
+        assert peak == 2
+        stats = call.scheduler.stats()
+        assert stats["admitted"] == 10
+        assert stats["in_flight"] == 0
+
+    def test_admission_priority_context(self):
+        """Calls made under admission_priority(PRIORITY_QUERY) skip the bulk queue"""
+        order = []
+        gate = None
+
+        @limit_async_func_call(1)
+        async def call(name):
+            order.append(name)
+            if name == "first":
+                await gate.wait()
+
+        async def query():
+            with admission_priority(PRIORITY_QUERY):
+                await call("query")
+
+        async def run():
+            nonlocal gate
+            gate = asyncio.Event()
+            tasks = [asyncio.create_task(call("first"))]
+            await settle()
+            tasks.append(asyncio.create_task(call("bulk")))
+            await settle()
+            tasks.append(asyncio.create_task(query()))
+            await settle()
+            gate.set()
+            await asyncio.gather(*tasks)
+
+        asyncio.run(run())
+        assert order == ["first", "query", "bulk"]
@@ -0,0 +1,145 @@
+"""
+Unit tests for the content-addressed embedding cache
+
+Tests that EmbeddingVectorCache only sends misses to the provider, keeps one
+file per model, survives reopening and compacts to its byte cap.
+"""
+
+import asyncio
+import os
+from functools import partial
+
+import numpy as np
+import pytest
+
+from hypergraphrag.storage import EmbeddingVectorCache
+from hypergraphrag.utils import EmbeddingFunc
+
+# Mark all tests in this module as unit tests
+pytestmark = pytest.mark.unit
+
+DIM = 4
+
+
+class CountingEmbedder:
+    """Embeds each text from its length, records the batches it is sent"""
+
+    def __init__(self, offset: float = 0.0):
+        self.offset = offset
+        self.calls = []
+
+    async def __call__(self, texts: list[str]) -> np.ndarray:
+        self.calls.append(list(texts))
+        return np.array([[len(t) + self.offset] * DIM for t in texts])
+
+    def func(self) -> EmbeddingFunc:
+        return EmbeddingFunc(embedding_dim=DIM, max_token_size=8192, func=self)
+
+
+def embed(cache_dir, embedder, texts, model="model-a", **kwargs):
+    cache = EmbeddingVectorCache(str(cache_dir), model, DIM, **kwargs)
+    return asyncio.run(cache.wrap(embedder.func())(texts)), cache
+
+
+async def openai_like_embedding(texts: list[str], model: str = "text-embedding-3"):
+    return np.zeros((len(texts), DIM))
+
+
+class TestEmbeddingVectorCache:
+    """Tests for EmbeddingVectorCache"""
+
+    def test_only_misses_reach_the_provider(self, tmp_path):
+        """Cached texts are spliced back in order, duplicates embedded once"""
+        embedder = CountingEmbedder()
+        first, _ = embed(tmp_path, embedder, ["a", "bb", "a"])
+        assert embedder.calls == [["a", "bb"]]
+        assert first[:, 0].tolist() == [1, 2, 1]
+        assert first.dtype == np.float32
+
+        second, _ = embed(tmp_path, embedder, ["ccc", "bb", "a"])
+        assert embedder.calls[1:] == [["ccc"]]
+        assert second[:, 0].tolist() == [3, 2, 1]
+
+        embed(tmp_path, embedder, ["a", "ccc"])
+        assert len(embedder.calls) == 2
+
+    def test_empty_input(self, tmp_path):
+        """An empty batch returns an empty matrix without calling the provider"""
+        embedder = CountingEmbedder()
+        result, _ = embed(tmp_path, embedder, [])
+        assert result.shape == (0, DIM)
+        assert embedder.calls == []
+
+    def test_models_do_not_share_vectors(self, tmp_path):
+        """Each model gets its own file, so a text is embedded once per model"""
+        model_a, model_b = CountingEmbedder(), CountingEmbedder(offset=100)
+        embed(tmp_path, model_a, ["a"], model="model-a")
+        result, _ = embed(tmp_path, model_b, ["a"], model="org/model-b")
+
+        assert model_b.calls == [["a"]]
+        assert result[0, 0] == 101
+        assert sorted(os.listdir(tmp_path)) == [
+            f"embedding_cache_model-a_{DIM}.bin",
+            f"embedding_cache_org_model-b_{DIM}.bin",
+        ]
+
+    def test_model_id(self):
+        """The cache key comes from the model keyword or the parameter default"""
+        assert (
+            EmbeddingVectorCache.model_id(openai_like_embedding)
+            == "openai_like_embedding_text-embedding-3"
+        )
+        bound = partial(partial(openai_like_embedding, model="large"), texts=[])
+        assert EmbeddingVectorCache.model_id(bound) == "openai_like_embedding_large"
+        wrapped = EmbeddingFunc(embedding_dim=DIM, max_token_size=8192, func=bound)
+        assert EmbeddingVectorCache.model_id(wrapped) == "openai_like_embedding_large"
+        assert EmbeddingVectorCache.model_id(CountingEmbedder()) is None
+
+    def test_torn_tail_is_dropped(self, tmp_path):
+        """An incomplete record from an interrupted append is truncated"""
+        embedder = CountingEmbedder()
+        _, cache = embed(tmp_path, embedder, ["a", "bb"])
+        with open(cache._file_name, "ab") as f:
+            f.write(b"\x00" * 7)
+
+        result, cache = embed(tmp_path, embedder, ["a", "bb"])
+        assert len(embedder.calls) == 1
+        assert len(cache) == 2
+        assert result[:, 0].tolist() == [1, 2]
+
+    def test_compaction_keeps_used_vectors(self, tmp_path):
+        """Past max_bytes the file is halved, keeping vectors used since opening"""
+        record_size = 16 + 4 * DIM
+        embedder = CountingEmbedder()
+        embed(tmp_path, embedder, [f"old-{i}" for i in range(6)])
+
+        cache = EmbeddingVectorCache(
+            str(tmp_path), "model-a", DIM, max_bytes=8 * record_size
+        )
+        func = cache.wrap(embedder.func())
+        asyncio.run(func(["old-0"]))
+        asyncio.run(func(["new-0", "new-1", "new-2"]))
+
+        assert len(cache) == 4
+        assert os.path.getsize(cache._file_name) == 4 * record_size
+        calls = len(embedder.calls)
+        asyncio.run(func(["old-0", "new-2", "new-1", "new-0"]))
+        assert len(embedder.calls) == calls
+
+
+class TestHyperGraphRAGEmbeddingCache:
+    """Tests for how HyperGraphRAG wires in the cache"""
+
+    def test_enabled_with_a_key(self, make_rag, tmp_path):
+        """With a cache key, the storages embed through the cache"""
+        rag = make_rag(embedding_vector_cache_key="fake").rag
+        rag.insert("<<met: ALICE BOB>>")
+        files = os.listdir(tmp_path / "rag")
+        assert any(name.startswith("embedding_cache_fake_") for name in files)
+
+    def test_disabled_without_a_model(self, make_rag, tmp_path):
+        """Without a key or a detectable model there is no cache file"""
+        rag = make_rag().rag
+        rag.insert("<<met: ALICE BOB>>")
+        files = os.listdir(tmp_path / "rag")
+        assert not any(name.startswith("embedding_cache_") for name in files)
@@ -0,0 +1,210 @@
+"""
+Unit tests for the incremental entity summaries
+
+Tests that the summary state is kept on the node, that nodes without it fall
+back to summarizing their whole description, and the batched summary requests.
+"""
+
+import asyncio
+import json
+import re
+
+import pytest
+
+from hypergraphrag.operate import (
+    _entity_node_data,
+    _merge_nodes,
+    _summarize_entities,
+)
+from hypergraphrag.prompt import GRAPH_FIELD_SEP
+
+# Mark all tests in this module as unit tests
+pytestmark = pytest.mark.unit
+
+
+class SummaryLLM:
+    """Answers every summary request with a fixed text, records the prompts"""
+
+    def __init__(self, answer="SUMMARY"):
+        self.answer = answer
+        self.prompts = []
+
+    async def __call__(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return self.answer
+
+
+@pytest.fixture
+def global_config(char_encoder):
+    return {
+        "llm_model_func": SummaryLLM(),
+        "llm_model_max_token_size": 32768,
+        "tiktoken_model_name": "gpt-4o-mini",
+        "entity_summary_to_max_tokens": 40,
+        "entity_summary_refresh_tokens": 20,
+        "entity_summary_batch_size": 1,
+        "entity_summary_batch_max_tokens": 8000,
+        "addon_params": {},
+    }
+
+
+def records(*descriptions, entity_type="person"):
+    return [
+        {"entity_type": entity_type, "description": d, "source_id": "chunk-1"}
+        for d in descriptions
+    ]
+
+
+def merge(global_config, already, *descriptions):
+    state = _merge_nodes('"ALICE"', records(*descriptions), already, global_config)
+    asyncio.run(_summarize_entities([state], global_config))
+    return _entity_node_data(state, global_config)
+
+
+class TestSummaryState:
+    """Tests for the summary state stored on entity nodes"""
+
+    def test_summary_then_pending(self, global_config):
+        """A summarized node only gets a new summary once enough new text piles
+        up; until then new fragments follow the summary"""
+        llm = global_config["llm_model_func"]
+        node = merge(global_config, None, "a" * 30, "b" * 30)
+        assert node["summary"] == "SUMMARY"
+        assert node["description"] == "SUMMARY"
+        assert node["pending_description"] == ""
+        assert node["pending_tokens"] == 0
+        assert len(llm.prompts) == 1
+
+        node = merge(global_config, node, "c" * 10)
+        assert node["summary"] == "SUMMARY"
+        assert node["description"] == GRAPH_FIELD_SEP.join(["SUMMARY", "c" * 10])
+        assert node["pending_tokens"] == 10
+        assert len(llm.prompts) == 1
+
+        node = merge(global_config, node, "d" * 10)
+        assert node["description"] == "SUMMARY"
+        assert len(llm.prompts) == 2
+        # the refresh folds the pending text into the previous summary
+        assert "SUMMARY" in llm.prompts[-1] and "c" * 10 in llm.prompts[-1]
+
+    @pytest.mark.parametrize(
+        "kept", [(), ("summary",), ("summary", "pending_description")]
+    )
+    def test_backend_without_summary_state(self, global_config, kept):
+        """Nodes missing any summary field, as read back from Oracle, treat
+        their whole description as pending"""
+        llm = global_config["llm_model_func"]
+        stored = merge(global_config, None, "a" * 10, "b" * 10)
+        assert len(llm.prompts) == 0
+        dropped = {"summary", "pending_description", "pending_tokens"} - set(kept)
+        stripped = {k: v for k, v in stored.items() if k not in dropped}
+
+        state = _merge_nodes('"ALICE"', records("c" * 10), stripped, global_config)
+        assert state["summary"] == ""
+        assert state["pending"] == ["a" * 10, "b" * 10, "c" * 10]
+        assert state["pending_tokens"] == 30
+        assert not state["needs_summary"]
+
+        state = _merge_nodes(
+            '"ALICE"', records("c" * 10, "d" * 10), stripped, global_config
+        )
+        assert state["needs_summary"]
+
+
+class BatchLLM:
+    """Answers batched summary prompts with JSON, single ones with plain text"""
+
+    def __init__(self, malformed=False, skip=()):
+        self.malformed = malformed
+        self.skip = skip
+        self.batches = []
+        self.singles = []
+
+    async def __call__(self, prompt, **kwargs):
+        items = re.findall(r"\[(\d+)\] Entities: (\S+)", prompt)
+        if items:
+            self.batches.append([name for _, name in items])
+            if self.malformed:
+                return "Here are the summaries you asked for."
+            return json.dumps(
+                {i: f"batched {name}" for i, name in items if name not in self.skip}
+            )
+        name = re.search(r"Entities: (\S+)", prompt).group(1)
+        self.singles.append(name)
+        return f"single {name}"
+
+
+def summary_states(global_config, names, tokens=50):
+    return [
+        _merge_nodes(name, records("x" * tokens), None, global_config)
+        for name in names
+    ]
+
+
+class TestBatchedSummaries:
+    """Tests for summarizing several entities per LLM call"""
+
+    NAMES = ["ALICE", "BOB", "CAROL"]
+
+    def summarize(self, global_config, llm, states, **config):
+        global_config.update(llm_model_func=llm, **config)
+        asyncio.run(_summarize_entities(states, global_config))
+        return [state["summary"] for state in states]
+
+    def test_one_call_for_several_entities(self, global_config):
+        """Entities needing a summary share one request and get their own result"""
+        llm = BatchLLM()
+        states = summary_states(global_config, self.NAMES)
+        states.append(_merge_nodes("DAVE", records("short"), None, global_config))
+        summaries = self.summarize(
+            global_config, llm, states, entity_summary_batch_size=8
+        )
+
+        assert llm.batches == [self.NAMES]
+        assert llm.singles == []
+        assert summaries == ["batched ALICE", "batched BOB", "batched CAROL", ""]
+        assert all(not state["needs_summary"] for state in states)
+
+    def test_batches_respect_size_and_token_budget(self, global_config):
+        """Batches hold at most entity_summary_batch_size entities and
+        entity_summary_batch_max_tokens tokens; a batch of one is a plain call"""
+        llm = BatchLLM()
+        states = summary_states(global_config, self.NAMES)
+        self.summarize(global_config, llm, states, entity_summary_batch_size=2)
+        assert llm.batches == [["ALICE", "BOB"]]
+        assert llm.singles == ["CAROL"]
+
+        llm = BatchLLM()
+        states = summary_states(global_config, self.NAMES)
+        self.summarize(
+            global_config,
+            llm,
+            states,
+            entity_summary_batch_size=8,
+            entity_summary_batch_max_tokens=60,
+        )
+        assert llm.batches == []
+        assert sorted(llm.singles) == self.NAMES
+
+    def test_unparseable_reply_falls_back(self, global_config):
+        """A reply that is not JSON sends every entity of the batch on its own"""
+        llm = BatchLLM(malformed=True)
+        states = summary_states(global_config, self.NAMES)
+        summaries = self.summarize(
+            global_config, llm, states, entity_summary_batch_size=8
+        )
+
+        assert len(llm.batches) == 1
+        assert sorted(llm.singles) == self.NAMES
+        assert summaries == ["single ALICE", "single BOB", "single CAROL"]
+
+    def test_missing_item_falls_back(self, global_config):
+        """Only the entities missing from the reply get a call of their own"""
+        llm = BatchLLM(skip=("BOB",))
+        states = summary_states(global_config, self.NAMES)
+        summaries = self.summarize(
+            global_config, llm, states, entity_summary_batch_size=8
+        )
+
+        assert llm.singles == ["BOB"]
+        assert summaries == ["batched ALICE", "single BOB", "batched CAROL"]
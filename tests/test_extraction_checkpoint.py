@@ -0,0 +1,101 @@
+"""
+Unit tests for the per-chunk extraction checkpoint
+
+Tests that an interrupted insert resumes from the checkpointed chunks and that
+checkpoint records are matched to chunks by key.
+"""
+
+import asyncio
+
+import pytest
+
+from hypergraphrag.storage import JsonKVStorage
+from tests.conftest import FakeLLM
+
+# Mark all tests in this module as unit tests
+pytestmark = pytest.mark.unit
+
+DOCS = [
+    "<<met at the lab: ALICE BOB>>",
+    "<<wrote a paper: CAROL DAVE>>",
+    "<<gave a talk: ERIN>>",
+]
+
+
+class FailingLLM(FakeLLM):
+    """Fails on prompts containing ``fail_on`` after the others have finished"""
+
+    def __init__(self, fail_on: str):
+        super().__init__()
+        self.fail_on = fail_on
+
+    async def __call__(self, prompt, **kwargs):
+        if self.fail_on in prompt:
+            await asyncio.sleep(0.05)
+            raise RuntimeError("provider went away")
+        return await super().__call__(prompt, **kwargs)
+
+
+def extraction_calls(llm: FakeLLM) -> list[str]:
+    return [doc for p in llm.prompts for doc in DOCS if doc in p]
+
+
+class TestExtractionCheckpoint:
+    """Tests for resuming extraction from the checkpoint"""
+
+    def test_resume_after_failure(self, make_rag):
+        """Only chunks without a checkpoint are sent to the LLM again"""
+
+        async def run():
+            first = make_rag(
+                llm_model_func=FailingLLM("ERIN"), extraction_checkpoint_interval=1
+            )
+            with pytest.raises(RuntimeError):
+                await first.rag.ainsert(DOCS)
+            assert await first.rag.full_docs.all_keys() == []
+
+            second = make_rag(extraction_checkpoint_interval=1)
+            await second.rag.ainsert(DOCS)
+            assert extraction_calls(second.llm) == [DOCS[2]]
+
+            graph = second.rag.chunk_entity_relation_graph
+            for name in ["ALICE", "BOB", "CAROL", "DAVE", "ERIN"]:
+                assert await graph.has_node(name)
+            assert await second.rag.extraction_checkpoint.all_keys() == []
+
+        asyncio.run(run())
+
+    def test_records_are_matched_by_key(self, make_rag):
+        """A backend returning only the found records, in any order, still
+        resumes each chunk with its own result"""
+
+        async def run():
+            first = make_rag(
+                llm_model_func=FailingLLM("ERIN"), extraction_checkpoint_interval=1
+            )
+            with pytest.raises(RuntimeError):
+                await first.rag.ainsert(DOCS)
+
+            second = make_rag()
+            checkpoint = second.rag.extraction_checkpoint
+            get_by_ids = checkpoint.get_by_ids
+
+            async def found_only(ids, fields=None):
+                return [dp for dp in await get_by_ids(ids, fields) if dp][::-1]
+
+            checkpoint.get_by_ids = found_only
+            await second.rag.ainsert(DOCS)
+
+            graph = second.rag.chunk_entity_relation_graph
+            edges = await graph.get_node_edges("CAROL")
+            assert [tgt for _, tgt in edges] == ["<hyperedge>wrote a paper"]
+
+        asyncio.run(run())
+
+    def test_disabled_on_fixed_schema_backends(self, make_rag, monkeypatch):
+        """KV backends without a table for the checkpoint turn it off"""
+        monkeypatch.setattr(
+            JsonKVStorage, "supported_namespaces", ("full_docs", "text_chunks")
+        )
+        rag = make_rag().rag
+        assert rag.extraction_checkpoint is None
@@ -0,0 +1,112 @@
+"""
+Unit tests for the batched graph merge phase
+
+Tests that inserting reads every stored record once, writes through the bulk
+graph upserts in graph_upsert_batch_size batches, and merges with what was
+already stored.
+"""
+
+import asyncio
+from collections import defaultdict
+from dataclasses import dataclass
+
+import pytest
+
+from hypergraphrag.base import BaseGraphStorage
+
+# Mark all tests in this module as unit tests
+pytestmark = pytest.mark.unit
+
+GRAPH_METHODS = [
+    "get_node",
+    "get_edge",
+    "get_nodes_batch",
+    "get_edges_batch",
+    "upsert_node",
+    "upsert_edge",
+    "upsert_nodes",
+    "upsert_edges",
+]
+
+
+def record_calls(graph) -> dict:
+    """Record the argument sizes of every graph read and write"""
+    calls = defaultdict(list)
+    for name in GRAPH_METHODS:
+        method = getattr(graph, name)
+
+        async def recorded(*args, _name=name, _method=method):
+            calls[_name].append(len(args[0]) if len(args) == 1 else 1)
+            return await _method(*args)
+
+        setattr(graph, name, recorded)
+    return calls
+
+
+class TestMergePhase:
+    """Tests for the merge phase of extract_entities"""
+
+    def test_reads_once_and_writes_in_batches(self, make_rag):
+        """One bulk read per record kind and bulk writes of at most
+        graph_upsert_batch_size records"""
+        rag = make_rag(graph_upsert_batch_size=2).rag
+        calls = record_calls(rag.chunk_entity_relation_graph)
+        rag.insert(["<<met: ALICE BOB>>", "<<wrote: CAROL DAVE ERIN>>"])
+
+        # hyperedges, then entities
+        assert calls["get_nodes_batch"] == [2, 5]
+        assert calls["get_edges_batch"] == [5]
+        # 2 hyperedges, then 5 entities in batches of 2
+        assert calls["upsert_nodes"] == [2, 2, 2, 1]
+        assert calls["upsert_edges"] == [2, 2, 1]
+        for name in ["get_node", "get_edge", "upsert_node", "upsert_edge"]:
+            assert calls[name] == []
+
+    def test_merges_with_stored_records(self, make_rag):
+        """Records extracted again are merged into the stored ones"""
+        rag = make_rag().rag
+        rag.insert("<<met: ALICE BOB>>")
+        rag.insert("<<met: ALICE CAROL>>")
+        graph = rag.chunk_entity_relation_graph
+
+        async def run():
+            edge = await graph.get_edge("<hyperedge>met", "ALICE")
+            assert edge["weight"] == 160
+            assert len(edge["source_id"].split("<SEP>")) == 2
+            hyperedge = await graph.get_node("<hyperedge>met")
+            assert hyperedge["weight"] == 10
+            alice = await graph.get_node("ALICE")
+            assert alice["description"] == "ALICE in met"
+            assert await graph.has_edge("<hyperedge>met", "CAROL")
+
+        asyncio.run(run())
+
+
+@dataclass
+class SingleWriteGraph(BaseGraphStorage):
+    """A backend implementing only the single-record upserts"""
+
+    def __post_init__(self):
+        self.nodes, self.edges = {}, {}
+
+    async def upsert_node(self, node_id, node_data):
+        self.nodes[node_id] = node_data
+
+    async def upsert_edge(self, source_node_id, target_node_id, edge_data):
+        self.edges[(source_node_id, target_node_id)] = edge_data
+
+
+class TestBulkUpsertFallback:
+    """Tests for the default bulk upserts of BaseGraphStorage"""
+
+    def test_default_bulk_upserts(self):
+        """upsert_nodes and upsert_edges fall back to one call per record"""
+        graph = SingleWriteGraph(namespace="graph", global_config={})
+
+        async def run():
+            await graph.upsert_nodes([("a", {"v": 1}), ("b", {"v": 2})])
+            await graph.upsert_edges([("a", "b", {"w": 1})])
+
+        asyncio.run(run())
+        assert graph.nodes == {"a": {"v": 1}, "b": {"v": 2}}
+        assert graph.edges == {("a", "b"): {"w": 1}}
@@ -0,0 +1,487 @@
+"""
+Unit tests for the graph storages
+
+Tests the CSR incidence-matrix backend IncidenceGraphStorage against
+NetworkXStorage, and the versioned ``.npz`` snapshot both of them persist to.
+"""
+
+import asyncio
+import json
+import os
+import random
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from hypergraphrag.base import BaseGraphStorage
+from hypergraphrag.storage import (
+    GRAPH_SNAPSHOT_VERSION,
+    IncidenceGraphStorage,
+    NetworkXStorage,
+    load_graph_snapshot,
+    write_graph_snapshot,
+)
+
+# Mark all tests in this module as unit tests
+pytestmark = pytest.mark.unit
+
+NODES = [
+    ('"ALICE"', {"role": "entity", "entity_type": "PERSON"}),
+    ('"BOB"', {"role": "entity", "entity_type": "PERSON"}),
+    ('"PARIS"', {"role": "entity", "entity_type": "GEO"}),
+    ("<hyperedge>h1", {"role": "hyperedge", "weight": 1.0}),
+    ("<hyperedge>h2", {"role": "hyperedge", "weight": 2.0}),
+]
+EDGES = [
+    ("<hyperedge>h1", '"ALICE"', {"weight": 1.0}),
+    ("<hyperedge>h1", '"BOB"', {"weight": 1.0}),
+    ('"PARIS"', "<hyperedge>h2", {"weight": 2.0}),
+    ("<hyperedge>h2", '"ALICE"', {"weight": 2.0}),
+]
+
+
+def make_storage(cls, working_dir):
+    return cls(
+        namespace="chunk_entity_relation",
+        global_config={"working_dir": str(working_dir)},
+    )
+
+
+async def build(cls, working_dir):
+    graph = make_storage(cls, working_dir)
+    await graph.upsert_nodes(NODES)
+    await graph.upsert_edges(EDGES)
+    return graph
+
+
+def csr_rows(indptr, indices, row_ids, col_ids) -> dict:
+    return {
+        row_id: sorted(col_ids[c] for c in indices[indptr[i] : indptr[i + 1]])
+        for i, row_id in enumerate(row_ids)
+    }
+
+
+class TestIncidenceGraphStorage:
+    """Tests for IncidenceGraphStorage"""
+
+    def test_matches_networkx(self, tmp_path):
+        """Single and batched reads agree with NetworkXStorage"""
+
+        async def run():
+            incidence = await build(IncidenceGraphStorage, tmp_path / "a")
+            reference = await build(NetworkXStorage, tmp_path / "b")
+            node_ids = [node_id for node_id, _ in NODES] + ['"MISSING"']
+            pairs = [(src, tgt) for src, tgt, _ in EDGES] + [('"BOB"', '"PARIS"')]
+
+            for graph in (incidence, reference):
+                assert await graph.has_edge('"ALICE"', "<hyperedge>h1")
+                assert not await graph.has_edge('"BOB"', '"PARIS"')
+            assert await incidence.get_nodes_batch(
+                node_ids
+            ) == await reference.get_nodes_batch(node_ids)
+            assert await incidence.node_degrees_batch(
+                node_ids
+            ) == await reference.node_degrees_batch(node_ids)
+            assert await incidence.get_edges_batch(
+                pairs
+            ) == await reference.get_edges_batch(pairs)
+            for got, expected in zip(
+                await incidence.get_node_edges_batch(node_ids),
+                await reference.get_node_edges_batch(node_ids),
+            ):
+                assert (got is None) == (expected is None)
+                if got is not None:
+                    assert sorted(got) == sorted(expected)
+            assert await incidence.edge_degree(
+                '"ALICE"', "<hyperedge>h1"
+            ) == await reference.edge_degree('"ALICE"', "<hyperedge>h1")
+
+        asyncio.run(run())
+
+    def test_degrees_and_neighbours(self, tmp_path):
+        """Vectorized degrees and CSR neighbourhoods"""
+
+        async def run():
+            graph = await build(IncidenceGraphStorage, tmp_path)
+            degrees = graph.degrees(['"ALICE"', "<hyperedge>h2", '"MISSING"'])
+            assert degrees.tolist() == [2, 2, 0]
+
+            offsets, neighbours = graph.neighbours(['"BOB"', '"MISSING"', '"ALICE"'])
+            assert offsets.tolist() == [0, 1, 1, 3]
+            assert neighbours[0] == "<hyperedge>h1"
+            assert sorted(neighbours[1:]) == ["<hyperedge>h1", "<hyperedge>h2"]
+
+        asyncio.run(run())
+
+    def test_incidence_matrix(self, tmp_path):
+        """Hyperedge x entity CSR and its transpose"""
+
+        async def run():
+            graph = await build(IncidenceGraphStorage, tmp_path)
+            indptr, indices, row_ids, col_ids = graph.incidence()
+            assert row_ids == ["<hyperedge>h1", "<hyperedge>h2"]
+            assert col_ids == ['"ALICE"', '"BOB"', '"PARIS"']
+            assert indptr.dtype == np.int64
+            assert csr_rows(indptr, indices, row_ids, col_ids) == {
+                "<hyperedge>h1": ['"ALICE"', '"BOB"'],
+                "<hyperedge>h2": ['"ALICE"', '"PARIS"'],
+            }
+            assert csr_rows(*graph.incidence(transpose=True)) == {
+                '"ALICE"': ["<hyperedge>h1", "<hyperedge>h2"],
+                '"BOB"': ["<hyperedge>h1"],
+                '"PARIS"': ["<hyperedge>h2"],
+            }
+
+        asyncio.run(run())
+
+    def test_upsert_updates_attributes(self, tmp_path):
+        """Upserting an existing node or edge merges into its attributes"""
+
+        async def run():
+            graph = await build(IncidenceGraphStorage, tmp_path)
+            await graph.upsert_node('"ALICE"', {"description": "x"})
+            await graph.upsert_edge('"BOB"', "<hyperedge>h1", {"weight": 5.0})
+
+            assert await graph.get_node('"ALICE"') == {
+                "role": "entity",
+                "entity_type": "PERSON",
+                "description": "x",
+            }
+            assert await graph.get_edge("<hyperedge>h1", '"BOB"') == {"weight": 5.0}
+            assert graph.degrees(['"BOB"']).tolist() == [1]
+
+        asyncio.run(run())
+
+    def test_delete_node_removes_incident_edges(self, tmp_path):
+        """Deleting a node drops its edges from reads and the incidence matrix"""
+
+        async def run():
+            graph = await build(IncidenceGraphStorage, tmp_path)
+            await graph.delete_node('"ALICE"')
+
+            assert not await graph.has_node('"ALICE"')
+            assert await graph.get_node_edges('"ALICE"') is None
+            assert not await graph.has_edge("<hyperedge>h1", '"ALICE"')
+            assert graph.degrees(["<hyperedge>h1", "<hyperedge>h2"]).tolist() == [1, 1]
+            assert csr_rows(*graph.incidence()) == {
+                "<hyperedge>h1": ['"BOB"'],
+                "<hyperedge>h2": ['"PARIS"'],
+            }
+
+        asyncio.run(run())
+
+    def test_delete_then_reinsert(self, tmp_path):
+        """A deleted node comes back without its old edges or attributes"""
+
+        async def run():
+            graph = await build(IncidenceGraphStorage, tmp_path)
+            await graph.delete_node('"ALICE"')
+            await graph.upsert_node('"ALICE"', {"role": "entity"})
+            await graph.upsert_edge('"ALICE"', "<hyperedge>h1", {"weight": 3.0})
+
+            assert await graph.get_node('"ALICE"') == {"role": "entity"}
+            assert await graph.get_node_edges('"ALICE"') == [
+                ('"ALICE"', "<hyperedge>h1")
+            ]
+            assert graph.degrees(["<hyperedge>h2"]).tolist() == [1]
+
+            await graph.index_done_callback()
+            reopened = make_storage(IncidenceGraphStorage, tmp_path)
+            assert await reopened.get_edge('"ALICE"', "<hyperedge>h1") == {
+                "weight": 3.0
+            }
+            assert reopened.degrees(['"ALICE"']).tolist() == [1]
+
+        asyncio.run(run())
+
+    def test_reopen_after_write(self, tmp_path):
+        """Flushed graphs reload with the same nodes, edges and matrix"""
+
+        async def run():
+            graph = await build(IncidenceGraphStorage, tmp_path)
+            await graph.delete_node('"BOB"')
+            await graph.index_done_callback()
+
+            reopened = make_storage(IncidenceGraphStorage, tmp_path)
+            assert sorted(reopened._node_index) == sorted(
+                node_id for node_id, _ in NODES if node_id != '"BOB"'
+            )
+            assert len(reopened._node_ids) == len(NODES) - 1
+            assert await reopened.get_node('"PARIS"') == dict(NODES)['"PARIS"']
+            assert csr_rows(*reopened.incidence()) == csr_rows(*graph.incidence())
+
+        asyncio.run(run())
+
+    def test_networkx_view(self, tmp_path):
+        """to_networkx and the _graph property reflect writes"""
+
+        async def run():
+            graph = await build(IncidenceGraphStorage, tmp_path)
+            assert graph._graph.number_of_edges() == len(EDGES)
+            await graph.upsert_edge('"BOB"', '"PARIS"', {"weight": 1.0})
+            assert graph._graph.number_of_edges() == len(EDGES) + 1
+            assert graph.to_networkx().nodes['"BOB"'] == dict(NODES)['"BOB"']
+
+        asyncio.run(run())
+
+    def test_incremental_updates_match_networkx(self, tmp_path):
+        """Interleaved inserts and deletes, merged into the key index and the CSR
+        in batches, read the same as NetworkXStorage and as a full rebuild"""
+
+        async def run():
+            graph = make_storage(IncidenceGraphStorage, tmp_path / "a")
+            graph.edge_index_batch = 4
+            reference = make_storage(NetworkXStorage, tmp_path / "b")
+            names = [f'"N{i}"' for i in range(30)]
+            rng = random.Random(0)
+            for step in range(300):
+                if step % 25 == 24:
+                    name = rng.choice(names)
+                    if await reference.has_node(name):
+                        await graph.delete_node(name)
+                        await reference.delete_node(name)
+                else:
+                    src, tgt = rng.choice(names), rng.choice(names)
+                    data = {"weight": float(step)}
+                    await graph.upsert_edge(src, tgt, data)
+                    await reference.upsert_edge(src, tgt, data)
+                if step % 10 == 0:
+                    # reads in between force partial index and CSR merges
+                    graph.degrees(names[:3])
+                    await graph.get_node_edges(rng.choice(names))
+
+            pairs = [(src, tgt) for src in names for tgt in names]
+            expected_edges = await reference.get_edges_batch(pairs)
+            assert await graph.get_edges_batch(pairs) == expected_edges
+            assert [await graph.get_edge(src, tgt) for src, tgt in pairs] == (
+                expected_edges
+            )
+            assert await graph.node_degrees_batch(
+                names
+            ) == await reference.node_degrees_batch(names)
+
+            def neighbourhoods(edges):
+                return [None if e is None else sorted(e) for e in edges]
+
+            expected = neighbourhoods(await reference.get_node_edges_batch(names))
+            assert neighbourhoods(await graph.get_node_edges_batch(names)) == expected
+            graph._csr = None
+            assert neighbourhoods(await graph.get_node_edges_batch(names)) == expected
+
+        asyncio.run(run())
+
+    def test_typed_attribute_columns(self, tmp_path):
+        """Float attributes are stored as float64, others dictionary-encoded"""
+
+        async def run():
+            graph = make_storage(IncidenceGraphStorage, tmp_path)
+            await graph.upsert_nodes(
+                [
+                    ('"A"', {"entity_type": "PERSON", "rank": 0.5}),
+                    ('"B"', {"entity_type": "PERSON", "rank": 2, "tags": ["x"]}),
+                    ('"C"', {"entity_type": "GEO"}),
+                ]
+            )
+            columns = graph._node_attrs._columns
+            assert columns["entity_type"].dtype == np.int64
+            assert graph._node_attrs._values["entity_type"] == ["PERSON", "GEO"]
+            # an int in a float column re-encodes it, keeping the float values
+            assert columns["rank"].dtype == np.int64
+            await graph.upsert_edge('"A"', '"B"', {"weight": 1.0})
+            assert graph._edge_attrs._columns["weight"].dtype == np.float64
+
+            expected = [
+                {"entity_type": "PERSON", "rank": 0.5},
+                {"entity_type": "PERSON", "rank": 2, "tags": ["x"]},
+                {"entity_type": "GEO"},
+            ]
+            node_ids = ['"A"', '"B"', '"C"']
+            assert await graph.get_nodes_batch(node_ids) == expected
+            await graph.index_done_callback()
+            reopened = make_storage(IncidenceGraphStorage, tmp_path)
+            assert await reopened.get_nodes_batch(node_ids) == expected
+            assert await reopened.get_edge('"B"', '"A"') == {"weight": 1.0}
+
+        asyncio.run(run())
+
+
+class TestGraphSnapshot:
+    """Tests for the binary graph snapshot and the GraphML migration"""
+
+    def test_round_trip(self, tmp_path):
+        """Ids, edges and sparse attribute columns survive a write and load"""
+        file_name = str(tmp_path / "graph.npz")
+        write_graph_snapshot(
+            file_name,
+            ["a", "b", "c"],
+            {"weight": [1.0, None, 3], "tags": [["x"], None, None]},
+            [0, 1],
+            [1, 2],
+            {"weight": [np.float64(0.5), None]},
+        )
+        snapshot = load_graph_snapshot(file_name)
+
+        assert snapshot["node_ids"] == ["a", "b", "c"]
+        assert snapshot["node_columns"] == {
+            "weight": [1.0, None, 3],
+            "tags": [["x"], None, None],
+        }
+        assert snapshot["edge_src"].tolist() == [0, 1]
+        assert snapshot["edge_tgt"].dtype == np.int64
+        assert snapshot["edge_columns"] == {"weight": [0.5, None]}
+        assert not os.path.exists(file_name + ".tmp")
+
+    def test_missing_file(self, tmp_path):
+        """Loading a snapshot that does not exist returns None"""
+        assert load_graph_snapshot(str(tmp_path / "graph.npz")) is None
+
+    @pytest.mark.parametrize(
+        "header",
+        [
+            {"format": "hypergraphrag-graph", "version": GRAPH_SNAPSHOT_VERSION + 1},
+            {"format": "something-else", "version": GRAPH_SNAPSHOT_VERSION},
+        ],
+    )
+    def test_rejects_unknown_header(self, tmp_path, header):
+        """Snapshots from a newer version or another format are refused"""
+        file_name = str(tmp_path / "graph.npz")
+        write_graph_snapshot(file_name, ["a"], {}, [], [], {})
+        with np.load(file_name) as data:
+            arrays = dict(data)
+        arrays["header"] = np.frombuffer(
+            json.dumps(header).encode("utf-8"), dtype=np.uint8
+        )
+        with open(file_name, "wb") as f:
+            np.savez(f, **arrays)
+
+        with pytest.raises(ValueError, match="Unsupported graph snapshot"):
+            load_graph_snapshot(file_name)
+
+    @pytest.mark.parametrize("cls", [NetworkXStorage, IncidenceGraphStorage])
+    def test_reopen_after_write(self, tmp_path, cls):
+        """Both backends reload what they flushed from graph_<namespace>.npz"""
+
+        async def run():
+            graph = await build(cls, tmp_path)
+            await graph.index_done_callback()
+            assert os.path.exists(tmp_path / "graph_chunk_entity_relation.npz")
+
+            reopened = make_storage(cls, tmp_path)
+            node_ids = [node_id for node_id, _ in NODES]
+            assert await reopened.get_nodes_batch(node_ids) == [
+                data for _, data in NODES
+            ]
+            assert await reopened.get_edges_batch(
+                [(src, tgt) for src, tgt, _ in EDGES]
+            ) == [data for _, _, data in EDGES]
+
+        asyncio.run(run())
+
+    def test_backends_share_snapshot(self, tmp_path):
+        """A snapshot written by one backend is readable by the other"""
+
+        async def run():
+            graph = await build(NetworkXStorage, tmp_path)
+            await graph.index_done_callback()
+
+            reopened = make_storage(IncidenceGraphStorage, tmp_path)
+            assert csr_rows(*reopened.incidence()) == {
+                "<hyperedge>h1": ['"ALICE"', '"BOB"'],
+                "<hyperedge>h2": ['"ALICE"', '"PARIS"'],
+            }
+
+        asyncio.run(run())
+
+    @pytest.mark.parametrize("cls", [NetworkXStorage, IncidenceGraphStorage])
+    def test_graphml_migration(self, tmp_path, cls):
+        """An existing GraphML file is imported and written as a snapshot"""
+
+        async def run():
+            graph = nx.Graph()
+            graph.add_nodes_from(NODES)
+            graph.add_edges_from(EDGES)
+            nx.write_graphml(graph, tmp_path / "graph_chunk_entity_relation.graphml")
+
+            migrated = make_storage(cls, tmp_path)
+            await migrated.index_done_callback()
+            assert os.path.exists(tmp_path / "graph_chunk_entity_relation.npz")
+            os.remove(tmp_path / "graph_chunk_entity_relation.graphml")
+
+            reopened = make_storage(cls, tmp_path)
+            assert await reopened.get_node('"PARIS"') == dict(NODES)['"PARIS"']
+            assert await reopened.get_edge('"ALICE"', "<hyperedge>h2") == {
+                "weight": 2.0
+            }
+            assert await reopened.node_degree('"ALICE"') == 2
+
+        asyncio.run(run())
+
+    def test_export_graphml(self, tmp_path):
+        """export_graphml writes a GraphML copy on demand"""
+
+        async def run():
+            graph = await build(IncidenceGraphStorage, tmp_path)
+            file_name = str(tmp_path / "export.graphml")
+            graph.export_graphml(file_name)
+
+            exported = nx.read_graphml(file_name)
+            assert exported.number_of_nodes() == len(NODES)
+            assert exported.number_of_edges() == len(EDGES)
+
+        asyncio.run(run())
+
+
+class TestBatchReads:
+    """Tests for the bulk graph reads"""
+
+    @pytest.mark.parametrize("cls", [NetworkXStorage, IncidenceGraphStorage])
+    def test_match_single_reads(self, tmp_path, cls):
+        """Every *_batch read returns what the single reads return, in order"""
+
+        async def run():
+            graph = await build(cls, tmp_path)
+            node_ids = ['"MISSING"'] + [node_id for node_id, _ in reversed(NODES)]
+            pairs = [(tgt, src) for src, tgt, _ in EDGES] + [('"BOB"', '"PARIS"')]
+
+            assert await graph.get_nodes_batch(node_ids) == [
+                await graph.get_node(node_id) for node_id in node_ids
+            ]
+            assert await graph.node_degrees_batch(node_ids) == [
+                await graph.node_degree(node_id) for node_id in node_ids
+            ]
+            assert await graph.get_edges_batch(pairs) == [
+                await graph.get_edge(src, tgt) for src, tgt in pairs
+            ]
+            assert await graph.edge_degrees_batch(pairs) == [
+                await graph.edge_degree(src, tgt) for src, tgt in pairs
+            ]
+            for got, node_id in zip(
+                await graph.get_node_edges_batch(node_ids), node_ids
+            ):
+                expected = await graph.get_node_edges(node_id)
+                assert (got is None) == (expected is None)
+                if got is not None:
+                    assert sorted(got) == sorted(expected)
+
+        asyncio.run(run())
+
+    def test_default_batch_reads(self, tmp_path):
+        """The BaseGraphStorage defaults fall back to one read per item"""
+
+        async def run():
+            graph = await build(NetworkXStorage, tmp_path)
+            node_ids = [node_id for node_id, _ in NODES] + ['"MISSING"']
+            pairs = [(src, tgt) for src, tgt, _ in EDGES]
+
+            for name, args in [
+                ("get_nodes_batch", node_ids),
+                ("node_degrees_batch", node_ids),
+                ("get_edges_batch", pairs),
+                ("edge_degrees_batch", pairs),
+                ("get_node_edges_batch", node_ids),
+            ]:
+                expected = await getattr(graph, name)(args)
+                assert await getattr(BaseGraphStorage, name)(graph, args) == expected
+
+        asyncio.run(run())
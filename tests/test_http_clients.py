@@ -0,0 +1,117 @@
+"""
+Unit tests for the pooled HTTP clients
+
+Tests that LLM and embedding calls share one client per event loop and that
+clients are closed, including those of event loops that have been closed.
+"""
+
+import asyncio
+
+import pytest
+
+from hypergraphrag import hypergraphrag as hypergraphrag_module
+from hypergraphrag import llm
+
+# Mark all tests in this module as unit tests
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture(autouse=True)
+def empty_registry(monkeypatch):
+    monkeypatch.setattr(llm, "_http_clients", {})
+
+
+class TestPooledClients:
+    """Tests for the per-loop client registry"""
+
+    def test_client_is_reused_within_a_loop(self):
+        """Calls on one loop get the same client, other loops a new one"""
+
+        async def get():
+            first = llm.get_openai_client(api_key="test")
+            assert llm.get_openai_client(api_key="test") is first
+            assert llm.get_openai_client(api_key="other") is not first
+            return first
+
+        first = asyncio.run(get())
+        second = asyncio.run(get())
+        assert second is not first
+
+    def test_close_http_clients(self):
+        """Clients of the running loop are closed and unregistered"""
+
+        async def run():
+            client = llm.get_openai_client(api_key="test")
+            session = llm.get_aiohttp_session("ollama")
+            await llm.close_http_clients()
+
+            assert client.is_closed()
+            assert session.closed
+            assert llm._http_clients == {}
+
+        asyncio.run(run())
+
+    def test_clients_of_closed_loops_are_closed(self):
+        """A client left behind by a finished asyncio.run is closed, not dropped"""
+
+        async def open_client():
+            return llm.get_openai_client(api_key="test")
+
+        stale = asyncio.run(open_client())
+
+        async def run():
+            fresh = llm.get_openai_client(api_key="test")
+            assert fresh is not stale
+            await asyncio.gather(*llm._closing_clients)
+            assert stale.is_closed()
+            assert list(llm._http_clients.values()) == [fresh]
+            await llm.close_http_clients()
+
+        asyncio.run(run())
+
+    def test_close_includes_closed_loops(self):
+        """close_http_clients also closes clients of closed loops"""
+
+        async def open_client():
+            return llm.get_openai_client(api_key="test")
+
+        stale = asyncio.run(open_client())
+
+        async def run():
+            await llm.close_http_clients()
+
+        asyncio.run(run())
+        assert stale.is_closed()
+        assert llm._http_clients == {}
+
+
+class TestHyperGraphRAGClose:
+    """Tests for HyperGraphRAG.aclose and close"""
+
+    def test_aclose_releases_clients_and_workers(self, make_rag):
+        """aclose shuts the chunking executor and the pooled clients"""
+        rag = make_rag(chunking_executor="thread").rag
+
+        async def run():
+            client = llm.get_openai_client(api_key="test")
+            executor = rag._get_chunking_executor()
+            await rag.aclose()
+
+            assert client.is_closed()
+            assert executor._shutdown
+            assert rag._chunking_executor is None
+
+        asyncio.run(run())
+
+    def test_close_runs_on_the_insert_loop(self, make_rag):
+        """The sync close closes clients opened by the sync insert and query"""
+        rag = make_rag().rag
+
+        async def open_client():
+            return llm.get_openai_client(api_key="test")
+
+        loop = hypergraphrag_module.always_get_an_event_loop()
+        client = loop.run_until_complete(open_client())
+        rag.close()
+        assert client.is_closed()
+        assert llm._http_clients == {}
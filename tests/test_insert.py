@@ -0,0 +1,157 @@
+"""
+Unit tests for document insertion
+
+Tests that extraction starts while later documents are still being chunked,
+that the chunking executor lives until the instance is closed, and streaming
+insertion in micro-batches.
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from hypergraphrag import hypergraphrag as hypergraphrag_module
+from tests.conftest import FakeLLM
+
+# Mark all tests in this module as unit tests
+pytestmark = pytest.mark.unit
+
+
+class SignallingLLM(FakeLLM):
+    """Sets ``started`` on the first extraction call"""
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+
+    async def __call__(self, prompt, **kwargs):
+        self.started.set()
+        return await super().__call__(prompt, **kwargs)
+
+
+class TestInsert:
+    """Tests for ainsert"""
+
+    def test_extraction_overlaps_chunking(self, make_rag, monkeypatch):
+        """The first document is extracted before the last one is chunked"""
+        llm = SignallingLLM()
+        chunk = hypergraphrag_module.chunking_by_token_size
+        overlapped = []
+
+        def slow_chunking(content, **kwargs):
+            if "ERIN" in content:
+                overlapped.append(llm.started.wait(timeout=5))
+            return chunk(content, **kwargs)
+
+        monkeypatch.setattr(
+            hypergraphrag_module, "chunking_by_token_size", slow_chunking
+        )
+        rag = make_rag(llm_model_func=llm, chunking_executor="thread").rag
+
+        async def run():
+            await rag.ainsert(["<<met: ALICE BOB>>", "<<spoke: ERIN>>"])
+            assert overlapped == [True]
+            assert await rag.chunk_entity_relation_graph.has_node("ERIN")
+            await rag.aclose()
+
+        asyncio.run(run())
+
+    def test_executor_is_kept_until_close(self, make_rag):
+        """One chunking executor serves every insert until aclose"""
+        rag = make_rag(chunking_executor="thread").rag
+
+        async def run():
+            await rag.ainsert("<<met: ALICE BOB>>")
+            executor = rag._chunking_executor
+            assert executor is not None
+            await rag.ainsert_stream(["<<spoke: ERIN>>"])
+            assert rag._chunking_executor is executor
+
+            await rag.aclose()
+            assert rag._chunking_executor is None
+            assert executor._shutdown
+
+        asyncio.run(run())
+
+
+class CountingLLM(FakeLLM):
+    """Records how many documents the stream had yielded at each extraction"""
+
+    def __init__(self):
+        super().__init__()
+        self.yielded = 0
+        self.seen = []
+
+    async def __call__(self, prompt, **kwargs):
+        self.seen.append(self.yielded)
+        return await super().__call__(prompt, **kwargs)
+
+
+DOCS = [f"<<fact {i}: PERSON{i}>>" for i in range(6)]
+
+
+class TestInsertStream:
+    """Tests for ainsert_stream"""
+
+    def test_sync_and_async_iterables(self, make_rag):
+        """Both kinds of iterables are inserted; duplicates are skipped"""
+        rag = make_rag().rag
+
+        async def docs():
+            for doc in DOCS[3:] + DOCS[:1]:
+                yield doc
+
+        async def run():
+            inserted = await rag.ainsert_stream(DOCS[:3] + DOCS[:1], batch_size=2)
+            assert inserted == 3
+            assert await rag.ainsert_stream(docs(), batch_size=2) == 3
+            assert await rag.ainsert_stream(DOCS) == 0
+            for i in range(6):
+                assert await rag.chunk_entity_relation_graph.has_node(f"PERSON{i}")
+
+        asyncio.run(run())
+
+    def test_flushes_every_batch(self, make_rag):
+        """Each micro-batch is committed on its own"""
+        rag = make_rag().rag
+        flushed = []
+        insert_done = rag._insert_done
+
+        async def recorded():
+            flushed.append(len(await rag.full_docs.all_keys()))
+            await insert_done()
+
+        rag._insert_done = recorded
+        assert rag.insert_stream(DOCS, batch_size=4) == 6
+        assert flushed == [4, 6]
+
+    def test_bounded_read_ahead(self, make_rag):
+        """The documents are read at most max_pending_batches batches ahead"""
+        llm = CountingLLM()
+        rag = make_rag(llm_model_func=llm).rag
+
+        def docs():
+            for doc in DOCS:
+                llm.yielded += 1
+                yield doc
+
+        rag.insert_stream(docs(), batch_size=1, max_pending_batches=1)
+        # the batch being extracted, one queued and one waiting to be queued
+        assert llm.seen[0] <= 3
+        assert llm.yielded == 6
+
+    def test_reader_error_keeps_committed_batches(self, make_rag):
+        """An error from the iterable is raised after the earlier batches are in"""
+        rag = make_rag().rag
+
+        def docs():
+            yield from DOCS[:2]
+            raise RuntimeError("source went away")
+
+        async def run():
+            with pytest.raises(RuntimeError, match="source went away"):
+                await rag.ainsert_stream(docs(), batch_size=2)
+            assert await rag.chunk_entity_relation_graph.has_node("PERSON1")
+
+        asyncio.run(run())
@@ -0,0 +1,203 @@
+"""
+Unit tests for the append-only JsonLogKVStorage
+
+Tests the segment log, replay on reopen, tombstones and compaction.
+"""
+
+import asyncio
+import json
+import os
+
+import pytest
+
+from hypergraphrag.storage import JsonLogKVStorage
+
+# Mark all tests in this module as unit tests
+pytestmark = pytest.mark.unit
+
+
+def make_storage(working_dir, **config):
+    return JsonLogKVStorage(
+        namespace="test",
+        global_config={"working_dir": str(working_dir), **config},
+        embedding_func=None,
+    )
+
+
+def log_records(working_dir):
+    with open(os.path.join(working_dir, "kv_store_test.log"), "rb") as f:
+        return [line.split(b"\t", 1) for line in f]
+
+
+class TestJsonLogKVStorage:
+    """Tests for JsonLogKVStorage"""
+
+    def test_reopen_after_write(self, tmp_path):
+        """Flushed records are replayed from the log on reopen"""
+
+        async def run():
+            kv = make_storage(tmp_path)
+            await kv.upsert({"a": {"v": 1}, "b": {"v": 2}})
+            await kv.index_done_callback()
+
+            reopened = make_storage(tmp_path)
+            assert sorted(await reopened.all_keys()) == ["a", "b"]
+            assert await reopened.get_by_id("a") == {"v": 1}
+            assert await reopened.get_by_ids(["b", "missing"]) == [{"v": 2}, None]
+            assert await reopened.filter_keys(["a", "c"]) == {"c"}
+
+        asyncio.run(run())
+
+    def test_flush_appends_only_changes(self, tmp_path):
+        """A flush appends the keys changed since the previous one"""
+
+        async def run():
+            kv = make_storage(tmp_path)
+            await kv.upsert({"a": {"v": 1}})
+            await kv.index_done_callback()
+            await kv.upsert({"b": {"v": 2}})
+            await kv.index_done_callback()
+            await kv.index_done_callback()
+
+            keys = [json.loads(k) for k, _ in log_records(tmp_path)]
+            assert keys == ["a", "b"]
+
+        asyncio.run(run())
+
+    def test_upsert_keeps_existing_value(self, tmp_path):
+        """Like JsonKVStorage, upsert does not overwrite an existing key"""
+
+        async def run():
+            kv = make_storage(tmp_path)
+            assert await kv.upsert({"a": {"v": 1}}) == {"a": {"v": 1}}
+            assert await kv.upsert({"a": {"v": 2}}) == {}
+            assert await kv.get_by_id("a") == {"v": 1}
+
+        asyncio.run(run())
+
+    def test_mutated_value_is_persisted(self, tmp_path):
+        """Upserting a value returned by get_by_id after mutating it is flushed"""
+
+        async def run():
+            kv = make_storage(tmp_path)
+            await kv.upsert({"a": {"v": 1}})
+            await kv.index_done_callback()
+
+            kv = make_storage(tmp_path)
+            value = await kv.get_by_id("a")
+            value["v"] = 2
+            await kv.upsert({"a": value})
+            await kv.index_done_callback()
+
+            assert await make_storage(tmp_path).get_by_id("a") == {"v": 2}
+
+        asyncio.run(run())
+
+    def test_decoded_values_are_bounded(self, tmp_path):
+        """Flushed values beyond cache_max_values are evicted, least recently
+        used first, and read back from the log on the next access"""
+
+        async def run():
+            kv = make_storage(tmp_path, kv_cache_max_values=4)
+            await kv.upsert({f"k{i}": {"v": i} for i in range(10)})
+            # unflushed values are never evicted
+            assert await kv.get_by_id("k0") == {"v": 0}
+            assert len(kv._values) == 10
+            await kv.index_done_callback()
+            assert len(kv._values) <= 4
+
+            for i in range(10):
+                assert await kv.get_by_id(f"k{i}") == {"v": i}
+                await kv.get_by_id("k0")
+                assert len(kv._values) <= 5
+            assert "k0" in kv._values
+
+        asyncio.run(run())
+
+    def test_delete_then_reinsert(self, tmp_path):
+        """Deletes are logged as tombstones and a key can be inserted again"""
+
+        async def run():
+            kv = make_storage(tmp_path)
+            await kv.upsert({"a": {"v": 1}, "b": {"v": 2}})
+            await kv.index_done_callback()
+            await kv.delete(["a"])
+            await kv.index_done_callback()
+
+            reopened = make_storage(tmp_path)
+            assert await reopened.all_keys() == ["b"]
+            assert await reopened.get_by_id("a") is None
+            assert log_records(tmp_path)[-1] == [b'"a"', b"null\n"]
+
+            await reopened.upsert({"a": {"v": 3}})
+            await reopened.index_done_callback()
+            assert await make_storage(tmp_path).get_by_id("a") == {"v": 3}
+
+        asyncio.run(run())
+
+    def test_torn_tail_is_dropped(self, tmp_path):
+        """An incomplete last record from an interrupted flush is truncated"""
+
+        async def run():
+            kv = make_storage(tmp_path)
+            await kv.upsert({"a": {"v": 1}})
+            await kv.index_done_callback()
+            log_file = os.path.join(tmp_path, "kv_store_test.log")
+            size = os.path.getsize(log_file)
+            with open(log_file, "ab") as f:
+                f.write(b'"b"\t{"v": ')
+
+            reopened = make_storage(tmp_path)
+            assert await reopened.all_keys() == ["a"]
+            assert os.path.getsize(log_file) == size
+
+        asyncio.run(run())
+
+    def test_compaction_drops_superseded_records(self, tmp_path):
+        """The log is rewritten once dead records exceed the compaction ratio"""
+
+        async def run():
+            kv = make_storage(tmp_path, kv_compaction_ratio=0.5)
+            kv.compaction_min_bytes = 0
+            await kv.upsert({f"k{i}": {"v": i} for i in range(4)})
+            await kv.index_done_callback()
+            await kv.delete(["k0", "k1", "k2"])
+            await kv.index_done_callback()
+
+            assert [json.loads(k) for k, _ in log_records(tmp_path)] == ["k3"]
+            reopened = make_storage(tmp_path)
+            assert await reopened.all_keys() == ["k3"]
+            assert await reopened.get_by_id("k3") == {"v": 3}
+
+        asyncio.run(run())
+
+    def test_drop_rewrites_log(self, tmp_path):
+        """Records upserted after a drop replace the whole log"""
+
+        async def run():
+            kv = make_storage(tmp_path)
+            await kv.upsert({"a": {"v": 1}})
+            await kv.index_done_callback()
+            await kv.drop()
+            await kv.upsert({"b": {"v": 2}})
+            await kv.index_done_callback()
+
+            reopened = make_storage(tmp_path)
+            assert await reopened.all_keys() == ["b"]
+
+        asyncio.run(run())
+
+    def test_migrates_legacy_json(self, tmp_path):
+        """A kv_store_<namespace>.json file is imported on first open"""
+
+        async def run():
+            with open(os.path.join(tmp_path, "kv_store_test.json"), "w") as f:
+                json.dump({"a": {"v": 1}}, f)
+            kv = make_storage(tmp_path)
+            assert await kv.get_by_id("a") == {"v": 1}
+            await kv.index_done_callback()
+
+            os.remove(os.path.join(tmp_path, "kv_store_test.json"))
+            assert await make_storage(tmp_path).get_by_id("a") == {"v": 1}
+
+        asyncio.run(run())
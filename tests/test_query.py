@@ -0,0 +1,360 @@
+"""
+Unit tests for querying
+
+Tests the query keyword cache, that queries read the graph in bulk and run
+their local and global retrieval concurrently, the retrieval-context cache
+that only_need_context queries are served from, how finished inserts and
+deletes invalidate it, and batched queries.
+"""
+
+import asyncio
+
+import pytest
+
+from hypergraphrag import QueryParam
+from hypergraphrag.operate import _extraction_prompt, _ReadMemo
+from hypergraphrag.prompt import PROMPTS
+from tests.conftest import FakeLLM
+
+# Mark all tests in this module as unit tests
+pytestmark = pytest.mark.unit
+
+DOCS = ["<<met at the lab: ALICE BOB>>", "<<wrote a paper: CAROL DAVE>>"]
+QUERY = "<<met at the lab: ALICE>>"
+CONTEXT = QueryParam(only_need_context=True)
+
+
+def count_graph_reads(rag) -> list:
+    """Record the names of the graph batch reads made by queries"""
+    graph = rag.chunk_entity_relation_graph
+    reads = []
+    for name in ["get_nodes_batch", "get_edges_batch", "get_node_edges_batch"]:
+        method = getattr(graph, name)
+
+        async def recorded(*args, _name=name, _method=method):
+            reads.append(_name)
+            return await _method(*args)
+
+        setattr(graph, name, recorded)
+    return reads
+
+
+class TestQueryKeywords:
+    """Tests for the query keyword extraction and its cache"""
+
+    def test_extraction_prompt_rendered_once(self):
+        """The static prompt parts are rendered once and wrap the input as the
+        full template would"""
+        global_config = {"addon_params": {"language": "French"}}
+        prefix, suffix = _extraction_prompt(global_config)
+        assert _extraction_prompt(global_config)[0] is prefix
+
+        delimiters = dict(
+            tuple_delimiter=PROMPTS["DEFAULT_TUPLE_DELIMITER"],
+            record_delimiter=PROMPTS["DEFAULT_RECORD_DELIMITER"],
+            completion_delimiter=PROMPTS["DEFAULT_COMPLETION_DELIMITER"],
+        )
+        examples = "\n".join(PROMPTS["entity_extraction_examples"]).format(
+            **delimiters,
+            entity_types=",".join(PROMPTS["DEFAULT_ENTITY_TYPES"]),
+            language="French",
+        )
+        assert prefix + "some text" + suffix == PROMPTS["entity_extraction"].format(
+            **delimiters, examples=examples, language="French", input_text="some text"
+        )
+
+    def test_repeated_query_skips_the_llm(self, make_rag):
+        """Keywords are cached per normalized query"""
+        built = make_rag(enable_context_cache=False)
+        built.rag.insert(DOCS)
+        calls = len(built.llm.prompts)
+        first = built.rag.query(QUERY, CONTEXT)
+        assert len(built.llm.prompts) == calls + 1
+
+        assert built.rag.query(f"  {QUERY.lower()}? ", CONTEXT) == first
+        assert len(built.llm.prompts) == calls + 1
+
+    def test_cache_disabled(self, make_rag):
+        """Without the keyword cache every query extracts its keywords"""
+        built = make_rag(enable_context_cache=False, enable_keyword_cache=False)
+        built.rag.insert(DOCS)
+        calls = len(built.llm.prompts)
+        built.rag.query(QUERY, CONTEXT)
+        built.rag.query(QUERY, CONTEXT)
+        assert len(built.llm.prompts) == calls + 2
+
+    def test_empty_keywords_are_not_cached(self, make_rag):
+        """A query that yielded no keywords is extracted again next time"""
+        built = make_rag()
+        built.rag.insert(DOCS)
+        calls = len(built.llm.prompts)
+        for _ in range(2):
+            assert built.rag.query("no keywords", CONTEXT) == PROMPTS["fail_response"]
+        assert len(built.llm.prompts) == calls + 2
+
+    def test_prompt_change_misses(self, make_rag):
+        """Keywords extracted under another prompt config are not reused"""
+        built = make_rag(enable_context_cache=False)
+        built.rag.insert(DOCS)
+        built.rag.query(QUERY, CONTEXT)
+
+        reopened = make_rag(
+            enable_context_cache=False, addon_params={"language": "French"}
+        )
+        reopened.rag.query(QUERY, CONTEXT)
+        assert len(reopened.llm.prompts) == 1
+
+
+class TestGraphReads:
+    """Tests for how queries read the graph"""
+
+    def test_only_bulk_reads(self, make_rag):
+        """Retrieval reads the graph through the *_batch methods only"""
+        rag = make_rag(enable_context_cache=False).rag
+        rag.insert(DOCS)
+        graph = rag.chunk_entity_relation_graph
+        single_reads = []
+        for name in ["get_node", "get_edge", "node_degree", "get_node_edges"]:
+
+            async def recorded(*args, _name=name):
+                single_reads.append(_name)
+
+            setattr(graph, name, recorded)
+        reads = count_graph_reads(rag)
+
+        assert "ALICE in met at the lab" in rag.query(QUERY, CONTEXT)
+        assert sorted(set(reads)) == [
+            "get_edges_batch",
+            "get_node_edges_batch",
+            "get_nodes_batch",
+        ]
+        assert single_reads == []
+
+
+class TestConcurrentRetrieval:
+    """Tests for running the local and global branches together"""
+
+    def test_branches_overlap(self, make_rag):
+        """The global branch starts reading while the local one is waiting"""
+        rag = make_rag(enable_context_cache=False).rag
+        rag.insert(DOCS)
+        graph = rag.chunk_entity_relation_graph
+        get_nodes_batch = graph.get_nodes_batch
+        overlapped = []
+        global_started = asyncio.Event()
+
+        async def get_nodes(node_ids):
+            if node_ids[0].startswith("<hyperedge>"):
+                global_started.set()
+            elif not overlapped:
+                try:
+                    await asyncio.wait_for(global_started.wait(), timeout=1)
+                    overlapped.append(True)
+                except asyncio.TimeoutError:
+                    overlapped.append(False)
+            return await get_nodes_batch(node_ids)
+
+        graph.get_nodes_batch = get_nodes
+        context = rag.query(QUERY, CONTEXT)
+        assert overlapped == [True]
+        assert "ALICE in met at the lab" in context
+
+    def test_read_memo_shares_fetches(self):
+        """Concurrent reads of overlapping keys fetch every key once"""
+        fetched = []
+
+        async def fetch(keys):
+            fetched.append(list(keys))
+            await asyncio.sleep(0.01)
+            return [key.upper() for key in keys]
+
+        async def run():
+            memo = _ReadMemo()
+            first, second = await asyncio.gather(
+                memo._read("node", ["a", "b", "a"], fetch),
+                memo._read("node", ["b", "c"], fetch),
+            )
+            assert first == ["A", "B", "A"]
+            assert second == ["B", "C"]
+            assert await memo._read("node", ["c"], fetch) == ["C"]
+            assert await memo._read("edge", ["c"], fetch) == ["C"]
+
+        asyncio.run(run())
+        assert fetched == [["a", "b"], ["c"], ["c"]]
+
+    def test_read_memo_failure(self):
+        """A failed fetch fails every waiter and is retried by the next read"""
+        failures = [RuntimeError("backend down")]
+
+        async def fetch(keys):
+            await asyncio.sleep(0.01)
+            if failures:
+                raise failures.pop()
+            return list(keys)
+
+        async def run():
+            memo = _ReadMemo()
+            results = await asyncio.gather(
+                memo._read("node", ["a"], fetch),
+                memo._read("node", ["a"], fetch),
+                return_exceptions=True,
+            )
+            assert all(isinstance(r, RuntimeError) for r in results)
+            assert await memo._read("node", ["a"], fetch) == ["a"]
+
+        asyncio.run(run())
+
+
+class TestContextCache:
+    """Tests for the only_need_context result cache"""
+
+    def test_repeated_context_is_cached(self, make_rag):
+        """The second identical context query does no retrieval"""
+        rag = make_rag().rag
+        rag.insert(DOCS)
+        reads = count_graph_reads(rag)
+
+        first = rag.query(QUERY, CONTEXT)
+        assert "ALICE in met at the lab" in first
+        assert reads
+        reads.clear()
+        assert rag.query(QUERY, CONTEXT) == first
+        assert reads == []
+
+        # other retrieval parameters are cached separately
+        rag.query(QUERY, QueryParam(only_need_context=True, top_k=1))
+        assert reads
+
+    def test_insert_invalidates(self, make_rag):
+        """A finished insert bumps the storage version and drops cached contexts"""
+        rag = make_rag().rag
+        rag.insert(DOCS)
+        version = rag._storage_version()
+        assert "ERIN" not in rag.query(QUERY, CONTEXT)
+
+        rag.insert("<<gave a talk at the lab: ERIN>>")
+        assert rag._storage_version() != version
+        assert "ERIN" in rag.query(QUERY, CONTEXT)
+
+    def test_delete_invalidates(self, make_rag):
+        """Deleting an entity bumps the storage version"""
+        rag = make_rag().rag
+        rag.insert(DOCS)
+        version = rag._storage_version()
+        rag.delete_by_entity("BOB")
+        assert rag._storage_version() != version
+
+    def test_cache_survives_restart(self, make_rag):
+        """The storage version is on disk, so a new instance keeps using the cache"""
+        rag = make_rag().rag
+        rag.insert(DOCS)
+        first = rag.query(QUERY, CONTEXT)
+
+        reopened = make_rag().rag
+        reads = count_graph_reads(reopened)
+        assert reopened.query(QUERY, CONTEXT) == first
+        assert reads == []
+
+    def test_callable_format_is_not_cached(self, make_rag):
+        """Contexts rendered by a callable are built on every query"""
+        rag = make_rag().rag
+        rag.insert(DOCS)
+        reads = count_graph_reads(rag)
+        param = QueryParam(only_need_context=True, context_format=lambda c: "custom")
+
+        assert rag.query(QUERY, param) == "custom"
+        reads.clear()
+        assert rag.query(QUERY, param) == "custom"
+        assert reads
+
+
+class EchoLLM(FakeLLM):
+    """Answers a query with the query itself, longer queries answered sooner"""
+
+    async def __call__(self, prompt, system_prompt=None, history_messages=[], **kwargs):
+        if system_prompt is None:
+            return await super().__call__(prompt)
+        self.prompts.append(prompt)
+        await asyncio.sleep(0.05 / len(prompt))
+        return f"answer to {prompt}"
+
+
+NO_CACHE = dict(
+    enable_llm_cache=False, enable_keyword_cache=False, enable_context_cache=False
+)
+QUERIES = [
+    "<<met at the lab: ALICE>>",
+    "<<wrote a paper together at the lab: CAROL DAVE>>",
+    "<<met: BOB>>",
+]
+
+
+class TestQueryBatch:
+    """Tests for query_batch"""
+
+    def test_answers_in_input_order(self, make_rag):
+        """Answers line up with the queries, whatever order they finish in"""
+        rag = make_rag(llm_model_func=EchoLLM(), **NO_CACHE).rag
+        rag.insert(DOCS)
+        answers = rag.query_batch(QUERIES)
+        assert answers == [f"answer to {query}" for query in QUERIES]
+
+    def test_same_results_as_single_queries(self, make_rag):
+        """Each context in the batch equals the one the query gets on its own"""
+        rag = make_rag(**NO_CACHE).rag
+        rag.insert(DOCS)
+        contexts = rag.query_batch(QUERIES, CONTEXT)
+        assert contexts == [rag.query(query, CONTEXT) for query in QUERIES]
+
+        param = QueryParam(only_need_context=True, top_k=1, context_format="json")
+        contexts = rag.query_batch(QUERIES, param)
+        assert contexts == [rag.query(query, param) for query in QUERIES]
+
+    def test_one_embedding_call_and_search_per_store(self, make_rag):
+        """The keywords of all queries are embedded and searched together"""
+        rag = make_rag(**NO_CACHE).rag
+        rag.insert(DOCS)
+        calls = []
+        stores = [("entities", rag.entities_vdb), ("hyperedges", rag.hyperedges_vdb)]
+        for name, vdb in stores:
+            method = vdb.query_embeddings
+
+            async def recorded(embeddings, top_k=5, _name=name, _method=method):
+                calls.append((_name, len(embeddings)))
+                return await _method(embeddings, top_k)
+
+            vdb.query_embeddings = recorded
+        embed = rag.entities_vdb._embed_queries
+
+        async def recorded_embed(texts):
+            calls.append(("embed", len(texts)))
+            return await embed(texts)
+
+        rag.entities_vdb._embed_queries = recorded_embed
+        rag.query_batch(QUERIES, CONTEXT)
+        assert sorted(calls) == [("embed", 6), ("entities", 3), ("hyperedges", 3)]
+
+    def test_failed_query_keeps_its_slot(self, make_rag):
+        """A query without keywords gets the fail response in its own place"""
+        rag = make_rag(**NO_CACHE).rag
+        rag.insert(DOCS)
+        queries = [QUERIES[0], "no keywords here", QUERIES[2]]
+        contexts = rag.query_batch(queries, CONTEXT)
+        assert contexts[1] == PROMPTS["fail_response"]
+        assert contexts[0] == rag.query(QUERIES[0], CONTEXT)
+        assert contexts[2] == rag.query(QUERIES[2], CONTEXT)
+
+    def test_cached_and_fresh_queries_mix(self, make_rag):
+        """Queries answered from the cache sit beside freshly retrieved ones"""
+        rag = make_rag().rag
+        rag.insert(DOCS)
+        cached = rag.query(QUERIES[1], CONTEXT)
+        contexts = rag.query_batch(QUERIES, CONTEXT)
+        assert contexts[1] == cached
+        assert contexts == [rag.query(query, CONTEXT) for query in QUERIES]
+
+    def test_only_hybrid_mode(self, make_rag):
+        """Other modes are rejected"""
+        rag = make_rag().rag
+        with pytest.raises(ValueError):
+            rag.query_batch(QUERIES, QueryParam(mode="naive"))
@@ -0,0 +1,130 @@
+"""
+Unit tests for the structured query context
+
+Tests how QueryContext rows are combined and rendered as csv, json, compact
+text or by a callable, and that queries hand the callable their rows.
+"""
+
+import json
+import re
+
+import pytest
+
+from hypergraphrag import QueryParam
+from hypergraphrag.base import QueryContext
+from hypergraphrag.operate import combine_contexts, render_context
+from hypergraphrag.utils import csv_string_to_list
+
+# Mark all tests in this module as unit tests
+pytestmark = pytest.mark.unit
+
+
+def entity(name, description="a person"):
+    return {"entity": name, "type": "person", "description": description}
+
+
+def relation(name, *entities):
+    return {"hyperedge": name, "related_entities": "|".join(entities)}
+
+
+CONTEXT = QueryContext(
+    entities=[entity("ALICE", 'said "hi", then left'), entity("BOB")],
+    relations=[relation("<hyperedge>met", "ALICE", "BOB")],
+    sources=[{"id": "chunk-1", "content": "ALICE met BOB"}],
+)
+
+
+def sections(text: str, fence: str) -> list[str]:
+    return re.findall(rf"```{fence}\n(.*?)\n```", text, re.S)
+
+
+class TestRenderContext:
+    """Tests for render_context"""
+
+    def test_csv(self):
+        """Rows become numbered csv tables that survive quoting"""
+        entities, relations, sources = sections(render_context(CONTEXT), "csv")
+        assert csv_string_to_list(entities) == [
+            ["id", "entity", "type", "description"],
+            ["0", "ALICE", "person", 'said "hi", then left'],
+            ["1", "BOB", "person", "a person"],
+        ]
+        assert csv_string_to_list(relations) == [
+            ["id", "hyperedge", "related_entities"],
+            ["0", "<hyperedge>met", "ALICE|BOB"],
+        ]
+        assert csv_string_to_list(sources) == [
+            ["id", "content"],
+            ["0", "ALICE met BOB"],
+        ]
+
+    def test_json(self):
+        """Rows become json arrays; sources keep only their content"""
+        entities, relations, sources = sections(render_context(CONTEXT, "json"), "json")
+        assert json.loads(entities) == CONTEXT.entities
+        assert json.loads(relations) == CONTEXT.relations
+        assert json.loads(sources) == [{"content": "ALICE met BOB"}]
+
+    def test_compact(self):
+        """Rows become one bullet line each"""
+        text = render_context(CONTEXT, "compact")
+        assert '- ALICE (person): said "hi", then left' in text
+        assert "- <hyperedge>met [ALICE|BOB]" in text
+        assert "- ALICE met BOB" in text
+        assert "```" not in text
+
+    def test_callable_and_unknown_format(self):
+        """A callable gets the QueryContext itself; unknown names are rejected"""
+        assert render_context(CONTEXT, lambda c: str(len(c.entities))) == "2"
+        with pytest.raises(ValueError, match="Unknown context format"):
+            render_context(CONTEXT, "yaml")
+
+
+class TestCombineContexts:
+    """Tests for combine_contexts"""
+
+    def test_high_level_rows_first_without_duplicates(self):
+        """Rows seen in the global context are not repeated from the local one"""
+        hl = QueryContext(
+            entities=[entity("ALICE", "from hl")],
+            relations=[relation("<hyperedge>met", "ALICE")],
+            sources=[{"id": "chunk-1", "content": "one"}],
+        )
+        ll = QueryContext(
+            entities=[entity("ALICE", "from ll"), entity("BOB")],
+            relations=[relation("<hyperedge>met", "ALICE")],
+            sources=[
+                {"id": "chunk-2", "content": "two"},
+                {"id": "chunk-1", "content": "one"},
+            ],
+        )
+        combined = combine_contexts(hl, ll)
+        assert combined.entities == [entity("ALICE", "from hl"), entity("BOB")]
+        assert len(combined.relations) == 1
+        assert [r["id"] for r in combined.sources] == ["chunk-1", "chunk-2"]
+        assert not combined.is_empty()
+        assert QueryContext().is_empty()
+
+
+class TestQueryContextFormat:
+    """Tests for context_format on queries"""
+
+    def test_callable_gets_the_rows(self, make_rag):
+        """A query hands its retrieved rows to a callable context_format"""
+        rag = make_rag().rag
+        rag.insert(["<<met at the lab: ALICE BOB>>", "<<wrote a paper: CAROL>>"])
+        received = []
+
+        def render(context):
+            received.append(context)
+            return "custom"
+
+        param = QueryParam(only_need_context=True, context_format=render)
+        assert rag.query("<<met at the lab: ALICE>>", param) == "custom"
+        (context,) = received
+        assert isinstance(context, QueryContext)
+        assert "ALICE" in [row["entity"] for row in context.entities]
+        assert "<hyperedge>met at the lab" in [
+            row["hyperedge"] for row in context.relations
+        ]
+        assert context.sources
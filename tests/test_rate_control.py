@@ -0,0 +1,188 @@
+"""
+Unit tests for the adaptive rate controller
+
+Tests the AIMD window of RateController, its per-minute budgets, and how the
+OpenAI completion wrapper reserves tokens with it.
+"""
+
+import asyncio
+import types
+
+import pytest
+
+from hypergraphrag import llm, utils
+from hypergraphrag.utils import RateController
+
+# Mark all tests in this module as unit tests
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace the monotonic clock and make asyncio.sleep advance it"""
+    now = types.SimpleNamespace(value=1000.0, slept=0.0)
+    monkeypatch.setattr(
+        utils,
+        "time",
+        types.SimpleNamespace(
+            monotonic=lambda: now.value,
+            perf_counter=lambda: now.value,
+            time=lambda: now.value,
+        ),
+    )
+
+    async def sleep(seconds):
+        now.value += seconds
+        now.slept += seconds
+
+    monkeypatch.setattr(utils.asyncio, "sleep", sleep)
+    return now
+
+
+class TestRateController:
+    """Tests for RateController"""
+
+    def test_rate_limit_halves_window(self, clock):
+        """A rate-limit error halves the window, once per decrease_interval"""
+
+        async def run():
+            controller = RateController(max_window=8, decrease_interval=5.0)
+            controller.release(await controller.acquire(), rate_limited=True)
+            assert controller.stats()["window"] == 4
+            assert controller._scheduler.max_size == 4
+
+            controller.release(await controller.acquire(), rate_limited=True)
+            assert controller.stats()["window"] == 4
+
+            clock.value += 6
+            controller.release(await controller.acquire(), rate_limited=True)
+            assert controller.stats()["window"] == 2
+            assert controller.stats()["rate_limited"] == 3
+
+        asyncio.run(run())
+
+    def test_window_never_drops_below_min(self, clock):
+        """Repeated back-off stops at min_window"""
+
+        async def run():
+            controller = RateController(
+                max_window=4, min_window=2, decrease_interval=0.0
+            )
+            for _ in range(5):
+                clock.value += 1
+                controller.release(await controller.acquire(), rate_limited=True)
+            assert controller.stats()["window"] == 2
+
+        asyncio.run(run())
+
+    def test_additive_recovery(self, clock):
+        """Successes grow the window by about one slot per window of calls"""
+
+        async def run():
+            controller = RateController(max_window=8)
+            controller.release(await controller.acquire(), rate_limited=True)
+            assert controller.stats()["window"] == 4
+
+            windows = []
+            for _ in range(30):
+                controller.release(await controller.acquire())
+                windows.append(controller._window)
+            assert windows == sorted(windows)
+            # four successes at a window of four add one slot
+            assert int(windows[4]) == 5
+            assert controller.stats()["window"] == 8
+
+        asyncio.run(run())
+
+    def test_slow_calls_back_off(self, clock):
+        """Calls slower than latency_target shrink the window like a 429"""
+
+        async def run():
+            controller = RateController(max_window=8, latency_target=2.0)
+            ticket = await controller.acquire()
+            clock.value += 1
+            controller.release(ticket)
+            assert controller.stats()["window"] == 8
+
+            ticket = await controller.acquire()
+            clock.value += 3
+            controller.release(ticket)
+            assert controller.stats()["window"] == 4
+
+        asyncio.run(run())
+
+    def test_rpm_budget_throttles(self, clock):
+        """Calls beyond the requests-per-minute budget wait for the oldest to age out"""
+
+        async def run():
+            controller = RateController(rpm=2)
+            for _ in range(2):
+                controller.release(await controller.acquire())
+            clock.value += 10
+            controller.release(await controller.acquire())
+
+            assert clock.slept == pytest.approx(50.0)
+            assert controller.stats()["throttle_time"] == pytest.approx(50.0)
+
+        asyncio.run(run())
+
+    def test_tpm_budget_uses_reported_usage(self, clock):
+        """Reported token usage replaces the estimate in the tokens budget"""
+
+        async def run():
+            controller = RateController(tpm=100)
+            controller.release(await controller.acquire(10), used_tokens=90)
+            assert controller.stats()["tokens_last_minute"] == 90
+
+            controller.release(await controller.acquire(20))
+            assert clock.slept == pytest.approx(60.0)
+            assert controller.stats()["tokens_last_minute"] == 20
+
+        asyncio.run(run())
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.kwargs = None
+
+    async def create(self, model, messages, **kwargs):
+        self.kwargs = kwargs
+        message = types.SimpleNamespace(content="ok")
+        return types.SimpleNamespace(
+            choices=[types.SimpleNamespace(message=message)],
+            usage=types.SimpleNamespace(total_tokens=7),
+        )
+
+
+class TestOpenAICompletionTickets:
+    """Tests for the rate-controller ticket of openai_complete_if_cache"""
+
+    @pytest.mark.parametrize("max_tokens", [None, 50])
+    def test_max_tokens_is_reserved(self, monkeypatch, max_tokens):
+        """max_tokens, when set, is added to the reserved tokens"""
+        completions = FakeCompletions()
+        client = types.SimpleNamespace(
+            chat=types.SimpleNamespace(completions=completions)
+        )
+        monkeypatch.setattr(llm, "get_openai_client", lambda *args: client)
+        controller = RateController()
+        monkeypatch.setattr(llm, "get_rate_controller", lambda *args: controller)
+        reserved = []
+        acquire = controller.acquire
+
+        async def spy(estimated_tokens=0):
+            reserved.append(estimated_tokens)
+            return await acquire(estimated_tokens)
+
+        controller.acquire = spy
+
+        async def run():
+            result = await llm.openai_complete_if_cache(
+                "model", "prompt", max_tokens=max_tokens
+            )
+            assert result == "ok"
+
+        asyncio.run(run())
+        assert reserved == [max_tokens or 0]
+        assert completions.kwargs == {"max_tokens": max_tokens}
+        assert controller.stats()["completed"] == 1
@@ -0,0 +1,383 @@
+"""
+Unit tests for the LLM response cache index
+
+Tests LRU/TTL eviction of ResponseCacheIndex and how its index is persisted,
+and the quantized similarity lookup of SemanticCacheMatrix.
+"""
+
+import asyncio
+import json
+import os
+import types
+
+import numpy as np
+import pytest
+
+from hypergraphrag import utils
+from hypergraphrag.storage import JsonKVStorage, JsonLogKVStorage
+from hypergraphrag.utils import (
+    ResponseCacheIndex,
+    SemanticCacheMatrix,
+    cosine_similarity,
+    dequantize_embedding,
+    get_best_cached_response,
+    quantize_embedding,
+    response_cache,
+)
+
+# Mark all tests in this module as unit tests
+pytestmark = pytest.mark.unit
+
+
+def make_kv(cls, working_dir, **config):
+    return cls(
+        namespace="llm_response_cache",
+        global_config={"working_dir": str(working_dir), **config},
+        embedding_func=None,
+    )
+
+
+def cached_keys(index: ResponseCacheIndex) -> list[str]:
+    return list(index._entries)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace the wall clock used for created_at and TTL checks"""
+    now = types.SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(utils, "time", types.SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+class TestResponseCacheIndex:
+    """Tests for ResponseCacheIndex"""
+
+    def test_lru_eviction_order(self, tmp_path):
+        """The least recently used entry is evicted first"""
+
+        async def run():
+            index = ResponseCacheIndex(
+                make_kv(JsonKVStorage, tmp_path, llm_cache_max_entries=3)
+            )
+            for args_hash in ["a", "b", "c"]:
+                await index.put("default", args_hash, {"return": args_hash})
+            assert (await index.get("default", "a"))["return"] == "a"
+
+            await index.put("default", "d", {"return": "d"})
+            assert cached_keys(index) == ["default:c", "default:a", "default:d"]
+            assert await index.get("default", "b") is None
+            assert await index.kv.get_by_id("default:b") is None
+
+        asyncio.run(run())
+
+    def test_byte_cap(self, tmp_path, clock):
+        """Entries are evicted until the cache fits in llm_cache_max_bytes"""
+
+        async def run():
+            index = ResponseCacheIndex(make_kv(JsonKVStorage, tmp_path))
+            await index.put("default", "a", {"return": "x" * 100})
+            index.max_bytes = index.stats()["bytes"] * 2
+            await index.put("default", "b", {"return": "y" * 100})
+            await index.put("default", "c", {"return": "z" * 100})
+
+            assert cached_keys(index) == ["default:b", "default:c"]
+            assert index.stats()["bytes"] <= index.max_bytes
+
+        asyncio.run(run())
+
+    def test_newest_entry_is_never_evicted(self, tmp_path):
+        """An entry larger than the cap is still kept until the next insert"""
+
+        async def run():
+            index = ResponseCacheIndex(
+                make_kv(JsonKVStorage, tmp_path, llm_cache_max_bytes=10)
+            )
+            await index.put("default", "a", {"return": "x" * 100})
+            assert cached_keys(index) == ["default:a"]
+            await index.put("default", "b", {"return": "y" * 100})
+            assert cached_keys(index) == ["default:b"]
+
+        asyncio.run(run())
+
+    def test_ttl_expiry(self, tmp_path, clock):
+        """Entries older than llm_cache_ttl are misses and are removed"""
+
+        async def run():
+            kv = make_kv(JsonKVStorage, tmp_path, llm_cache_ttl=60)
+            index = ResponseCacheIndex(kv)
+            await index.put("default", "old", {"return": "old"})
+            clock.value += 50
+            await index.put("default", "new", {"return": "new"})
+            clock.value += 20
+
+            assert await index.get("default", "old") is None
+            assert (await index.get("default", "new"))["return"] == "new"
+            assert cached_keys(index) == ["default:new"]
+            clock.value += 60
+            assert await index.records("default") == []
+
+        asyncio.run(run())
+
+    def test_modes_are_separate(self, tmp_path):
+        """The same args hash can be cached under different modes"""
+
+        async def run():
+            index = ResponseCacheIndex(make_kv(JsonKVStorage, tmp_path))
+            await index.put("default", "a", {"return": "1"})
+            await index.put("context", "a", {"return": "2"})
+            await index.drop_mode("context")
+
+            assert (await index.get("default", "a"))["return"] == "1"
+            assert await index.get("context", "a") is None
+
+        asyncio.run(run())
+
+    def test_semantic_hit_refreshes_lru(self, tmp_path):
+        """A similarity hit counts as a use of the matched entry"""
+
+        async def run():
+            kv = make_kv(JsonKVStorage, tmp_path, llm_cache_max_entries=2)
+            index = response_cache(kv)
+            for args_hash, axis in [("a", 0), ("b", 1)]:
+                codes, min_val, max_val = quantize_embedding(np.eye(4)[axis])
+                await index.put(
+                    "default",
+                    args_hash,
+                    {
+                        "return": args_hash,
+                        "embedding": codes.tobytes().hex(),
+                        "embedding_min": float(min_val),
+                        "embedding_max": float(max_val),
+                        "original_prompt": args_hash,
+                    },
+                )
+            hit = await get_best_cached_response(kv, np.eye(4)[0], mode="default")
+            assert hit == "a"
+
+            await index.put("default", "c", {"return": "c"})
+            assert cached_keys(index) == ["default:a", "default:c"]
+
+        asyncio.run(run())
+
+    @pytest.mark.parametrize("cls", [JsonKVStorage, JsonLogKVStorage])
+    def test_reload_reads_only_meta_fields(self, tmp_path, cls, clock):
+        """Reopening restores LRU order from the fields stored in each record"""
+
+        async def run():
+            kv = make_kv(cls, tmp_path, llm_cache_max_entries=3)
+            index = ResponseCacheIndex(kv)
+            for args_hash in ["a", "b", "c"]:
+                clock.value += 1
+                await index.put("default", args_hash, {"return": args_hash})
+            clock.value += 1
+            await index.get("default", "a")
+            await index.save()
+            await kv.index_done_callback()
+            clock.value += 1
+            await index.put("default", "d", {"return": "d"})
+            await index.save()
+            await kv.index_done_callback()
+
+            kv = make_kv(cls, tmp_path, llm_cache_max_entries=3)
+            reads = []
+            get_by_ids = kv.get_by_ids
+
+            async def spy(ids, fields=None):
+                reads.append(fields)
+                return await get_by_ids(ids, fields)
+
+            kv.get_by_ids = spy
+            reopened = ResponseCacheIndex(kv)
+            assert (await reopened.get("default", "c"))["return"] == "c"
+            assert reads == [ResponseCacheIndex.meta_fields]
+            assert cached_keys(reopened) == ["default:a", "default:d", "default:c"]
+            assert reopened.stats()["bytes"] == index.stats()["bytes"]
+
+        asyncio.run(run())
+
+    def test_save_rewrites_only_used_records(self, tmp_path, clock):
+        """A save appends just the records used since the previous one"""
+
+        async def run():
+            kv = make_kv(JsonLogKVStorage, tmp_path)
+            index = ResponseCacheIndex(kv)
+            for args_hash in ["a", "b", "c"]:
+                await index.put("default", args_hash, {"return": args_hash})
+            await index.save()
+            await kv.index_done_callback()
+            log_file = os.path.join(tmp_path, "kv_store_llm_response_cache.log")
+            size = os.path.getsize(log_file)
+
+            clock.value += 1
+            await index.get("default", "b")
+            await index.save()
+            await kv.index_done_callback()
+            with open(log_file, "rb") as f:
+                f.seek(size)
+                appended = [json.loads(line.split(b"\t", 1)[0]) for line in f]
+            assert set(appended) == {"default:b"}
+            assert (await kv.get_by_id("default:b"))["last_used"] == clock.value
+
+        asyncio.run(run())
+
+    def test_reload_without_meta_fields(self, tmp_path):
+        """Records missing the meta fields are read and ordered by insert time"""
+
+        async def run():
+            kv = make_kv(JsonKVStorage, tmp_path)
+            await kv.upsert(
+                {
+                    "default:b": {"return": "b", "created_at": 2.0},
+                    "default:a": {"return": "a", "created_at": 1.0},
+                }
+            )
+            index = ResponseCacheIndex(kv)
+            assert (await index.get("default", "b"))["return"] == "b"
+            assert cached_keys(index) == ["default:a", "default:b"]
+
+            await index.save()
+            assert (await kv.get_by_id("default:a"))["size"] > 0
+
+        asyncio.run(run())
+
+    def test_backend_without_delete_keeps_entries(self, tmp_path):
+        """Eviction is skipped, not failed, on stores that cannot delete"""
+
+        class AppendOnlyKV(JsonKVStorage):
+            async def delete(self, ids):
+                raise NotImplementedError
+
+        async def run():
+            kv = make_kv(AppendOnlyKV, tmp_path, llm_cache_max_entries=1)
+            index = ResponseCacheIndex(kv)
+            await index.put("default", "a", {"return": "a"})
+            await index.put("default", "b", {"return": "b"})
+            await index.put("default", "c", {"return": "c"})
+
+            assert len(await kv.all_keys()) == 3
+            assert (await index.get("default", "c"))["return"] == "c"
+
+        asyncio.run(run())
+
+    def test_migrates_legacy_mode_dicts(self, tmp_path):
+        """The old one-dict-per-mode layout is split into per-entry records"""
+
+        async def run():
+            kv = make_kv(JsonKVStorage, tmp_path)
+            await kv.upsert(
+                {"default": {"h1": {"return": "1"}, "h2": {"return": "2"}}}
+            )
+            index = ResponseCacheIndex(kv)
+
+            assert (await index.get("default", "h2"))["return"] == "2"
+            assert sorted(await kv.all_keys()) == ["default:h1", "default:h2"]
+
+        asyncio.run(run())
+
+
+def random_embeddings(n: int, dim: int = 16, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+
+def add(matrix: SemanticCacheMatrix, key: str, embedding: np.ndarray):
+    matrix.add(key, *quantize_embedding(embedding))
+
+
+class TestSemanticCacheMatrix:
+    """Tests for SemanticCacheMatrix"""
+
+    def test_scores_match_dequantized_cosine(self):
+        """The scale/offset product equals cosine against the decoded rows"""
+        embeddings = random_embeddings(10)
+        matrix = SemanticCacheMatrix(16)
+        for i, embedding in enumerate(embeddings):
+            add(matrix, f"k{i}", embedding)
+
+        query = random_embeddings(1, seed=1)[0]
+        expected = [
+            cosine_similarity(dequantize_embedding(*quantize_embedding(e)), query)
+            for e in embeddings
+        ]
+        key, score = matrix.best(query)
+        assert key == f"k{int(np.argmax(expected))}"
+        assert score == pytest.approx(max(expected), abs=1e-5)
+
+    def test_quantization_keeps_near_duplicates_close(self):
+        """A query equal to a stored embedding scores close to 1"""
+        embeddings = random_embeddings(5)
+        matrix = SemanticCacheMatrix(16)
+        for i, embedding in enumerate(embeddings):
+            add(matrix, f"k{i}", embedding)
+
+        key, score = matrix.best(embeddings[3])
+        assert key == "k3"
+        assert score > 0.99
+
+    def test_blocked_product(self, monkeypatch):
+        """Scoring in blocks gives the same result as one product"""
+        embeddings = random_embeddings(50)
+        matrix = SemanticCacheMatrix(16)
+        for i, embedding in enumerate(embeddings):
+            add(matrix, f"k{i}", embedding)
+        query = random_embeddings(1, seed=2)[0]
+        expected = matrix.best(query)
+
+        monkeypatch.setattr(SemanticCacheMatrix, "block_size", 7)
+        key, score = matrix.best(query)
+        assert key == expected[0]
+        assert score == pytest.approx(expected[1])
+
+    def test_grows_past_capacity(self):
+        """Rows beyond the initial capacity are kept"""
+        embeddings = random_embeddings(10)
+        matrix = SemanticCacheMatrix(16, capacity=2)
+        for i, embedding in enumerate(embeddings):
+            add(matrix, f"k{i}", embedding)
+
+        assert len(matrix) == 10
+        assert matrix.best(embeddings[9])[0] == "k9"
+
+    def test_removed_rows_are_skipped(self):
+        """Removed keys are tombstoned and never returned"""
+        embeddings = random_embeddings(3)
+        matrix = SemanticCacheMatrix(16)
+        for i, embedding in enumerate(embeddings):
+            add(matrix, f"k{i}", embedding)
+        matrix.remove("k1")
+        matrix.remove("missing")
+
+        assert len(matrix) == 2
+        assert matrix.best(embeddings[1])[0] != "k1"
+
+    def test_readd_replaces_row(self):
+        """Adding an existing key replaces its embedding"""
+        embeddings = random_embeddings(2)
+        matrix = SemanticCacheMatrix(16)
+        add(matrix, "k", embeddings[0])
+        add(matrix, "other", embeddings[1])
+        add(matrix, "k", embeddings[1])
+
+        assert len(matrix) == 2
+        assert matrix.best(embeddings[0])[1] < 0.99
+
+    def test_compaction(self):
+        """Tombstones are compacted away once they outnumber live rows"""
+        embeddings = random_embeddings(100)
+        matrix = SemanticCacheMatrix(16)
+        for i, embedding in enumerate(embeddings):
+            add(matrix, f"k{i}", embedding)
+        for i in range(60):
+            matrix.remove(f"k{i}")
+
+        assert len(matrix) == 40
+        assert len(matrix._keys) < 100
+        for i in (60, 75, 99):
+            assert matrix.best(embeddings[i])[0] == f"k{i}"
+
+    def test_empty(self):
+        """An empty matrix has no best match"""
+        matrix = SemanticCacheMatrix(16)
+        assert matrix.best(random_embeddings(1)[0]) == (None, -1.0)
+        add(matrix, "k", random_embeddings(1)[0])
+        matrix.remove("k")
+        assert matrix.best(random_embeddings(1)[0]) == (None, -1.0)
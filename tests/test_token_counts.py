@@ -0,0 +1,92 @@
+"""
+Unit tests for the stored token counts
+
+Tests that inserts store token counts on entity and hyperedge nodes and that
+truncate_list_by_token_size uses stored counts, tokenizing only the rest.
+"""
+
+import asyncio
+
+import pytest
+
+from hypergraphrag import utils
+from hypergraphrag.utils import truncate_list_by_token_size
+
+# Mark all tests in this module as unit tests
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture
+def tokenized(monkeypatch, char_encoder):
+    """Record the texts count_tokens is asked to tokenize"""
+    texts = []
+    count_tokens = utils.count_tokens
+
+    def recorded(contents, *args, **kwargs):
+        texts.extend(contents)
+        return count_tokens(contents, *args, **kwargs)
+
+    monkeypatch.setattr(utils, "count_tokens", recorded)
+    return texts
+
+
+def truncate(items, max_token_size, token_key=None):
+    return truncate_list_by_token_size(
+        items,
+        key=lambda x: x["text"],
+        max_token_size=max_token_size,
+        token_key=token_key,
+    )
+
+
+class TestTruncateListByTokenSize:
+    """Tests for truncate_list_by_token_size"""
+
+    ITEMS = [{"text": "aa"}, {"text": "bbb"}, {"text": "c"}]
+
+    @pytest.mark.parametrize(
+        "max_token_size, kept", [(0, 0), (1, 0), (2, 1), (5, 2), (6, 3), (100, 3)]
+    )
+    def test_keeps_the_prefix_that_fits(self, tokenized, max_token_size, kept):
+        """Items are kept while the running total fits"""
+        assert truncate(self.ITEMS, max_token_size) == self.ITEMS[:kept]
+
+    def test_stored_counts_skip_tokenizing(self, tokenized):
+        """Stored counts are trusted; only items without one are tokenized"""
+        items = [
+            {"text": "aa", "tokens": 10},
+            {"text": "bbb"},
+            {"text": "c", "tokens": 1},
+        ]
+        token_key = lambda x: x.get("tokens")  # noqa: E731
+        assert truncate(items, 13, token_key) == items[:2]
+        assert truncate(items, 12, token_key) == items[:1]
+        assert tokenized == ["bbb", "bbb"]
+
+        tokenized.clear()
+        assert truncate(items[:1], 10, token_key) == items[:1]
+        assert tokenized == []
+
+
+class TestStoredTokenCounts:
+    """Tests for the token counts written at ingest"""
+
+    def test_nodes_store_their_counts(self, make_rag):
+        """Entities store the count of their description, hyperedges of their name"""
+        rag = make_rag().rag
+        rag.insert(["<<met at the lab: ALICE BOB>>", "<<met at the lab: ALICE>>"])
+        graph = rag.chunk_entity_relation_graph
+
+        async def run():
+            alice = await graph.get_node("ALICE")
+            assert alice["description_tokens"] == len(alice["description"])
+            # the hyperedge id is what queries truncate hyperedges by
+            hyperedge_id = "<hyperedge>met at the lab"
+            hyperedge = await graph.get_node(hyperedge_id)
+            assert hyperedge["name_tokens"] == len(hyperedge_id)
+            chunks = await rag.text_chunks.get_by_ids(
+                await rag.text_chunks.all_keys()
+            )
+            assert all(chunk["tokens"] == len(chunk["content"]) for chunk in chunks)
+
+        asyncio.run(run())
@@ -0,0 +1,470 @@
+"""
+Unit tests for the memory-mapped vector storages
+
+Tests persistence, tombstoned deletes and row reuse of MmapVectorDBStorage,
+and the IVF-flat index of IVFVectorDBStorage.
+"""
+
+import asyncio
+import json
+import os
+
+import numpy as np
+import pytest
+
+from hypergraphrag.base import BaseVectorStorage
+from hypergraphrag.storage import (
+    IVFVectorDBStorage,
+    MmapVectorDBStorage,
+    _spherical_kmeans,
+)
+from hypergraphrag.utils import EmbeddingFunc, compute_mdhash_id
+
+# Mark all tests in this module as unit tests
+pytestmark = pytest.mark.unit
+
+DIM = 4
+
+
+def one_hot(i: int) -> list[float]:
+    vector = [0.0] * DIM
+    vector[i % DIM] = 1.0
+    return vector
+
+
+async def embed(texts: list[str]) -> np.ndarray:
+    """Deterministic embedding: ``"<axis>:<anything>"`` maps to a unit axis"""
+    return np.array([one_hot(int(t.split(":", 1)[0])) for t in texts])
+
+
+def make_storage(cls, working_dir, **kwargs):
+    return cls(
+        namespace="entities",
+        global_config={
+            "working_dir": str(working_dir),
+            "embedding_batch_num": 32,
+            "cosine_better_than_threshold": 0.5,
+            "vector_db_storage_cls_kwargs": kwargs,
+        },
+        embedding_func=EmbeddingFunc(
+            embedding_dim=DIM, max_token_size=8192, func=embed
+        ),
+        meta_fields={"entity_name"},
+    )
+
+
+class TestMmapVectorDBStorage:
+    """Tests for MmapVectorDBStorage"""
+
+    def test_reopen_after_write(self, tmp_path):
+        """Vectors and meta fields survive a flush and reopen"""
+
+        async def run():
+            vdb = make_storage(MmapVectorDBStorage, tmp_path)
+            await vdb.upsert(
+                {
+                    "a": {"content": "0:a", "entity_name": "A", "other": 1},
+                    "b": {"content": "1:b", "entity_name": "B"},
+                }
+            )
+            await vdb.index_done_callback()
+
+            reopened = make_storage(MmapVectorDBStorage, tmp_path)
+            results = await reopened.query("0:query", top_k=5)
+            assert [r["id"] for r in results] == ["a"]
+            assert results[0]["entity_name"] == "A"
+            assert "other" not in results[0]
+            assert results[0]["distance"] == pytest.approx(1.0)
+
+        asyncio.run(run())
+
+    def test_float16_storage(self, tmp_path):
+        """The matrix can be stored as float16 and is still searchable"""
+
+        async def run():
+            vdb = make_storage(MmapVectorDBStorage, tmp_path, dtype="float16")
+            await vdb.upsert({f"k{i}": {"content": f"{i}:x"} for i in range(DIM)})
+            await vdb.index_done_callback()
+
+            reopened = make_storage(MmapVectorDBStorage, tmp_path, dtype="float16")
+            assert reopened._matrix.dtype == np.float16
+            results = await reopened.query_batch(["2:q", "3:q"], top_k=1)
+            assert [[r["id"] for r in rs] for rs in results] == [["k2"], ["k3"]]
+
+        asyncio.run(run())
+
+    def test_update_overwrites_row(self, tmp_path):
+        """Upserting an existing id replaces its vector in place"""
+
+        async def run():
+            vdb = make_storage(MmapVectorDBStorage, tmp_path)
+            await vdb.upsert({"a": {"content": "0:a"}})
+            report = await vdb.upsert({"a": {"content": "1:a"}})
+            assert report == {"update": ["a"], "insert": []}
+            assert len(vdb._ids) == 1
+            assert await vdb.query("0:q", top_k=5) == []
+            assert [r["id"] for r in await vdb.query("1:q", top_k=5)] == ["a"]
+
+        asyncio.run(run())
+
+    def test_rows_of_a_multi_insert(self, tmp_path):
+        """Every id inserted in one call maps to its own row"""
+
+        async def run():
+            vdb = make_storage(MmapVectorDBStorage, tmp_path)
+            await vdb.upsert({f"k{i}": {"content": f"{i}:x"} for i in range(3)})
+            assert [vdb._id_to_row[f"k{i}"] for i in range(3)] == [0, 1, 2]
+
+            await vdb.upsert({"k1": {"content": "3:x"}})
+            assert [r["id"] for r in await vdb.query("3:q", top_k=5)] == ["k1"]
+            assert [r["id"] for r in await vdb.query("2:q", top_k=5)] == ["k2"]
+
+        asyncio.run(run())
+
+    def test_deleted_rows_are_tombstoned_until_flush(self, tmp_path):
+        """Deleted rows are hidden from queries and dropped on flush"""
+
+        async def run():
+            vdb = make_storage(MmapVectorDBStorage, tmp_path)
+            entity_id = compute_mdhash_id('"A"', prefix="ent-")
+            await vdb.upsert(
+                {
+                    entity_id: {"content": "0:a"},
+                    "b": {"content": "0:b"},
+                }
+            )
+            await vdb.delete_entity('"A"')
+
+            assert len(vdb._ids) == 2
+            assert [r["id"] for r in await vdb.query("0:q", top_k=5)] == ["b"]
+
+            await vdb.index_done_callback()
+            assert vdb._ids == ["b"]
+            reopened = make_storage(MmapVectorDBStorage, tmp_path)
+            assert reopened._ids == ["b"]
+            assert reopened._matrix.shape == (1, DIM)
+
+        asyncio.run(run())
+
+    def test_delete_then_reinsert_reuses_row(self, tmp_path):
+        """Re-inserting a deleted id before a flush reuses its old row"""
+
+        async def run():
+            vdb = make_storage(MmapVectorDBStorage, tmp_path)
+            await vdb.upsert({"a": {"content": "0:a"}, "b": {"content": "1:b"}})
+            row = vdb._id_to_row["a"]
+            vdb._delete_ids(["a"])
+
+            report = await vdb.upsert({"a": {"content": "2:a"}})
+            assert report == {"update": [], "insert": ["a"]}
+            assert vdb._id_to_row["a"] == row
+            assert len(vdb._ids) == 2
+            assert not vdb._deleted_rows
+            assert [r["id"] for r in await vdb.query("2:q", top_k=5)] == ["a"]
+
+            await vdb.index_done_callback()
+            reopened = make_storage(MmapVectorDBStorage, tmp_path)
+            assert sorted(reopened._ids) == ["a", "b"]
+            assert [r["id"] for r in await reopened.query("2:q", top_k=5)] == ["a"]
+
+        asyncio.run(run())
+
+    def test_delete_relation(self, tmp_path):
+        """Relations touching an entity are tombstoned"""
+
+        async def run():
+            vdb = make_storage(MmapVectorDBStorage, tmp_path)
+            vdb.meta_fields = {"src_id", "tgt_id"}
+            await vdb.upsert(
+                {
+                    "r1": {"content": "0:r1", "src_id": "A", "tgt_id": "B"},
+                    "r2": {"content": "0:r2", "src_id": "C", "tgt_id": "A"},
+                    "r3": {"content": "0:r3", "src_id": "B", "tgt_id": "C"},
+                }
+            )
+            await vdb.delete_relation("A")
+            assert [r["id"] for r in await vdb.query("0:q", top_k=5)] == ["r3"]
+
+        asyncio.run(run())
+
+    def test_flush_fills_spare_rows_in_place(self, tmp_path):
+        """Inserts that fit the file's spare rows do not rewrite the file"""
+
+        async def run():
+            vdb = make_storage(MmapVectorDBStorage, tmp_path)
+            await vdb.upsert({f"k{i}": {"content": f"{i}:x"} for i in range(2)})
+            await vdb.upsert({"k2": {"content": "2:x"}})
+            assert len(vdb._buffer) == 4
+            await vdb.index_done_callback()
+            matrix_file_name = vdb._matrix_file_name
+
+            await vdb.upsert({"k3": {"content": "3:x"}})
+            await vdb.upsert({"k0": {"content": "1:x"}})
+            await vdb.index_done_callback()
+            assert vdb._matrix_file_name == matrix_file_name
+            assert [f for f in os.listdir(tmp_path) if f.endswith(".npy")] == [
+                os.path.basename(matrix_file_name)
+            ]
+
+            reopened = make_storage(MmapVectorDBStorage, tmp_path)
+            assert reopened._matrix.shape == (4, DIM)
+            assert [r["id"] for r in await reopened.query("3:q", top_k=5)] == ["k3"]
+            results = await reopened.query("1:q", top_k=5)
+            assert sorted(r["id"] for r in results) == ["k0", "k1"]
+
+        asyncio.run(run())
+
+    def test_crash_before_meta_keeps_previous_state(self, tmp_path, monkeypatch):
+        """A flush interrupted before the sidecar is replaced loses only itself"""
+
+        async def run():
+            vdb = make_storage(MmapVectorDBStorage, tmp_path)
+            await vdb.upsert({f"k{i}": {"content": f"{i}:x"} for i in range(3)})
+            await vdb.index_done_callback()
+
+            replace = os.replace
+
+            def crash_on_meta(src, dst):
+                if dst == vdb._meta_file_name:
+                    raise OSError("crashed")
+                replace(src, dst)
+
+            monkeypatch.setattr(os, "replace", crash_on_meta)
+            vdb._delete_ids(["k0"])
+            await vdb.upsert({"k3": {"content": "3:x"}})
+            with pytest.raises(OSError):
+                await vdb.index_done_callback()
+            monkeypatch.setattr(os, "replace", replace)
+
+            reopened = make_storage(MmapVectorDBStorage, tmp_path)
+            assert reopened._ids == ["k0", "k1", "k2"]
+            for i in range(3):
+                results = await reopened.query(f"{i}:q", top_k=5)
+                assert [r["id"] for r in results] == [f"k{i}"]
+
+        asyncio.run(run())
+
+    def test_row_count_is_checked_on_load(self, tmp_path):
+        """A sidecar naming more rows than the matrix holds is truncated"""
+
+        async def run():
+            vdb = make_storage(MmapVectorDBStorage, tmp_path)
+            await vdb.upsert({f"k{i}": {"content": f"{i}:x"} for i in range(2)})
+            await vdb.index_done_callback()
+            with open(vdb._meta_file_name) as f:
+                meta = json.load(f)
+            meta["ids"].append("ghost")
+            meta["metadata"].append({})
+            meta["rows"] = 3
+            with open(vdb._meta_file_name, "w") as f:
+                json.dump(meta, f)
+
+            reopened = make_storage(MmapVectorDBStorage, tmp_path)
+            assert reopened._ids == ["k0", "k1"]
+
+        asyncio.run(run())
+
+
+class EchoVectorStorage(BaseVectorStorage):
+    """Text-only backend: returns each query back as its single result"""
+
+    async def query(self, query: str, top_k: int) -> list[dict]:
+        return [{"id": query}]
+
+
+class TestQueryBatch:
+    """Tests for batched vector queries"""
+
+    def test_matches_single_queries(self, tmp_path):
+        """query_batch returns what query returns, in query order"""
+
+        async def run():
+            vdb = make_storage(MmapVectorDBStorage, tmp_path)
+            await vdb.upsert({f"k{i}": {"content": f"{i}:x"} for i in range(DIM)})
+            queries = ["3:q", "0:q", "2:q", "3:again"]
+
+            batched = await vdb.query_batch(queries, top_k=2)
+            single = [await vdb.query(q, top_k=2) for q in queries]
+            assert batched == single
+            assert await vdb.query_batch([], top_k=2) == []
+
+        asyncio.run(run())
+
+    def test_queries_are_embedded_in_batches(self, tmp_path):
+        """Query embeddings are computed embedding_batch_num at a time"""
+
+        async def run():
+            vdb = make_storage(MmapVectorDBStorage, tmp_path)
+            vdb.global_config["embedding_batch_num"] = 2
+            calls = []
+
+            async def counting_embed(texts):
+                calls.append(len(texts))
+                return await embed(texts)
+
+            vdb.embedding_func = EmbeddingFunc(
+                embedding_dim=DIM, max_token_size=8192, func=counting_embed
+            )
+            embeddings = await vdb._embed_queries([f"{i}:q" for i in range(5)])
+            assert calls == [2, 2, 1]
+            assert np.argmax(embeddings, axis=1).tolist() == [0, 1, 2, 3, 0]
+
+        asyncio.run(run())
+
+    def test_base_class_falls_back_to_query(self, tmp_path):
+        """Backends without bulk search answer one query call per string"""
+
+        async def run():
+            vdb = EchoVectorStorage(
+                namespace="entities",
+                global_config={"working_dir": str(tmp_path)},
+                embedding_func=None,
+            )
+            results = await vdb.query_batch(["a", "b"], top_k=1)
+            assert results == [[{"id": "a"}], [{"id": "b"}]]
+            with pytest.raises(NotImplementedError):
+                await vdb.query_embeddings(np.eye(DIM), top_k=1)
+
+        asyncio.run(run())
+
+
+def ivf_storage(working_dir, **kwargs):
+    config = {"ivf_nlist": DIM, "ivf_nprobe": 1, "ivf_min_train_size": 8}
+    return make_storage(IVFVectorDBStorage, working_dir, **{**config, **kwargs})
+
+
+def ivf_data(n_per_axis: int, prefix: str = "k") -> dict:
+    return {
+        f"{prefix}{axis}_{i}": {"content": f"{axis}:{i}"}
+        for axis in range(DIM)
+        for i in range(n_per_axis)
+    }
+
+
+class TestSphericalKMeans:
+    """Tests for the k-means used to train the IVF index"""
+
+    def test_separated_clusters(self):
+        """Well separated directions each get their own unit-norm centroid"""
+        rng = np.random.default_rng(0)
+        vectors = np.concatenate(
+            [
+                np.eye(DIM)[axis] + 0.05 * rng.standard_normal((20, DIM))
+                for axis in range(DIM)
+            ]
+        )
+        vectors /= np.linalg.norm(vectors, axis=-1, keepdims=True)
+        centroids = _spherical_kmeans(vectors, DIM, n_iter=10)
+
+        assert centroids.shape == (DIM, DIM)
+        assert np.allclose(np.linalg.norm(centroids, axis=-1), 1.0, atol=1e-5)
+        assert sorted(np.argmax(centroids, axis=1)) == list(range(DIM))
+
+
+class TestIVFVectorDBStorage:
+    """Tests for IVFVectorDBStorage"""
+
+    def test_brute_force_below_min_train_size(self, tmp_path):
+        """Small stores are not indexed"""
+
+        async def run():
+            vdb = ivf_storage(tmp_path)
+            await vdb.upsert(ivf_data(1))
+            await vdb.index_done_callback()
+
+            assert vdb._lists is None
+            assert not os.path.exists(vdb._index_file_name)
+            assert [r["id"] for r in await vdb.query("2:q", top_k=5)] == ["k2_0"]
+
+        asyncio.run(run())
+
+    def test_index_is_trained_and_reloaded(self, tmp_path):
+        """Once large enough the index is trained, saved and used on reopen"""
+
+        async def run():
+            vdb = ivf_storage(tmp_path)
+            await vdb.upsert(ivf_data(3))
+            await vdb.index_done_callback()
+            assert os.path.exists(vdb._index_file_name)
+
+            reopened = ivf_storage(tmp_path)
+            assert reopened._lists is not None
+            assert reopened._trained_size == 3 * DIM
+            for axis in range(DIM):
+                results = await reopened.query(f"{axis}:q", top_k=10)
+                assert sorted(r["id"] for r in results) == [
+                    f"k{axis}_{i}" for i in range(3)
+                ]
+
+        asyncio.run(run())
+
+    def test_upsert_after_training_joins_a_list(self, tmp_path):
+        """Vectors added to a trained index are found without retraining"""
+
+        async def run():
+            vdb = ivf_storage(tmp_path)
+            await vdb.upsert(ivf_data(3))
+            await vdb.index_done_callback()
+            centroids = vdb._centroids.copy()
+
+            await vdb.upsert({"new": {"content": "1:new"}})
+            assert len(vdb._assign) == len(vdb._ids)
+            results = await vdb.query("1:q", top_k=10)
+            assert "new" in [r["id"] for r in results]
+
+            await vdb.index_done_callback()
+            assert np.array_equal(ivf_storage(tmp_path)._centroids, centroids)
+
+        asyncio.run(run())
+
+    def test_retrain_after_growth(self, tmp_path):
+        """The index is retrained once the store grows by the retrain factor"""
+
+        async def run():
+            vdb = ivf_storage(tmp_path)
+            await vdb.upsert(ivf_data(2))
+            await vdb.index_done_callback()
+            assert vdb._trained_size == 2 * DIM
+
+            await vdb.upsert(ivf_data(2, prefix="more"))
+            await vdb.index_done_callback()
+            assert vdb._trained_size == 4 * DIM
+
+        asyncio.run(run())
+
+    def test_deletes_keep_index_in_sync(self, tmp_path):
+        """Deleted rows leave both the vectors and the saved assignments"""
+
+        async def run():
+            vdb = ivf_storage(tmp_path)
+            await vdb.upsert(ivf_data(3))
+            await vdb.index_done_callback()
+            vdb._delete_ids(["k0_0", "k0_1"])
+            assert [r["id"] for r in await vdb.query("0:q", top_k=10)] == ["k0_2"]
+            await vdb.index_done_callback()
+
+            reopened = ivf_storage(tmp_path)
+            assert len(reopened._assign) == len(reopened._ids) == 3 * DIM - 2
+            assert [r["id"] for r in await reopened.query("0:q", top_k=10)] == [
+                "k0_2"
+            ]
+
+        asyncio.run(run())
+
+    def test_out_of_sync_index_is_rebuilt(self, tmp_path):
+        """An index file that does not match the vectors is ignored and rebuilt"""
+
+        async def run():
+            vdb = ivf_storage(tmp_path)
+            await vdb.upsert(ivf_data(3))
+            await vdb.index_done_callback()
+            index = dict(np.load(vdb._index_file_name))
+            index["assign"] = index["assign"][:-1]
+            np.savez(vdb._index_file_name, **index)
+
+            reopened = ivf_storage(tmp_path)
+            assert reopened._lists is None
+            await reopened.index_done_callback()
+            assert len(ivf_storage(tmp_path)._assign) == 3 * DIM
+
+        asyncio.run(run())